@@ -0,0 +1,276 @@
+from sqlalchemy import select, update, insert, func
+from datetime import date, timedelta
+import bisect
+import logging
+import threading
+import time
+import os
+from db import (
+    session_scope, Task, TaskHistory, AnalyticsWatermark, TaskFlowState,
+    ProjectFlowDaily, ProjectDurationHistogram
+)
+from crud import chunks, now_ts, counter_upsert, dialect_of
+from workflows import get_workflow
+
+# Project analytics (throughput, cumulative flow, time in status, lead/cycle time) read from
+# small per-day rollups. A job folds only the tasks and history rows past a watermark into them,
+# so neither the job nor the queries ever scan task_history as a whole.
+ANALYTICS_REFRESH_SECONDS = int(os.environ.get("ANALYTICS_REFRESH_SECONDS", 60))  # 0 = no background job
+ANALYTICS_BATCH = int(os.environ.get("ANALYTICS_BATCH", 5000))
+# Watermarks assume ids become visible in order, which concurrent writers (e.g. on Postgres) do not
+# guarantee: a row can commit after a higher id was already folded, and would then be skipped for
+# good. So a run only folds up to the newest id whose timestamp is older than this lag; moves and
+# imports commit in short transactions, well within it.
+ANALYTICS_LAG_SECONDS = int(os.environ.get("ANALYTICS_LAG_SECONDS", 30))
+ANALYTICS_MAX_DAYS = 400
+# statuses are per project (workflows.py); these are status categories: cycle time starts the
+# first time a task enters a "doing" status, and entering a "done" status completes it
+START_CATEGORY = "doing"
+DONE_CATEGORY = "done"
+# upper bounds (seconds) of the duration buckets; percentiles are reported as a bucket bound
+DURATION_BUCKETS = (
+    60, 300, 900, 1800, 3600, 2 * 3600, 4 * 3600, 8 * 3600, 86400, 2 * 86400, 3 * 86400, 5 * 86400,
+    7 * 86400, 14 * 86400, 21 * 86400, 30 * 86400, 60 * 86400, 90 * 86400, 180 * 86400, 365 * 86400,
+)
+PERCENTILES = (0.5, 0.85, 0.95)
+
+log = logging.getLogger("analytics")
+
+def day_of(ts: int):
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+def bucket_of(seconds: int):
+    # values above the last bound land in an overflow bucket (index len(DURATION_BUCKETS))
+    return bisect.bisect_left(DURATION_BUCKETS, max(seconds, 0))
+
+def _watermark(db, name: str):
+    last_id = db.query(AnalyticsWatermark.last_id).filter(AnalyticsWatermark.name == name).scalar()
+    if last_id is None:
+        db.add(AnalyticsWatermark(name=name, last_id=0))
+        db.flush()
+        last_id = 0
+    return last_id
+
+def _advance(db, name: str, old: int, new: int):
+    # compare-and-set: a concurrent run that already folded this batch makes ours roll back
+    stmt = update(AnalyticsWatermark).where(AnalyticsWatermark.name == name, AnalyticsWatermark.last_id == old)
+    return db.execute(stmt.values(last_id=new)).rowcount == 1
+
+def _add(table: dict, key, *deltas):
+    current = table.get(key)
+    table[key] = tuple(deltas) if current is None else tuple(a + b for a, b in zip(current, deltas))
+
+def _write_rollups(db, flows: dict, durations: dict):
+    # upserts: two runs folding into the same day cannot both insert the row
+    dialect = dialect_of(db)
+    for (project_id, day, status), (entered, exited) in flows.items():
+        db.execute(counter_upsert(dialect, ProjectFlowDaily, {"project_id": project_id, "day": day, "status": status},
+                                  {"entered": entered, "exited": exited}))
+    for (project_id, day, metric, bucket), (count,) in durations.items():
+        db.execute(counter_upsert(dialect, ProjectDurationHistogram,
+                                  {"project_id": project_id, "day": day, "metric": metric, "bucket": bucket}, {"count": count}))
+
+def _fold_tasks(db, last_id: int, max_id: int, batch_size: int):
+    # the status a task was created in: where its first move started from, or where it still is;
+    # the current workflow's initial status may have changed since
+    first_from = (
+        select(TaskHistory.from_status).where(TaskHistory.task_id == Task.id)
+        .order_by(TaskHistory.changed_at, TaskHistory.id).limit(1).scalar_subquery()
+    )
+    rows = db.execute(
+        select(Task.id, Task.project_id, Task.created_at, func.coalesce(first_from, Task.status))
+        .where(Task.id > last_id, Task.id <= max_id).order_by(Task.id).limit(batch_size)
+    ).all()
+    if not rows:
+        return 0
+    flows, states = {}, []
+    for task_id, project_id, created_at, created_in in rows:
+        initial = created_in or get_workflow(project_id, db).initial
+        states.append({"task_id": task_id, "project_id": project_id, "status": initial,
+                       "entered_at": created_at, "created_at": created_at, "started_at": None})
+        _add(flows, (project_id, day_of(created_at), initial), 1, 0)
+    db.execute(insert(TaskFlowState), states)
+    _write_rollups(db, flows, {})
+    if not _advance(db, "tasks", last_id, rows[-1].id):
+        return None
+    return len(rows)
+
+def _fold_history(db, last_id: int, max_id: int, batch_size: int, tasks_folded: int):
+    rows = db.execute(
+        select(TaskHistory.id, TaskHistory.task_id, TaskHistory.from_status, TaskHistory.to_status, TaskHistory.changed_at)
+        .where(TaskHistory.id > last_id, TaskHistory.id <= max_id).order_by(TaskHistory.id).limit(batch_size)
+    ).all()
+    # a move waits until its task is folded (imported tasks may be newer than their history's timestamps)
+    rows = rows[:next((i for i, r in enumerate(rows) if r.task_id > tasks_folded), len(rows))]
+    if not rows:
+        return 0
+    states = {}
+    for part in chunks(list({r.task_id for r in rows})):
+        for st in db.execute(select(TaskFlowState.__table__).where(TaskFlowState.task_id.in_(part))).mappings():
+            states[st["task_id"]] = dict(st)
+    flows, durations, changed = {}, {}, set()
+    for r in rows:
+        st = states.get(r.task_id)
+        if st is None or r.from_status == r.to_status:
+            continue
+        project_id, day = st["project_id"], day_of(r.changed_at)
+        category = get_workflow(project_id, db).categories.get(r.to_status)
+        _add(flows, (project_id, day, r.from_status), 0, 1)
+        _add(flows, (project_id, day, r.to_status), 1, 0)
+        _add(durations, (project_id, day, f"status:{r.from_status}", bucket_of(r.changed_at - st["entered_at"])), 1)
+        if category == START_CATEGORY and st["started_at"] is None:
+            st["started_at"] = r.changed_at
+        if category == DONE_CATEGORY:
+            _add(durations, (project_id, day, "lead", bucket_of(r.changed_at - st["created_at"])), 1)
+            if st["started_at"] is not None:
+                _add(durations, (project_id, day, "cycle", bucket_of(r.changed_at - st["started_at"])), 1)
+        st["status"], st["entered_at"] = r.to_status, r.changed_at
+        changed.add(r.task_id)
+    if changed:
+        # ORM bulk UPDATE by primary key
+        db.execute(update(TaskFlowState), [
+            {k: states[t][k] for k in ("task_id", "status", "entered_at", "started_at")} for t in changed
+        ])
+    _write_rollups(db, flows, durations)
+    if not _advance(db, "task_history", last_id, rows[-1].id):
+        return None
+    return len(rows)
+
+def refresh_analytics(batch_size: int = ANALYTICS_BATCH, max_batches: int = None, lag: int = ANALYTICS_LAG_SECONDS, *, db):
+    """Fold the tasks and history rows created since the last run (and at least `lag` seconds ago)
+    into the rollups, one short transaction per batch. Returns the number of rows processed."""
+    cutoff = now_ts() - lag
+    history_max = db.query(func.max(TaskHistory.id)).filter(TaskHistory.changed_at <= cutoff).scalar() or 0
+    task_max = db.query(func.max(Task.id)).filter(Task.created_at <= cutoff).scalar() or 0
+    db.commit()
+    processed, batches = 0, 0
+    while max_batches is None or batches < max_batches:
+        # tasks first, so the flow state of every task exists before its moves are folded
+        n = _fold_tasks(db, _watermark(db, "tasks"), task_max, batch_size)
+        if n == 0:
+            n = _fold_history(db, _watermark(db, "task_history"), history_max, batch_size, _watermark(db, "tasks"))
+        if not n:
+            db.rollback()
+            break
+        db.commit()
+        processed += n
+        batches += 1
+    return processed
+
+def _summary(buckets: dict):
+    total = sum(buckets.values())
+    out = {"count": total}
+    for q in PERCENTILES:
+        value, seen = None, 0
+        if total:
+            for bucket in sorted(buckets):
+                seen += buckets[bucket]
+                if seen >= q * total:
+                    value = DURATION_BUCKETS[min(bucket, len(DURATION_BUCKETS) - 1)]
+                    break
+        out[f"p{int(q * 100)}_seconds"] = value
+    return out
+
+def project_analytics(project_id: int, start: date, end: date, db):
+    """Daily throughput and cumulative flow (over the project's workflow statuses) plus duration
+    percentiles for moves in [start, end]."""
+    workflow = get_workflow(project_id, db)
+    done = set(workflow.statuses_in(DONE_CATEGORY))
+    first, last = start.isoformat(), end.isoformat()
+    running = dict.fromkeys(workflow.statuses, 0)
+    for status, net in (
+        db.query(ProjectFlowDaily.status, func.sum(ProjectFlowDaily.entered - ProjectFlowDaily.exited))
+        .filter(ProjectFlowDaily.project_id == project_id, ProjectFlowDaily.day < first)
+        .group_by(ProjectFlowDaily.status)
+    ):
+        running[status] = net
+    by_day = {}
+    for day, status, entered, exited in (
+        db.query(ProjectFlowDaily.day, ProjectFlowDaily.status, ProjectFlowDaily.entered, ProjectFlowDaily.exited)
+        .filter(ProjectFlowDaily.project_id == project_id, ProjectFlowDaily.day >= first, ProjectFlowDaily.day <= last)
+    ):
+        by_day.setdefault(day, []).append((status, entered, exited))
+    throughput, flow = [], []
+    for i in range((end - start).days + 1):
+        day = (start + timedelta(days=i)).isoformat()
+        completed = 0
+        for status, entered, exited in by_day.get(day, ()):
+            running[status] = running.get(status, 0) + entered - exited
+            if status in done:
+                completed += entered
+        throughput.append({"day": day, "completed": completed})
+        flow.append({"day": day, **running})
+    histograms = {}
+    for metric, bucket, count in (
+        db.query(ProjectDurationHistogram.metric, ProjectDurationHistogram.bucket, func.sum(ProjectDurationHistogram.count))
+        .filter(ProjectDurationHistogram.project_id == project_id,
+                ProjectDurationHistogram.day >= first, ProjectDurationHistogram.day <= last)
+        .group_by(ProjectDurationHistogram.metric, ProjectDurationHistogram.bucket)
+    ):
+        histograms.setdefault(metric, {})[bucket] = count
+    watermark = db.query(AnalyticsWatermark.last_id).filter(AnalyticsWatermark.name == "task_history").scalar()
+    as_of = db.query(TaskHistory.changed_at).filter(TaskHistory.id == watermark).scalar() if watermark else None
+    return {
+        "from": first,
+        "to": last,
+        "as_of": as_of,
+        "throughput": throughput,
+        "cumulative_flow": flow,
+        "lead_time": _summary(histograms.pop("lead", {})),
+        "cycle_time": _summary(histograms.pop("cycle", {})),
+        "time_in_status": {m.split(":", 1)[1]: _summary(b) for m, b in sorted(histograms.items())},
+    }
+
+class AnalyticsJob:
+    """Runs refresh_analytics every ANALYTICS_REFRESH_SECONDS in a background thread."""
+    def __init__(self, interval: int = ANALYTICS_REFRESH_SECONDS, batch_size: int = ANALYTICS_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.runs = 0
+        self.processed = 0
+        self.errors = 0
+        self.last_run_ms = 0.0
+
+    def run_once(self):
+        start = time.perf_counter()
+        try:
+            with session_scope() as db:
+                n = refresh_analytics(self.batch_size, db=db)
+        except Exception:
+            self.errors += 1
+            log.exception("analytics refresh failed")
+            return 0
+        self.runs += 1
+        self.processed += n
+        self.last_run_ms = (time.perf_counter() - start) * 1000
+        return n
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        if self.interval > 0 and self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="analytics", daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+            self.thread = None
+
+    def stats(self):
+        return {
+            "enabled": self.interval > 0,
+            "interval": self.interval,
+            "runs": self.runs,
+            "processed": self.processed,
+            "errors": self.errors,
+            "last_run_ms": round(self.last_run_ms, 2),
+        }
+
+analytics_job = AnalyticsJob()
@@ -2,32 +2,189 @@ from fastapi import Depends, HTTPException, status, Header
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import Optional
+from dataclasses import dataclass
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import threading
+import time
 import os
-from db import get_session
-from crud import get_user_by_id as crud_get_user_by_id
-from passlib.context import CryptContext
+from db import get_db, get_async_db, User, ProjectMember
+from crud import get_user_by_id as crud_get_user_by_id, is_project_member, get_task_membership
+import crud_async
 
 SECRET = os.environ.get("JWT_SECRET", "dev_secret")
 EXPIRES_SECONDS = int(os.environ.get("JWT_EXPIRES_SECONDS", 7200))
+PRINCIPAL_CACHE_TTL = int(os.environ.get("PRINCIPAL_CACHE_TTL", 300))
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("PRINCIPAL_CACHE_SIZE", 10000))
+MEMBERSHIP_CACHE_TTL = int(os.environ.get("MEMBERSHIP_CACHE_TTL", 60))
+MEMBERSHIP_CACHE_SIZE = int(os.environ.get("MEMBERSHIP_CACHE_SIZE", 50000))
 
-pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user as seen by route handlers (not bound to any session)."""
+    id: int
+    username: str
+
+class PrincipalCache:
+    """LRU cache of verified tokens; an entry never outlives the token's exp."""
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: int = PRINCIPAL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.tokens_by_user = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.time():
+                self._drop(token)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(token)
+            self.hits += 1
+            return principal
+
+    def put(self, token: str, principal: Principal, exp: int):
+        expires_at = min(time.time() + self.ttl, exp)
+        with self.lock:
+            self.entries[token] = (principal, expires_at)
+            self.entries.move_to_end(token)
+            self.tokens_by_user.setdefault(principal.id, set()).add(token)
+            while len(self.entries) > self.maxsize:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, token: str):
+        principal, _ = self.entries.pop(token)
+        tokens = self.tokens_by_user.get(principal.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self.tokens_by_user[principal.id]
+
+    def invalidate_user(self, user_id: int):
+        with self.lock:
+            for token in list(self.tokens_by_user.get(user_id, ())):
+                self._drop(token)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tokens_by_user.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+principal_cache = PrincipalCache()
+
+# Changed or deleted users are dropped once the transaction commits: dropping them at flush time
+# would let a concurrent request re-cache the still-committed old row.
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _track_changed_principal(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_users", set()).add(target.id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_principals(session):
+    for user_id in session.info.pop("changed_users", ()):
+        principal_cache.invalidate_user(user_id)
 
 def create_access_token(sub: int, username: str, expires_seconds: int = EXPIRES_SECONDS):
     expire = datetime.utcnow() + timedelta(seconds=expires_seconds)
-    payload = {"sub": sub, "username": username, "exp": expire}
+    payload = {"sub": str(sub), "username": username, "exp": expire}
     token = jwt.encode(payload, SECRET, algorithm="HS256")
     return token
 
-def verify_password(plain_password, hashed_password):
-    return pwd_ctx.verify(plain_password, hashed_password)
+class MembershipCache:
+    """Bounded per-process cache of (project_id, user_id) -> is member, plus the task -> project
+    mapping (tasks never change project). The TTL bounds staleness across workers."""
+    def __init__(self, maxsize: int = MEMBERSHIP_CACHE_SIZE, ttl: int = MEMBERSHIP_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.members = OrderedDict()
+        self.task_projects = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _put(self, table: OrderedDict, key, value):
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.maxsize:
+            table.popitem(last=False)
+
+    def is_member(self, project_id: int, user_id: int):
+        """True/False when cached, None on a miss."""
+        with self.lock:
+            entry = self.members.get((project_id, user_id))
+            if entry is None or entry[1] <= time.time():
+                self.misses += 1
+                return None
+            self.members.move_to_end((project_id, user_id))
+            self.hits += 1
+            return entry[0]
+
+    def set_member(self, project_id: int, user_id: int, value: bool):
+        with self.lock:
+            self._put(self.members, (project_id, user_id), (value, time.time() + self.ttl))
+
+    def task_project(self, task_id: int):
+        with self.lock:
+            return self.task_projects.get(task_id)
+
+    def set_task_project(self, task_id: int, project_id: int):
+        with self.lock:
+            self._put(self.task_projects, task_id, project_id)
+
+    def invalidate(self, project_id: int, user_id: int):
+        with self.lock:
+            self.members.pop((project_id, user_id), None)
 
-def get_current_user(authorization: Optional[str] = Header(None)):
+    def clear(self):
+        with self.lock:
+            self.members.clear()
+            self.task_projects.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"members": len(self.members), "tasks": len(self.task_projects), "maxsize": self.maxsize,
+                    "hits": self.hits, "misses": self.misses}
+
+membership_cache = MembershipCache()
+
+# New memberships (create_project, use_invitation) are dropped from the cache once committed,
+# so a concurrent request cannot re-cache the pre-commit state.
+@event.listens_for(ProjectMember, "after_insert")
+def _track_new_member(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("new_members", set()).add((target.project_id, target.user_id))
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_new_members(session):
+    for project_id, user_id in session.info.pop("new_members", ()):
+        membership_cache.invalidate(project_id, user_id)
+
+def _bearer_token(authorization: Optional[str]):
     if authorization is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="missing token")
     parts = authorization.split()
     if len(parts) != 2 or parts[0].lower() != "bearer":
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid auth header")
-    token = parts[1]
+    return parts[1]
+
+def _token_claims(token: str):
+    """(user id, exp) of a valid token."""
     try:
         payload = jwt.decode(token, SECRET, algorithms=["HS256"])
         user_id = payload.get("sub")
@@ -35,9 +192,80 @@ def get_current_user(authorization: Optional[str] = Header(None)):
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid token")
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid token")
-    db = get_session()
-    # Access the User model via db query
-    user = db.query(crud_get_user_by_id.__globals__['User']).get(user_id)
+    return int(user_id), payload["exp"]
+
+def _remember_principal(token: str, user, exp: int):
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="user not found")
-    return user
+    principal = Principal(id=user.id, username=user.username)
+    principal_cache.put(token, principal, exp)
+    return principal
+
+def _require(allowed: bool):
+    if not allowed:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="not a member")
+
+def _remember_task_membership(task_id: int, user_id: int, found):
+    """Cache a get_task_membership result and return whether the user is a member."""
+    if found is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="not_found")
+    project_id, allowed = found
+    membership_cache.set_task_project(task_id, project_id)
+    membership_cache.set_member(project_id, user_id, allowed)
+    return allowed
+
+def _cached_task_membership(task_id: int, user_id: int):
+    project_id = membership_cache.task_project(task_id)
+    return membership_cache.is_member(project_id, user_id) if project_id is not None else None
+
+def get_current_user(authorization: Optional[str] = Header(None), db=Depends(get_db)):
+    token = _bearer_token(authorization)
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    user_id, exp = _token_claims(token)
+    return _remember_principal(token, crud_get_user_by_id(user_id, db=db), exp)
+
+def require_project_member(project_id: int, current_user=Depends(get_current_user), db=Depends(get_db)):
+    """Dependency for project-scoped routes: 403 unless the caller is a member."""
+    allowed = membership_cache.is_member(project_id, current_user.id)
+    if allowed is None:
+        allowed = is_project_member(project_id, current_user.id, db=db)
+        membership_cache.set_member(project_id, current_user.id, allowed)
+    _require(allowed)
+    return current_user
+
+def require_task_member(task_id: int, current_user=Depends(get_current_user), db=Depends(get_db)):
+    """Dependency for task-scoped routes: 404 for unknown tasks, 403 unless the caller is a member
+    of the task's project. Costs at most one indexed query."""
+    allowed = _cached_task_membership(task_id, current_user.id)
+    if allowed is None:
+        allowed = _remember_task_membership(task_id, current_user.id, get_task_membership(task_id, current_user.id, db=db))
+    _require(allowed)
+    return current_user
+
+# The same dependencies for async routes: their lookups run on the request's AsyncSession, so an
+# async route uses one session (one unit of work) for authentication and its own queries.
+async def get_current_user_async(authorization: Optional[str] = Header(None), adb=Depends(get_async_db)):
+    token = _bearer_token(authorization)
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    user_id, exp = _token_claims(token)
+    return _remember_principal(token, await crud_async.get_user_by_id(user_id, db=adb), exp)
+
+async def require_project_member_async(project_id: int, current_user=Depends(get_current_user_async), adb=Depends(get_async_db)):
+    allowed = membership_cache.is_member(project_id, current_user.id)
+    if allowed is None:
+        allowed = await crud_async.is_project_member(project_id, current_user.id, db=adb)
+        membership_cache.set_member(project_id, current_user.id, allowed)
+    _require(allowed)
+    return current_user
+
+async def require_task_member_async(task_id: int, current_user=Depends(get_current_user_async), adb=Depends(get_async_db)):
+    allowed = _cached_task_membership(task_id, current_user.id)
+    if allowed is None:
+        found = await crud_async.get_task_membership(task_id, current_user.id, db=adb)
+        allowed = _remember_task_membership(task_id, current_user.id, found)
+    _require(allowed)
+    return current_user
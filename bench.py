@@ -0,0 +1,354 @@
+"""Local load-testing / latency benchmark for the API hot paths.
+
+Seeds a dataset, drives the ASGI app in-process with concurrent requests and
+writes throughput, latency percentiles, SQL statements per request and peak
+memory to a JSON file.
+
+Usage:
+  python bench.py run [--tasks 5000 --concurrency 16 --requests 500 ...] --out bench.json
+  python bench.py startup [--repeat 5] --out startup.json
+  python bench.py compare baseline.json candidate.json [--threshold 0.10]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from sqlalchemy import event
+
+def percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+class QueryCounter:
+    """Counts statements on the sync engine and on the async engine's sync core."""
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+    def attach(self, *engines):
+        for e in engines:
+            event.listen(e, "before_cursor_execute", self)
+
+class MemoryProbe:
+    """Peak memory of a scenario: Python allocations with tracemalloc (exact but slows the
+    run down, so latencies are not comparable), otherwise the process max RSS."""
+    def __init__(self, use_tracemalloc: bool = False):
+        self.use_tracemalloc = use_tracemalloc
+        self.peak_kb = 0.0
+
+    def __enter__(self):
+        if self.use_tracemalloc:
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.use_tracemalloc:
+            self.peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+        else:
+            self.peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return False
+
+def seed(users: int, projects: int, tasks: int, history: int, password: str):
+    """Create users (one shared bcrypt hash), projects with every user as member, tasks and
+    `history` moves per task. Returns {"users": [(id, username)], "projects": [ids], "tasks": [ids]}."""
+    from db import session_scope, User, ProjectMember
+    from crud import create_project, bulk_create_tasks, bulk_move_tasks
+    from hashing import hash_password
+    pw_hash = hash_password(password)
+    out = {"users": [], "projects": [], "tasks": []}
+    with session_scope() as db:
+        db.bulk_insert_mappings(User, [{"username": f"bench{i}", "password_hash": pw_hash} for i in range(users)])
+        db.flush()
+        out["users"] = [(u.id, u.username) for u in db.query(User.id, User.username).filter(User.username.like("bench%"))]
+        owner_id = out["users"][0][0]
+        for p in range(projects):
+            pid = create_project(f"bench project {p}", owner_id, db=db).id
+            out["projects"].append(pid)
+            db.bulk_insert_mappings(ProjectMember, [{"project_id": pid, "user_id": uid, "role": "member"} for uid, _ in out["users"][1:]])
+        db.commit()
+        per_project = max(1, tasks // max(1, projects))
+        for pid in out["projects"]:
+            for start in range(0, per_project, 1000):
+                items = [{"title": f"task {i}", "description": "x" * 200} for i in range(start, min(per_project, start + 1000))]
+                out["tasks"] += [r["id"] for r in bulk_create_tasks(pid, items, db=db)]
+        cycle = ["doing", "done", "todo"]
+        for h in range(history):
+            for start in range(0, len(out["tasks"]), 1000):
+                moves = [{"task_id": tid, "to_status": cycle[h % 3]} for tid in out["tasks"][start:start + 1000]]
+                bulk_move_tasks(moves, owner_id, db=db)
+    return out
+
+async def drive(client, make_request, n: int, concurrency: int):
+    latencies, errors = [], 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors
+        async with sem:
+            method, url, kwargs = make_request(i)
+            t0 = time.perf_counter()
+            r = await client.request(method, url, **kwargs)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if r.status_code >= 400:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return latencies, errors, time.perf_counter() - t0
+
+def summarize(latencies, errors, elapsed, queries, peak_kb):
+    ordered = sorted(latencies)
+    n = len(ordered)
+    return {
+        "requests": n,
+        "errors": errors,
+        "throughput_rps": round(n / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50), 2),
+        "p90_ms": round(percentile(ordered, 0.90), 2),
+        "p99_ms": round(percentile(ordered, 0.99), 2),
+        "max_ms": round(ordered[-1], 2) if ordered else 0.0,
+        "queries_per_request": round(queries / n, 2) if n else 0.0,
+        "peak_mem_kb": round(peak_kb, 1),
+    }
+
+async def bench_sse_fanout(notifier, subscribers: int, events: int):
+    """Publish-to-receive latency through the notifier for `subscribers` project streams."""
+    from notifier import project_topic
+    subs = [notifier.subscribe([project_topic(1)]) for _ in range(subscribers)]
+    latencies = []
+
+    async def consume(sub):
+        for _ in range(events):
+            item = await sub.get(timeout=10)
+            if item is None:
+                return
+            latencies.append((time.perf_counter() - item[1]["sent"]) * 1000)
+
+    consumers = [asyncio.create_task(consume(s)) for s in subs]
+    t0 = time.perf_counter()
+    for i in range(events):
+        notifier.publish({"type": "bench", "sent": time.perf_counter()}, [project_topic(1)])
+        await asyncio.sleep(0)
+    await asyncio.gather(*consumers)
+    elapsed = time.perf_counter() - t0
+    for s in subs:
+        notifier.unsubscribe(s)
+    return latencies, subscribers * events - len(latencies), elapsed
+
+async def run_http_scenarios(app, counter, users, projects, tasks, args):
+    import httpx
+    results = {}
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        tokens = []
+        for _, username in users[:args.concurrency]:
+            r = await client.post("/auth/login", json={"username": username, "password": "benchpw"})
+            tokens.append(r.json()["token"])
+
+        def auth(i):
+            return {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+
+        statuses = ["doing", "done", "todo"]
+        scenarios = {
+            "login": (lambda i: ("POST", "/auth/login", {"json": {"username": users[i % len(users)][1], "password": "benchpw"}}), max(1, args.requests // 10)),
+            "list_tasks": (lambda i: ("GET", f"/tasks/{projects[i % len(projects)]}/tasks", {"headers": auth(i)}), args.requests),
+            "move_task": (lambda i: ("PATCH", f"/tasks/move/{tasks[i % len(tasks)]}", {"json": {"to_status": statuses[i % 3]}, "headers": auth(i)}), args.requests),
+            "report": (lambda i: ("GET", f"/projects/{projects[i % len(projects)]}/report", {"headers": auth(i)}), args.requests),
+        }
+        for name, (make_request, n) in scenarios.items():
+            if args.only and name not in args.only:
+                continue
+            counter.count = 0
+            with MemoryProbe(args.tracemalloc) as mem:
+                latencies, errors, elapsed = await drive(client, make_request, n, args.concurrency)
+            results[name] = summarize(latencies, errors, elapsed, counter.count, mem.peak_kb)
+            print(f"{name:12s} {results[name]}")
+    return results
+
+async def run_scenarios(args):
+    import db as db_module
+    from main import app, notifier
+    from notification_writer import notification_writer
+    counter = QueryCounter()
+    counter.attach(db_module.engine, db_module.init_async_db().sync_engine)
+    data = seed(args.users, args.projects, args.tasks, args.history, "benchpw")
+    users, projects, tasks = data["users"], data["projects"], data["tasks"]
+
+    results = {}
+    # measure the production write path even when NOTIFICATION_WRITE_MODE=sync (tests)
+    previous_mode, notification_writer.mode = notification_writer.mode, "background"
+    try:
+        results.update(await run_http_scenarios(app, counter, users, projects, tasks, args))
+    finally:
+        notification_writer.close()
+        notification_writer.mode = previous_mode
+
+    if not args.only or "sse_fanout" in args.only:
+        with MemoryProbe(args.tracemalloc) as mem:
+            latencies, errors, elapsed = await bench_sse_fanout(notifier, args.subscribers, args.events)
+        results["sse_fanout"] = summarize(latencies, errors, elapsed, 0, mem.peak_kb)
+        print(f"{'sse_fanout':12s} {results['sse_fanout']}")
+    return results
+
+def cmd_run(args):
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    db_url = args.db or f"sqlite:///{os.path.join(workdir, 'bench.sqlite')}"
+    from db import init_db
+    import main  # noqa: F401  (import the app before pointing it at the benchmark DB)
+    init_db(db_url, create_schema=True)
+    results = asyncio.run(run_scenarios(args))
+    report = {
+        "meta": {
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "db": db_url,
+            "users": args.users, "projects": args.projects, "tasks": args.tasks, "history": args.history,
+            "concurrency": args.concurrency, "requests": args.requests,
+            "subscribers": args.subscribers, "events": args.events,
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        },
+        "scenarios": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.out}")
+    return 0
+
+DDL_PREFIXES = ("CREATE", "ALTER", "DROP")
+
+async def _startup_probe():
+    # runs in a fresh interpreter (see cmd_startup), so the import is really cold
+    from sqlalchemy.engine import Engine
+    import httpx
+    statements = {"all": 0, "ddl": 0}
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def count(conn, cursor, statement, *args):
+        statements["all"] += 1
+        statements["ddl"] += statement.lstrip().upper().startswith(DDL_PREFIXES)
+
+    t0 = time.perf_counter()
+    from main import app
+    t1 = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        t2 = time.perf_counter()
+        async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+            resp = await client.get("/health/db")
+        t3 = time.perf_counter()
+    return {
+        "import_ms": round((t1 - t0) * 1000, 2),
+        "startup_ms": round((t2 - t1) * 1000, 2),
+        "first_request_ms": round((t3 - t2) * 1000, 2),
+        "statements": statements["all"],
+        "ddl_statements": statements["ddl"],
+        "status": resp.status_code,
+    }
+
+def cmd_startup_probe(args):
+    print(json.dumps(asyncio.run(_startup_probe())))
+    return 0
+
+def cmd_startup(args):
+    """Cold start of a worker against an already migrated database: import time, lifespan
+    startup, first request and the statements run meanwhile (median of --repeat processes)."""
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    db_url = args.db or f"sqlite:///{os.path.join(workdir, 'bench.sqlite')}"
+    from db import init_db
+    init_db(db_url, create_schema=True)
+    env = {**os.environ, "DB_FILE": db_url, "DB_AUTO_MIGRATE": "0"}
+    runs = []
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "startup-probe"], env=env,
+                             capture_output=True, text=True, check=True)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    result = {k: statistics.median(r[k] for r in runs) for k in runs[0] if k != "status"}
+    result["errors"] = sum(r["status"] != 200 for r in runs)
+    print(f"{'startup':12s} {result}")
+    report = {
+        "meta": {"timestamp": int(time.time()), "python": platform.python_version(), "db": db_url, "repeat": args.repeat},
+        "scenarios": {"startup": result},
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.out}")
+    return 0
+
+# metric -> True when a higher value is better
+COMPARED_METRICS = {
+    "throughput_rps": True, "p50_ms": False, "p99_ms": False, "queries_per_request": False,
+    "import_ms": False, "startup_ms": False, "first_request_ms": False,
+}
+
+def compare(baseline: dict, candidate: dict, threshold: float):
+    """Returns a list of (scenario, metric, base, new, change) rows that regressed by more than threshold."""
+    regressions = []
+    for name, base in baseline["scenarios"].items():
+        new = candidate["scenarios"].get(name)
+        if new is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            b, n = base.get(metric), new.get(metric)
+            if not b or n is None:
+                continue
+            change = (n - b) / b
+            if (higher_is_better and change < -threshold) or (not higher_is_better and change > threshold):
+                regressions.append((name, metric, b, n, round(change, 3)))
+    return regressions
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    regressions = compare(baseline, candidate, args.threshold)
+    for name, metric, b, n, change in regressions:
+        print(f"REGRESSION {name}.{metric}: {b} -> {n} ({change:+.1%})")
+    if not regressions:
+        print("no regressions")
+    return 1 if regressions else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API benchmark harness")
+    sub = parser.add_subparsers(dest="command", required=True)
+    r = sub.add_parser("run")
+    r.add_argument("--db", default=None, help="database URL (default: fresh SQLite file in a temp dir)")
+    r.add_argument("--users", type=int, default=50)
+    r.add_argument("--projects", type=int, default=5)
+    r.add_argument("--tasks", type=int, default=5000)
+    r.add_argument("--history", type=int, default=2, help="moves per task to pre-populate task_history")
+    r.add_argument("--concurrency", type=int, default=16)
+    r.add_argument("--requests", type=int, default=500)
+    r.add_argument("--subscribers", type=int, default=200)
+    r.add_argument("--events", type=int, default=50)
+    r.add_argument("--only", nargs="*", default=None, help="subset of scenarios to run")
+    r.add_argument("--tracemalloc", action="store_true", help="measure Python allocations instead of max RSS")
+    r.add_argument("--out", default="bench.json")
+    r.set_defaults(func=cmd_run)
+    s = sub.add_parser("startup")
+    s.add_argument("--db", default=None, help="database URL (default: fresh SQLite file in a temp dir)")
+    s.add_argument("--repeat", type=int, default=5)
+    s.add_argument("--out", default="startup.json")
+    s.set_defaults(func=cmd_startup)
+    p = sub.add_parser("startup-probe", help=argparse.SUPPRESS)
+    p.set_defaults(func=cmd_startup_probe)
+    c = sub.add_parser("compare")
+    c.add_argument("baseline")
+    c.add_argument("candidate")
+    c.add_argument("--threshold", type=float, default=0.10)
+    c.set_defaults(func=cmd_compare)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
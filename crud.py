@@ -1,38 +1,51 @@
 from db import (
-    get_session, User, Project, ProjectMember, Invitation,
-    Task, TaskHistory, Notification
+    User, Project, ProjectMember, Invitation,
+    Task, TaskHistory, Notification, ProjectStatusCount, NotificationUnreadCount, VersionStamp,
+    WorkflowStatus, WorkflowTransition
 )
-from passlib.context import CryptContext
+from sqlalchemy import func, update, insert, select, delete, and_, or_
+from sqlalchemy.dialects import sqlite, postgresql
+from hashing import hash_password
+from workflows import DEFAULT_STATUSES, get_workflow, validate_workflow, track_workflow_change
+import search
 from datetime import datetime
 import secrets
+import time
+import os
 
-pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# read /projects/{id}/report from the materialized counters instead of aggregating tasks
+REPORT_COUNTERS = os.environ.get("REPORT_COUNTERS", "1") == "1"
+MAX_BULK_ITEMS = int(os.environ.get("MAX_BULK_ITEMS", 5000))
+# keep IN (...) lists well under SQLite's bound-parameter limit
+IN_CHUNK = 900
 
 def now_ts():
     return int(datetime.utcnow().timestamp())
 
 # Users
-def create_user(username: str, password: str, db=None):
-    db = db or get_session()
+def create_user(username: str, password: str, password_hash: str = None, *, db):
+    """password_hash skips hashing here (the async routes hash off the event loop)."""
     if db.query(User).filter(User.username == username).first():
         raise ValueError("username exists")
-    u = User(username=username, password_hash=pwd_ctx.hash(password))
+    u = User(username=username, password_hash=password_hash or hash_password(password))
     db.add(u)
     db.commit()
     db.refresh(u)
     return u
 
-def get_user_by_username(username: str, db=None):
-    db = db or get_session()
+def get_user_by_username(username: str, db):
     return db.query(User).filter(User.username == username).first()
 
-def get_user_by_id(user_id: int, db=None):
-    db = db or get_session()
+def get_user_by_id(user_id: int, db):
     return db.query(User).get(user_id)
 
+def update_password_hash(user, password_hash: str, db):
+    user.password_hash = password_hash
+    db.commit()
+    return user
+
 # Projects
-def create_project(name: str, owner_id: int, db=None):
-    db = db or get_session()
+def create_project(name: str, owner_id: int, db):
     p = Project(name=name, owner_id=owner_id)
     db.add(p)
     db.commit()
@@ -40,17 +53,69 @@ def create_project(name: str, owner_id: int, db=None):
     # add owner as member
     pm = ProjectMember(project_id=p.id, user_id=owner_id, role="owner")
     db.add(pm)
+    bump_version("user", owner_id, db=db)
     db.commit()
     return p
 
-def get_user_projects(user_id: int, db=None):
-    db = db or get_session()
+def get_user_projects(user_id: int, db):
     rows = db.query(Project).join(ProjectMember, ProjectMember.project_id == Project.id).filter(ProjectMember.user_id == user_id).all()
     return rows
 
+def is_project_member(project_id: int, user_id: int, db):
+    return db.query(ProjectMember.id).filter(ProjectMember.project_id == project_id, ProjectMember.user_id == user_id).first() is not None
+
+def get_task_project_id(task_id: int, db):
+    return db.execute(select(Task.project_id).where(Task.id == task_id)).scalar()
+
+def get_task_membership(task_id: int, user_id: int, db):
+    """One indexed lookup: (project_id, is_member) for the task, or None if it does not exist."""
+    row = (
+        db.query(Task.project_id, ProjectMember.id)
+        .outerjoin(ProjectMember, and_(ProjectMember.project_id == Task.project_id, ProjectMember.user_id == user_id))
+        .filter(Task.id == task_id)
+        .first()
+    )
+    if row is None:
+        return None
+    return row[0], row[1] is not None
+
+def is_project_owner(project_id: int, user_id: int, db):
+    return db.query(Project.owner_id).filter(Project.id == project_id).scalar() == user_id
+
+# Workflows (compiled and cached by workflows.py)
+def save_workflow(project_id: int, statuses: list, transitions: dict = None, *, db):
+    """Replace the project's workflow. statuses: dicts with name, category and wip_limit in board
+    order; transitions: status -> statuses it may move to (omitted statuses are final; None allows
+    every move). Fails with reason "invalid", or "in_use" while tasks are in a status it drops."""
+    error = validate_workflow(statuses, transitions)
+    if error is not None:
+        return {"ok": False, "reason": "invalid", "detail": error}
+    names = [s["name"] for s in statuses]
+    in_use = db.execute(
+        select(Task.status).where(Task.project_id == project_id, Task.status.notin_(names)).distinct()
+    ).scalars().all()
+    if in_use:
+        return {"ok": False, "reason": "in_use", "statuses": sorted(in_use)}
+    if transitions is None:
+        pairs = [(a, b) for a in names for b in names if a != b]
+    else:
+        pairs = sorted({(a, b) for a, targets in transitions.items() for b in targets if a != b})
+    db.execute(delete(WorkflowTransition).where(WorkflowTransition.project_id == project_id))
+    db.execute(delete(WorkflowStatus).where(WorkflowStatus.project_id == project_id))
+    db.execute(insert(WorkflowStatus), [
+        {"project_id": project_id, "name": st["name"], "position": i, "category": st["category"], "wip_limit": st.get("wip_limit")}
+        for i, st in enumerate(statuses)
+    ])
+    if pairs:
+        db.execute(insert(WorkflowTransition), [{"project_id": project_id, "from_status": a, "to_status": b} for a, b in pairs])
+    track_workflow_change(db, project_id)
+    # reports and task lists follow the workflow
+    bump_version("project", project_id, db=db)
+    db.commit()
+    return {"ok": True}
+
 # Invitations
-def create_invitation(project_id: int, created_by: int, ttl_seconds: int = 24*3600, db=None):
-    db = db or get_session()
+def create_invitation(project_id: int, created_by: int, ttl_seconds: int = 24*3600, *, db):
     token = secrets.token_hex(16)
     expires_at = now_ts() + ttl_seconds
     inv = Invitation(project_id=project_id, token=token, expires_at=expires_at, created_by=created_by, used=False)
@@ -59,69 +124,492 @@ def create_invitation(project_id: int, created_by: int, ttl_seconds: int = 24*36
     db.refresh(inv)
     return inv
 
-def use_invitation(token: str, user_id: int, db=None):
-    db = db or get_session()
+def use_invitation(token: str, user_id: int, db):
     inv = db.query(Invitation).filter(Invitation.token == token, Invitation.used == False).first()
     if not inv:
         return {"ok": False, "reason": "invalid"}
     if inv.expires_at < now_ts():
         return {"ok": False, "reason": "expired"}
-    # add membership
-    pm = ProjectMember(project_id=inv.project_id, user_id=user_id, role="member")
-    db.add(pm)
+    # add membership (once: (project_id, user_id) is unique)
+    if not is_project_member(inv.project_id, user_id, db=db):
+        db.add(ProjectMember(project_id=inv.project_id, user_id=user_id, role="member"))
+        bump_version("user", user_id, db=db)
+        bump_version("project", inv.project_id, db=db)
     inv.used = True
     db.commit()
     return {"ok": True, "project_id": inv.project_id}
 
 # Tasks
-def create_task(project_id: int, title: str, description: str = "", assignee_id: int = None, db=None):
-    db = db or get_session()
-    t = Task(project_id=project_id, title=title, description=description, status="todo", assignee_id=assignee_id, created_at=now_ts(), updated_at=now_ts())
+def create_task(project_id: int, title: str, description: str = "", assignee_id: int = None, *, db):
+    status = get_workflow(project_id, db).initial
+    t = Task(project_id=project_id, title=title, description=description, status=status, assignee_id=assignee_id, created_at=now_ts(), updated_at=now_ts())
     db.add(t)
+    bump_status_count(project_id, status, 1, db=db)
+    bump_version("project", project_id, db=db)
+    db.flush()
+    index_tasks([search_row(t.id, project_id, t.title, t.description)], db=db)
     db.commit()
     db.refresh(t)
     return t
 
-def get_project_tasks(project_id: int, db=None):
-    db = db or get_session()
-    return db.query(Task).filter(Task.project_id == project_id).all()
+# Search (see search.py): the index is written in the same transaction as the tasks
+def search_row(task_id: int, project_id: int, title: str, description: str):
+    return {"id": task_id, "project_id": project_id, "title": title, "description": description or ""}
+
+def search_rows(ids, rows):
+    return [search_row(i, r["project_id"], r["title"], r["description"]) for i, r in zip(ids, rows)]
+
+def index_tasks(rows: list, db):
+    stmt = search.backend.index_statement()
+    if stmt is not None and rows:
+        db.execute(stmt, rows)
+
+def search_tasks(project_id: int, query: str, status: str = None, assignee_id: int = None,
+                 limit: int = 100, offset: int = 0, *, db):
+    """Ranked matches of every word of `query` in the project's task titles/descriptions
+    (best first; `rank` is None on the LIKE backend). None when the query has no words."""
+    terms = search.parse_terms(query)
+    if not terms:
+        return None
+    return db.execute(search.backend.search_statement(project_id, terms, status, assignee_id, limit, offset)).all()
+
+def rebuild_search_index(db):
+    n = search.backend.rebuild(db)
+    db.commit()
+    return n
+
+def get_project_tasks(project_id: int, limit: int = None, cursor: int = None, *, db):
+    """Tasks ordered by id; `cursor` is the last id of the previous page."""
+    q = db.query(Task.id, Task.title, Task.status, Task.version).filter(Task.project_id == project_id)
+    if cursor is not None:
+        q = q.filter(Task.id > cursor)
+    q = q.order_by(Task.id.asc())
+    if limit is not None:
+        q = q.limit(limit)
+    return q.all()
 
-def move_task(task_id: int, to_status: str, changed_by: int, db=None):
-    db = db or get_session()
-    task = db.query(Task).get(task_id)
-    if not task:
+# Moves are compare-and-set: the UPDATE only matches the state the move was planned from, so
+# concurrent moves of a task serialize on its row and history records the real previous status.
+MOVE_RETRIES = 3
+
+def task_state_stmt(task_id: int):
+    return select(Task.project_id, Task.status, Task.version).where(Task.id == task_id)
+
+def move_stmt(task_id: int, to_status: str, from_status: str, version: int = None):
+    stmt = update(Task).where(Task.id == task_id, Task.status == from_status)
+    if version is not None:
+        stmt = stmt.where(Task.version == version)
+    return (
+        stmt.values(status=to_status, updated_at=now_ts(), version=Task.version + 1)
+        .returning(Task.project_id, Task.version)
+        .execution_options(synchronize_session=False)
+    )
+
+def move_failure(state):
+    if state is None:
         return {"ok": False, "reason": "not_found"}
-    from_status = task.status
-    task.status = to_status
-    task.updated_at = now_ts()
-    db.add(task)
-    # history
-    h = TaskHistory(task_id=task.id, from_status=from_status, to_status=to_status, changed_by=changed_by, changed_at=now_ts())
-    db.add(h)
+    return {"ok": False, "reason": "conflict", "status": state.status, "version": state.version}
+
+def move_history_stmt(task_id: int, from_status: str, to_status: str, changed_by: int):
+    return insert(TaskHistory).values(task_id=task_id, from_status=from_status, to_status=to_status,
+                                      changed_by=changed_by, changed_at=now_ts())
+
+def workflow_failure(workflow, from_status: str, to_status: str):
+    """The failed result when the project's workflow does not allow the move, else None."""
+    if not workflow.has(to_status):
+        return {"ok": False, "reason": "invalid_status"}
+    if not workflow.allows(from_status, to_status):
+        return {"ok": False, "reason": "transition_not_allowed", "status": from_status,
+                "allowed": [s for s in workflow.statuses if workflow.allows(from_status, s) and s != from_status]}
+    return None
+
+def wip_failure(workflow, to_status: str):
+    return {"ok": False, "reason": "wip_limit", "status": to_status, "limit": workflow.wip_limits[to_status]}
+
+def move_task(task_id: int, to_status: str, changed_by: int, expected_status: str = None,
+              expected_version: int = None, workflow=None, *, db):
+    """Move a task unless it changed meanwhile. With expected_status this is a single conditional
+    UPDATE; otherwise the current state is read and the UPDATE is conditioned on it, retried up
+    to MOVE_RETRIES times if another move gets in between. A failed expectation returns reason
+    "conflict" with the current status and version. The project's workflow (passed in, or looked
+    up) is checked against the state the UPDATE replaced, and the WIP limit of the target status
+    is enforced by the counter increment in the same transaction."""
+    row = None
+    for _ in range(MOVE_RETRIES):
+        if expected_status is not None:
+            from_status, version = expected_status, expected_version
+        else:
+            state = db.execute(task_state_stmt(task_id)).first()
+            if state is None or (expected_version is not None and state.version != expected_version):
+                return move_failure(state)
+            from_status, version = state.status, state.version
+        row = db.execute(move_stmt(task_id, to_status, from_status, version)).first()
+        if row is not None or expected_status is not None:
+            break
+        db.rollback()
+    if row is None:
+        db.rollback()
+        return move_failure(db.execute(task_state_stmt(task_id)).first())
+    project_id, version = row
+    workflow = workflow or get_workflow(project_id, db)
+    failure = workflow_failure(workflow, from_status, to_status)
+    if failure is None and from_status != to_status:
+        if bump_status_count(project_id, to_status, 1, limit=workflow.wip_limits.get(to_status), db=db):
+            bump_status_count(project_id, from_status, -1, db=db)
+        else:
+            failure = wip_failure(workflow, to_status)
+    if failure is not None:
+        db.rollback()
+        return failure
+    db.execute(move_history_stmt(task_id, from_status, to_status, changed_by))
+    bump_version("project", project_id, db=db)
     db.commit()
-    return {"ok": True, "from": from_status, "to": to_status}
+    return {"ok": True, "from": from_status, "to": to_status, "project_id": project_id, "version": version}
+
+# Bulk operations: planning is split from execution so it stays a pure, testable function
+def plan_bulk_create(project_id: int, items: list, status: str):
+    """Returns (results, rows): one result per item, rows to insert (in `status`) for the valid ones."""
+    results, rows, ts = [], [], now_ts()
+    for i, item in enumerate(items):
+        title = (item.get("title") or "").strip()
+        if not title:
+            results.append({"index": i, "ok": False, "reason": "empty_title"})
+        elif len(title) > 300:
+            results.append({"index": i, "ok": False, "reason": "title_too_long"})
+        else:
+            results.append({"index": i, "ok": True})
+            rows.append({"project_id": project_id, "title": title, "description": item.get("description") or "",
+                         "status": status, "assignee_id": item.get("assignee_id"), "created_at": ts, "updated_at": ts})
+    return results, rows
+
+def bulk_insert_tasks_stmt():
+    return insert(Task).returning(Task.id, sort_by_parameter_order=True)
+
+def attach_ids(results, ids):
+    ids = iter(ids)
+    for r in results:
+        if r["ok"]:
+            r["id"] = next(ids)
+    return results
+
+def bulk_create_tasks(project_id: int, items: list, db):
+    """Insert many tasks in one transaction; per-item results in input order."""
+    status = get_workflow(project_id, db).initial
+    results, rows = plan_bulk_create(project_id, items, status)
+    if rows:
+        ids = db.scalars(bulk_insert_tasks_stmt(), rows).all()
+        index_tasks(search_rows(ids, rows), db=db)
+        bump_status_count(project_id, status, len(rows), db=db)
+        bump_version("project", project_id, db=db)
+        db.commit()
+        attach_ids(results, ids)
+    return results
+
+def plan_bulk_moves(current: dict, moves: list, workflows: dict, counts: dict, changed_by: int):
+    """current maps task id -> (project_id, status), workflows project id -> Workflow and counts
+    (project_id, status) -> tasks in it (for WIP-limited statuses). Applies moves in order and returns
+    (results, final status per task, history rows, counter deltas per (project, status))."""
+    results, history, deltas, final, ts = [], [], {}, {}, now_ts()
+    state = {tid: status for tid, (_, status) in current.items()}
+    for i, m in enumerate(moves):
+        tid, to_status = m["task_id"], m["to_status"]
+        if tid not in state:
+            results.append({"index": i, "task_id": tid, "ok": False, "reason": "not_found"})
+            continue
+        from_status = state[tid]
+        project_id = current[tid][0]
+        workflow = workflows[project_id]
+        failure = workflow_failure(workflow, from_status, to_status)
+        limit = workflow.wip_limits.get(to_status)
+        if failure is None and from_status != to_status and limit is not None:
+            if counts.get((project_id, to_status), 0) + deltas.get((project_id, to_status), 0) >= limit:
+                failure = wip_failure(workflow, to_status)
+        if failure is not None:
+            results.append({"index": i, "task_id": tid, **failure})
+            continue
+        state[tid] = final[tid] = to_status
+        if from_status != to_status:
+            deltas[(project_id, from_status)] = deltas.get((project_id, from_status), 0) - 1
+            deltas[(project_id, to_status)] = deltas.get((project_id, to_status), 0) + 1
+        history.append({"task_id": tid, "from_status": from_status, "to_status": to_status, "changed_by": changed_by, "changed_at": ts})
+        results.append({"index": i, "task_id": tid, "project_id": project_id, "ok": True, "from": from_status, "to": to_status})
+    return results, final, history, deltas
+
+def status_counts_stmt(project_ids: list):
+    return (select(ProjectStatusCount.project_id, ProjectStatusCount.status, ProjectStatusCount.count)
+            .where(ProjectStatusCount.project_id.in_(project_ids)))
+
+def wip_limited(workflows: dict):
+    return [pid for pid, workflow in workflows.items() if workflow.wip_limits]
+
+def lost_wip_race(results):
+    # a concurrent move filled a WIP-limited status after the batch was planned: nothing was applied
+    return [r if not r["ok"] else {"index": r["index"], "task_id": r["task_id"], "ok": False, "reason": "conflict"}
+            for r in results]
 
-def get_task_history(task_id: int, db=None):
-    db = db or get_session()
-    return db.query(TaskHistory).filter(TaskHistory.task_id == task_id).order_by(TaskHistory.changed_at.asc()).all()
+def touched_projects(results):
+    return {r["project_id"] for r in results if r["ok"]}
+
+def chunks(values: list, size: int = IN_CHUNK):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def group_by_status(final: dict):
+    by_status = {}
+    for tid, status in final.items():
+        by_status.setdefault(status, []).append(tid)
+    return by_status
+
+def group_by_move(current: dict, final: dict):
+    """Planned tasks grouped by (status they were read in, status they end in)."""
+    groups = {}
+    for tid, status in final.items():
+        groups.setdefault((current[tid][1], status), []).append(tid)
+    return groups
+
+def bulk_move_stmt(task_ids: list, from_status: str, to_status: str, ts: int):
+    # only rows still in the status the batch was planned from move; RETURNING tells which did
+    return (
+        update(Task).where(Task.id.in_(task_ids), Task.status == from_status)
+        .values(status=to_status, updated_at=ts, version=Task.version + 1)
+        .returning(Task.id)
+        .execution_options(synchronize_session=False)
+    )
+
+def settle_bulk_moves(current: dict, results: list, history: list, applied: set):
+    """Keep what the conditional UPDATEs applied: tasks moved concurrently since planning are reported
+    as conflict, and history and counter deltas come only from the rows that changed."""
+    results = [r if not r["ok"] or r["task_id"] in applied else {"index": r["index"], "task_id": r["task_id"], "ok": False, "reason": "conflict"}
+               for r in results]
+    history = [h for h in history if h["task_id"] in applied]
+    deltas = {}
+    for h in history:
+        if h["from_status"] != h["to_status"]:
+            project_id = current[h["task_id"]][0]
+            deltas[(project_id, h["from_status"])] = deltas.get((project_id, h["from_status"]), 0) - 1
+            deltas[(project_id, h["to_status"])] = deltas.get((project_id, h["to_status"]), 0) + 1
+    return results, history, deltas
+
+def current_task_states_stmt(task_ids: list, member_id: int = None):
+    """(id, project_id, status) of the given tasks; with member_id, only tasks in that user's projects."""
+    stmt = select(Task.id, Task.project_id, Task.status).where(Task.id.in_(task_ids))
+    if member_id is not None:
+        stmt = stmt.join(ProjectMember, and_(ProjectMember.project_id == Task.project_id, ProjectMember.user_id == member_id))
+    return stmt
+
+def bulk_move_tasks(moves: list, changed_by: int, member_only: bool = False, *, db):
+    """Apply many moves with one conditional UPDATE per (from, to) pair and one history insert,
+    following each project's workflow. With member_only, tasks outside changed_by's projects are reported as not_found."""
+    task_ids = list({m["task_id"] for m in moves})
+    current = {}
+    for part in chunks(task_ids):
+        for tid, project_id, status in db.execute(current_task_states_stmt(part, changed_by if member_only else None)):
+            current[tid] = (project_id, status)
+    workflows = {pid: get_workflow(pid, db) for pid, _ in current.values()}
+    counts = {}
+    if wip_limited(workflows):
+        counts = {(p, st): c for p, st, c in db.execute(status_counts_stmt(wip_limited(workflows)))}
+    results, final, history, _ = plan_bulk_moves(current, moves, workflows, counts, changed_by)
+    if history:
+        ts, applied = history[0]["changed_at"], set()
+        for (from_status, to_status), ids in group_by_move(current, final).items():
+            for part in chunks(ids):
+                applied.update(db.execute(bulk_move_stmt(part, from_status, to_status, ts)).scalars())
+        results, history, deltas = settle_bulk_moves(current, results, history, applied)
+    if history:
+        db.execute(insert(TaskHistory), history)
+        for (project_id, status), delta in deltas.items():
+            if delta and not bump_status_count(project_id, status, delta, limit=workflows[project_id].wip_limits.get(status) if delta > 0 else None, db=db):
+                db.rollback()
+                return lost_wip_race(results)
+        for project_id in touched_projects(results):
+            bump_version("project", project_id, db=db)
+        db.commit()
+    return results
+
+def get_task_history(task_id: int, limit: int = None, cursor: tuple = None, *, db):
+    """History ordered by (changed_at, id); `cursor` is that pair for the last row seen."""
+    q = db.query(
+        TaskHistory.id, TaskHistory.from_status, TaskHistory.to_status, TaskHistory.changed_by, TaskHistory.changed_at
+    ).filter(TaskHistory.task_id == task_id)
+    if cursor is not None:
+        changed_at, last_id = cursor
+        q = q.filter(or_(TaskHistory.changed_at > changed_at, and_(TaskHistory.changed_at == changed_at, TaskHistory.id > last_id)))
+    q = q.order_by(TaskHistory.changed_at.asc(), TaskHistory.id.asc())
+    if limit is not None:
+        q = q.limit(limit)
+    return q.all()
+
+# Counters (version stamps, report and unread counts) are bumped with one INSERT ... ON CONFLICT DO
+# UPDATE, so two transactions creating the same row cannot both take the insert path
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+def dialect_of(db):
+    return db.get_bind().dialect.name
+
+def counter_upsert(dialect: str, model, keys: dict, deltas: dict, where=None):
+    """Insert the row with `deltas` as its counts, or add them to the existing row's columns."""
+    stmt = UPSERT_INSERTS[dialect](model).values(**keys, **deltas)
+    return stmt.on_conflict_do_update(
+        index_elements=list(keys), set_={c: getattr(model, c) + stmt.excluded[c] for c in deltas}, where=where
+    )
+
+# Version stamps (HTTP caching, see etags.py)
+def version_upsert(dialect: str, scope: str, ref_id: int):
+    return counter_upsert(dialect, VersionStamp, {"scope": scope, "ref_id": ref_id}, {"version": 1})
+
+def track_version_bump(db, scope: str, ref_id: int):
+    # cached versions are dropped once the transaction commits (etags.py)
+    db.info.setdefault("touched_versions", set()).add((scope, ref_id))
+
+def bump_version(scope: str, ref_id: int, db):
+    """Invalidate ETags of a resource inside the caller's transaction (no commit)."""
+    db.execute(version_upsert(dialect_of(db), scope, ref_id))
+    track_version_bump(db, scope, ref_id)
+
+def get_version(scope: str, ref_id: int, db):
+    v = db.query(VersionStamp.version).filter(VersionStamp.scope == scope, VersionStamp.ref_id == ref_id).scalar()
+    return v or 0
 
 # Reports
-def project_report(project_id: int, db=None):
-    db = db or get_session()
-    todo = db.query(Task).filter(Task.project_id == project_id, Task.status == "todo").count()
-    doing = db.query(Task).filter(Task.project_id == project_id, Task.status == "doing").count()
-    done = db.query(Task).filter(Task.project_id == project_id, Task.status == "done").count()
-    return {"todo": todo, "doing": doing, "done": done}
+def status_count_upsert(dialect: str, project_id: int, status: str, delta: int, limit: int = None):
+    # WIP limit: the increment and the check are one statement, so concurrent moves cannot both pass
+    where = ProjectStatusCount.count + delta <= limit if limit is not None else None
+    return counter_upsert(dialect, ProjectStatusCount, {"project_id": project_id, "status": status}, {"count": delta}, where)
+
+def bump_status_count(project_id: int, status: str, delta: int, limit: int = None, *, db):
+    """Adjust the materialized counter inside the caller's transaction (no commit). With limit,
+    returns False and changes nothing when the count would exceed it."""
+    if limit is not None and delta > limit:
+        return False
+    return db.execute(status_count_upsert(dialect_of(db), project_id, status, delta, limit)).rowcount == 1
+
+def _report_from_rows(rows, statuses=DEFAULT_STATUSES):
+    report = {s: 0 for s in statuses}
+    for status, count in rows:
+        # tasks left in a status the workflow no longer has still show up
+        if count or status in report:
+            report[status] = count
+    return report
+
+def project_report(project_id: int, db):
+    """Task count per status of the project's workflow, in board order."""
+    statuses = get_workflow(project_id, db).statuses
+    if REPORT_COUNTERS:
+        rows = db.query(ProjectStatusCount.status, ProjectStatusCount.count).filter(ProjectStatusCount.project_id == project_id).all()
+    else:
+        rows = db.query(Task.status, func.count(Task.id)).filter(Task.project_id == project_id).group_by(Task.status).all()
+    return _report_from_rows(rows, statuses)
+
+def rebuild_status_counts(project_id: int = None, bump_versions: bool = True, *, db):
+    """Recompute the materialized counters from the tasks table (consistency repair)."""
+    counters = db.query(ProjectStatusCount)
+    totals = db.query(Task.project_id, Task.status, func.count(Task.id)).group_by(Task.project_id, Task.status)
+    if project_id is not None:
+        counters = counters.filter(ProjectStatusCount.project_id == project_id)
+        totals = totals.filter(Task.project_id == project_id)
+    repaired = {p for p, in counters.with_entities(ProjectStatusCount.project_id).distinct()}
+    counters.delete(synchronize_session=False)
+    rows = totals.all()
+    db.bulk_insert_mappings(ProjectStatusCount, [{"project_id": p, "status": s, "count": c} for p, s, c in rows])
+    # cached reports (ETags) of every project whose numbers may have changed are stale now
+    if bump_versions:
+        for pid in repaired | {p for p, _, _ in rows}:
+            bump_version("project", pid, db=db)
+    db.commit()
+    return len(rows)
 
 # Notifications
-def create_notification(user_id: int, message: str, db=None):
-    db = db or get_session()
+def unread_count_upsert(dialect: str, user_id: int, delta: int):
+    return counter_upsert(dialect, NotificationUnreadCount, {"user_id": user_id}, {"count": delta})
+
+def bump_unread_count(user_id: int, delta: int, db):
+    """Adjust the user's unread counter inside the caller's transaction (no commit)."""
+    db.execute(unread_count_upsert(dialect_of(db), user_id, delta))
+
+def create_notification(user_id: int, message: str, db):
     n = Notification(user_id=user_id, message=message, created_at=now_ts(), read=False)
     db.add(n)
+    bump_unread_count(user_id, 1, db=db)
     db.commit()
     db.refresh(n)
     return n
 
-def get_notifications_for_user(user_id: int, db=None):
-    db = db or get_session()
-    return db.query(Notification).filter(Notification.user_id == user_id).order_by(Notification.created_at.desc()).all()
+def bulk_create_notifications(rows: list, db):
+    """Multi-row insert of notification dicts (user_id, message, created_at, read); no refresh.
+    Unread counters are bumped once per user in the same transaction."""
+    db.execute(insert(Notification), rows)
+    per_user = {}
+    for r in rows:
+        if not r.get("read"):
+            per_user[r["user_id"]] = per_user.get(r["user_id"], 0) + 1
+    for user_id, n in per_user.items():
+        bump_unread_count(user_id, n, db=db)
+    db.commit()
+
+def get_notifications_for_user(user_id: int, limit: int = None, cursor: tuple = None, *, db):
+    """Newest first, ordered by (created_at, id) descending; `cursor` is that pair for the last row seen."""
+    q = db.query(Notification.id, Notification.message, Notification.created_at, Notification.read).filter(Notification.user_id == user_id)
+    if cursor is not None:
+        created_at, last_id = cursor
+        q = q.filter(or_(Notification.created_at < created_at, and_(Notification.created_at == created_at, Notification.id < last_id)))
+    q = q.order_by(Notification.created_at.desc(), Notification.id.desc())
+    if limit is not None:
+        q = q.limit(limit)
+    return q.all()
+
+def get_unread_count(user_id: int, db):
+    count = db.query(NotificationUnreadCount.count).filter(NotificationUnreadCount.user_id == user_id).scalar()
+    return max(count or 0, 0)
+
+def mark_notifications_read(user_id: int, from_id: int = None, to_id: int = None, cursor: tuple = None, *, db):
+    """Mark the user's unread notifications as read: ids in [from_id, to_id] and/or everything at or
+    older than `cursor` (created_at, id), i.e. the position of a row already shown; no bound marks all.
+    Returns (marked, unread)."""
+    q = update(Notification).where(Notification.user_id == user_id, Notification.read == False)  # noqa: E712
+    if from_id is not None:
+        q = q.where(Notification.id >= from_id)
+    if to_id is not None:
+        q = q.where(Notification.id <= to_id)
+    if cursor is not None:
+        created_at, last_id = cursor
+        q = q.where(or_(Notification.created_at < created_at, and_(Notification.created_at == created_at, Notification.id <= last_id)))
+    marked = db.execute(q.values(read=True)).rowcount
+    if marked:
+        bump_unread_count(user_id, -marked, db=db)
+    db.commit()
+    return marked, get_unread_count(user_id, db=db)
+
+def purge_read_notifications(older_than: int, batch_size: int = 1000, max_batches: int = None, pause: float = 0, *, db):
+    """Delete read notifications created before `older_than` in batches of `batch_size`, one short
+    transaction per batch so writers are never locked out for long. Unread rows are kept (they still
+    count). Returns the number of rows deleted."""
+    deleted, batches = 0, 0
+    while max_batches is None or batches < max_batches:
+        ids = db.execute(
+            select(Notification.id)
+            .where(Notification.read == True, Notification.created_at < older_than)  # noqa: E712
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        db.execute(delete(Notification).where(Notification.id.in_(ids)))
+        db.commit()
+        deleted += len(ids)
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+def rebuild_unread_counts(user_id: int = None, *, db):
+    """Recompute the unread counters from the notifications table (consistency repair)."""
+    counters = db.query(NotificationUnreadCount)
+    totals = db.query(Notification.user_id, func.count(Notification.id)).filter(Notification.read == False).group_by(Notification.user_id)  # noqa: E712
+    if user_id is not None:
+        counters = counters.filter(NotificationUnreadCount.user_id == user_id)
+        totals = totals.filter(Notification.user_id == user_id)
+    counters.delete(synchronize_session=False)
+    rows = totals.all()
+    db.bulk_insert_mappings(NotificationUnreadCount, [{"user_id": u, "count": c} for u, c in rows])
+    db.commit()
+    return len(rows)
@@ -0,0 +1,50 @@
+import functools
+import crud
+from hashing import hasher
+
+# Async entry points for the async route handlers. Each one runs the crud.py function on the
+# request's AsyncSession through AsyncSession.run_sync, so there is a single implementation of
+# every operation (retries, workflow/WIP checks, counters) and the queries still don't block the
+# event loop. `db` is an AsyncSession (see db.get_async_db) and must be passed.
+
+def _on_async_session(fn):
+    @functools.wraps(fn)
+    async def run(*args, db, **kwargs):
+        return await db.run_sync(lambda session: fn(*args, db=session, **kwargs))
+    return run
+
+# Users
+get_user_by_username = _on_async_session(crud.get_user_by_username)
+get_user_by_id = _on_async_session(crud.get_user_by_id)
+update_password_hash = _on_async_session(crud.update_password_hash)
+_create_user = _on_async_session(crud.create_user)
+
+async def create_user(username: str, password: str, db):
+    # reject duplicates before paying for the hash, which runs in the hasher's pool
+    if await get_user_by_username(username, db=db):
+        raise ValueError("username exists")
+    return await _create_user(username, password, password_hash=await hasher.hash(password), db=db)
+
+# Counters
+bump_status_count = _on_async_session(crud.bump_status_count)
+bump_version = _on_async_session(crud.bump_version)
+bump_unread_count = _on_async_session(crud.bump_unread_count)
+
+# Projects and invitations
+get_user_projects = _on_async_session(crud.get_user_projects)
+is_project_member = _on_async_session(crud.is_project_member)
+get_task_membership = _on_async_session(crud.get_task_membership)
+create_invitation = _on_async_session(crud.create_invitation)
+use_invitation = _on_async_session(crud.use_invitation)
+
+# Tasks
+index_tasks = _on_async_session(crud.index_tasks)
+get_task_project_id = _on_async_session(crud.get_task_project_id)
+create_task = _on_async_session(crud.create_task)
+move_task = _on_async_session(crud.move_task)
+bulk_create_tasks = _on_async_session(crud.bulk_create_tasks)
+bulk_move_tasks = _on_async_session(crud.bulk_move_tasks)
+
+# Notifications
+get_notifications_for_user = _on_async_session(crud.get_notifications_for_user)
+create_notification = _on_async_session(crud.create_notification)
@@ -1,17 +1,102 @@
 from sqlalchemy import (
-    create_engine, Column, Integer, String, ForeignKey, Text, Boolean
+    create_engine, event, Column, Integer, String, ForeignKey, Text, Boolean, Index
 )
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+from sqlalchemy.pool import StaticPool, NullPool
+from contextlib import contextmanager
 from datetime import datetime
+from metrics import instrument_engine
+import search
+import os
 
 Base = declarative_base()
 SessionLocal = None
+engine = None
+AsyncSessionLocal = None
+async_engine = None
+_db_url = None
+_sqlite_pragmas = False
+_memory_db_counter = 0
 
-def init_db(db_url: str = "sqlite:///:memory:"):
-    global SessionLocal
-    engine = create_engine(db_url, connect_args={"check_same_thread": False})
+# Pool tuning (overridable per environment)
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+SQLITE_WAL = os.environ.get("DB_SQLITE_WAL", "1") == "1"
+# run pending migrations whenever init_db is called (development convenience)
+AUTO_MIGRATE = os.environ.get("DB_AUTO_MIGRATE", "0") == "1"
+
+def _is_memory_sqlite(db_url: str):
+    return db_url.startswith("sqlite") and (
+        ":memory:" in db_url or "mode=memory" in db_url or db_url.rstrip("/") in ("sqlite:", "sqlite:/")
+    )
+
+def _engine_kwargs(db_url: str, pool_size: int, max_overflow: int, pool_recycle: int, pool_timeout: int):
+    if not db_url.startswith("sqlite"):
+        return {
+            "pool_size": pool_size,
+            "max_overflow": max_overflow,
+            "pool_recycle": pool_recycle,
+            "pool_timeout": pool_timeout,
+            "pool_pre_ping": True,
+        }
+    kwargs = {"connect_args": {"check_same_thread": False}}
+    if _is_memory_sqlite(db_url):
+        # a single shared connection, otherwise every thread sees an empty DB
+        kwargs["poolclass"] = StaticPool
+    else:
+        kwargs.update(pool_size=pool_size, max_overflow=max_overflow,
+                      pool_recycle=pool_recycle, pool_timeout=pool_timeout)
+    return kwargs
+
+def _set_sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA busy_timeout=5000")
+    cur.execute("PRAGMA foreign_keys=ON")
+    cur.close()
+
+def _shared_memory_url():
+    # a named shared-cache DB so the async engine sees the same in-memory data
+    global _memory_db_counter
+    _memory_db_counter += 1
+    return f"sqlite:///file:memdb{_memory_db_counter}?mode=memory&cache=shared&uri=true"
+
+def _async_url(db_url: str):
+    if db_url.startswith("sqlite:"):
+        return db_url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if db_url.startswith("postgresql:") or db_url.startswith("postgres:"):
+        return "postgresql+asyncpg:" + db_url.split(":", 1)[1]
+    return db_url
+
+def init_db(db_url: str = "sqlite:///:memory:", pool_size: int = POOL_SIZE, max_overflow: int = MAX_OVERFLOW,
+            pool_recycle: int = POOL_RECYCLE, pool_timeout: int = POOL_TIMEOUT, sqlite_wal: bool = SQLITE_WAL,
+            create_schema: bool = None):
+    """Create the engine and session factories. No DDL runs unless create_schema (default: only
+    for in-memory databases, or with DB_AUTO_MIGRATE=1); otherwise use `python manage.py migrate`."""
+    global SessionLocal, engine, AsyncSessionLocal, async_engine, _db_url, _sqlite_pragmas
+    if engine is not None:
+        engine.dispose()
+    if create_schema is None:
+        create_schema = AUTO_MIGRATE or _is_memory_sqlite(db_url)
+    if _is_memory_sqlite(db_url):
+        db_url = _shared_memory_url()
+    _db_url = db_url
+    AsyncSessionLocal = None
+    async_engine = None
+    engine = create_engine(db_url, **_engine_kwargs(db_url, pool_size, max_overflow, pool_recycle, pool_timeout))
+    instrument_engine(engine)
+    _sqlite_pragmas = sqlite_wal and db_url.startswith("sqlite") and not _is_memory_sqlite(db_url)
+    if _sqlite_pragmas:
+        event.listen(engine, "connect", _set_sqlite_pragmas)
     SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
-    Base.metadata.create_all(bind=engine)
+    search.configure(engine)
+    if create_schema:
+        # migrations.py builds on crud, which imports this module
+        from migrations import migrate
+        migrate(engine)
     return engine
 
 def get_session():
@@ -20,7 +105,79 @@ def get_session():
         init_db()
     return SessionLocal()
 
+def get_db():
+    """FastAPI dependency: one session per request, always closed at the end."""
+    db = get_session()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def init_async_db():
+    """Build the async engine for the URL given to init_db (aiosqlite / asyncpg)."""
+    global AsyncSessionLocal, async_engine
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    if _db_url is None:
+        init_db()
+    url = _async_url(_db_url)
+    if url.startswith("sqlite"):
+        # aiosqlite connections are cheap and must not be shared across event loops
+        async_engine = create_async_engine(url, poolclass=NullPool)
+    else:
+        async_engine = create_async_engine(url, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW,
+                                           pool_recycle=POOL_RECYCLE, pool_timeout=POOL_TIMEOUT, pool_pre_ping=True)
+    instrument_engine(async_engine.sync_engine)
+    if _sqlite_pragmas:
+        # same WAL/durability/foreign key settings as the sync connections
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+    return async_engine
+
+def get_async_session():
+    if AsyncSessionLocal is None:
+        init_async_db()
+    return AsyncSessionLocal()
+
+async def get_async_db():
+    """Async counterpart of get_db for async route handlers."""
+    db = get_async_session()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+@contextmanager
+def session_scope():
+    """Unit of work for code outside a request (scripts, background jobs)."""
+    db = get_session()
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def pool_stats():
+    if engine is None:
+        return {}
+    pool = engine.pool
+    stats = {"pool_class": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            stats[name] = fn()
+    stats["status"] = pool.status()
+    return stats
+
 # Models
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)
+    description = Column(String(200))
+    applied_at = Column(Integer)
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -48,6 +205,8 @@ class ProjectMember(Base):
 
     project = relationship("Project", back_populates="members")
 
+    __table_args__ = (Index("ux_project_members_project_user", "project_id", "user_id", unique=True),)
+
 class Invitation(Base):
     __tablename__ = "invitations"
     id = Column(Integer, primary_key=True)
@@ -65,12 +224,50 @@ class Task(Base):
     description = Column(Text, default="")
     status = Column(String(50), default="todo")
     assignee_id = Column(Integer, nullable=True)
+    # incremented by every move (optimistic concurrency, If-Match)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     created_at = Column(Integer, default=lambda: int(datetime.utcnow().timestamp()))
     updated_at = Column(Integer, default=lambda: int(datetime.utcnow().timestamp()))
 
     project = relationship("Project", back_populates="tasks")
     history = relationship("TaskHistory", back_populates="task")
 
+    __table_args__ = (
+        Index("ix_tasks_project_status", "project_id", "status"),
+        Index("ix_tasks_project_id_id", "project_id", "id"),
+    )
+
+class ProjectStatusCount(Base):
+    """Materialized task count per (project, status), maintained by create_task/move_task."""
+    __tablename__ = "project_status_counts"
+    project_id = Column(Integer, ForeignKey("projects.id"), primary_key=True)
+    status = Column(String(50), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class WorkflowStatus(Base):
+    """A status of a project's workflow; the first by position is where new tasks start.
+    Projects without rows use the default todo/doing/done workflow (see workflows.py)."""
+    __tablename__ = "workflow_statuses"
+    project_id = Column(Integer, ForeignKey("projects.id"), primary_key=True)
+    name = Column(String(50), primary_key=True)
+    position = Column(Integer, nullable=False)
+    category = Column(String(20), nullable=False)  # todo | doing | done (analytics)
+    wip_limit = Column(Integer, nullable=True)
+
+class WorkflowTransition(Base):
+    __tablename__ = "workflow_transitions"
+    project_id = Column(Integer, ForeignKey("projects.id"), primary_key=True)
+    from_status = Column(String(50), primary_key=True)
+    to_status = Column(String(50), primary_key=True)
+
+class VersionStamp(Base):
+    """Monotonic version per cached resource: ("project", id) for its tasks/report/history,
+    ("user", id) for that user's project list. Bumped in the same transaction as the change."""
+    __tablename__ = "version_stamps"
+    scope = Column(String(20), primary_key=True)
+    ref_id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
 class TaskHistory(Base):
     __tablename__ = "task_history"
     id = Column(Integer, primary_key=True)
@@ -82,6 +279,42 @@ class TaskHistory(Base):
 
     task = relationship("Task", back_populates="history")
 
+    __table_args__ = (Index("ix_task_history_task_changed", "task_id", "changed_at", "id"),)
+
+# Analytics rollups (analytics.py), filled incrementally from tasks/task_history past a watermark
+class AnalyticsWatermark(Base):
+    __tablename__ = "analytics_watermarks"
+    name = Column(String(50), primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+
+class TaskFlowState(Base):
+    """Where each task is in the workflow as of the watermark (to measure time in status)."""
+    __tablename__ = "task_flow_state"
+    task_id = Column(Integer, primary_key=True)
+    project_id = Column(Integer, nullable=False)
+    status = Column(String(50), nullable=False)
+    entered_at = Column(Integer, nullable=False)
+    created_at = Column(Integer, nullable=False)
+    started_at = Column(Integer, nullable=True)
+
+class ProjectFlowDaily(Base):
+    """Transitions into/out of each status per UTC day (creations enter the first status)."""
+    __tablename__ = "project_flow_daily"
+    project_id = Column(Integer, primary_key=True)
+    day = Column(String(10), primary_key=True)
+    status = Column(String(50), primary_key=True)
+    entered = Column(Integer, nullable=False, default=0)
+    exited = Column(Integer, nullable=False, default=0)
+
+class ProjectDurationHistogram(Base):
+    """Bucketed durations ("lead", "cycle", "status:<name>") per UTC day of the closing move."""
+    __tablename__ = "project_duration_histograms"
+    project_id = Column(Integer, primary_key=True)
+    day = Column(String(10), primary_key=True)
+    metric = Column(String(60), primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
 class Notification(Base):
     __tablename__ = "notifications"
     id = Column(Integer, primary_key=True)
@@ -89,3 +322,15 @@ class Notification(Base):
     message = Column(Text)
     created_at = Column(Integer, default=lambda: int(datetime.utcnow().timestamp()))
     read = Column(Boolean, default=False)
+
+    __table_args__ = (
+        Index("ix_notifications_user_created", "user_id", "created_at", "id"),
+        # retention scans read rows by age
+        Index("ix_notifications_read_created", "read", "created_at"),
+    )
+
+class NotificationUnreadCount(Base):
+    """Materialized unread count per user, maintained by the notification writes and mark-read."""
+    __tablename__ = "notification_unread_counts"
+    user_id = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
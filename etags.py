@@ -0,0 +1,120 @@
+from fastapi import HTTPException, Request, Response
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import hashlib
+import threading
+import time
+import os
+from crud import get_version
+
+# Conditional GETs: read endpoints send a strong ETag derived from the version stamp of the
+# resource (crud.bump_version) and the request URL, and answer If-None-Match with 304 from a
+# cached stamp, without touching the task rows. The TTL bounds staleness across workers.
+ETAG_CACHE_TTL = float(os.environ.get("ETAG_CACHE_TTL", 2))
+ETAG_CACHE_SIZE = int(os.environ.get("ETAG_CACHE_SIZE", 50000))
+
+class VersionCache:
+    """Bounded per-process cache of (scope, ref_id) -> version."""
+    def __init__(self, maxsize: int = ETAG_CACHE_SIZE, ttl: float = ETAG_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # bumped by every invalidation: a version read from the DB before a concurrent commit
+        # must not be cached after that commit invalidated the key
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, version: int, generation: int):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (version, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "maxsize": self.maxsize, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses}
+
+version_cache = VersionCache()
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_versions(session):
+    touched = session.info.pop("touched_versions", None)
+    if touched:
+        version_cache.invalidate(touched)
+
+def current_version(scope: str, ref_id: int, db):
+    key = (scope, ref_id)
+    version = version_cache.get(key)
+    if version is None:
+        generation = version_cache.generation
+        version = get_version(scope, ref_id, db=db)
+        version_cache.put(key, version, generation)
+    return version
+
+def make_etag(request: Request, scope: str, ref_id: int, version: int):
+    # the URL covers the route and its pagination parameters
+    digest = hashlib.blake2b(f"{request.url.path}?{request.url.query}".encode(), digest_size=8).hexdigest()
+    return f'"{scope[0]}{ref_id}.{version}.{digest}"'
+
+def etag_matches(if_none_match: str, etag: str):
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    return any(t.strip().removeprefix("W/") == etag for t in if_none_match.split(","))
+
+def task_etag(task_id: int, version: int):
+    # for If-Match on writes: names the task's row version, independent of any URL
+    return f'"t{task_id}.{version}"'
+
+def if_match_version(if_match: str, task_id: int):
+    """Task version required by an If-Match header: None when absent or "*", 0 (never a real
+    version, so the move conflicts) when none of the listed tags is for this task."""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    prefix = f'"t{task_id}.'
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        # If-Match uses the strong comparison: weak tags never match
+        if tag.startswith(prefix) and tag.endswith('"') and tag[len(prefix):-1].isdigit():
+            return int(tag[len(prefix):-1])
+    return 0
+
+def check_etag(request: Request, response: Response, scope: str, ref_id: int, db):
+    """Raise 304 when the client's copy is current, otherwise tag the response. Call it before
+    reading the data, so a concurrent change can only make the tag older than the body."""
+    etag = make_etag(request, scope, ref_id, current_version(scope, ref_id, db))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return etag
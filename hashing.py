@@ -0,0 +1,123 @@
+from passlib.context import CryptContext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from functools import lru_cache
+import multiprocessing
+import asyncio
+import threading
+import time
+import os
+
+# Shared password hasher. Bcrypt is deliberately slow, so the async helpers run it
+# on a dedicated, size-limited pool instead of the request thread.
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+HASH_MAX_PENDING = int(os.environ.get("HASH_MAX_PENDING", HASH_WORKERS * 8))
+HASH_EXECUTOR = os.environ.get("HASH_EXECUTOR", "process")
+HASH_RETRY_AFTER = int(os.environ.get("HASH_RETRY_AFTER", 1))
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool already has HASH_MAX_PENDING calls in flight."""
+
+@lru_cache(maxsize=None)
+def get_context(rounds: int = BCRYPT_ROUNDS):
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+
+# Plain functions: usable directly and picklable for the process pool
+def hash_password(plain_password, rounds: int = BCRYPT_ROUNDS):
+    return get_context(rounds).hash(plain_password)
+
+def verify_password(plain_password, hashed_password, rounds: int = BCRYPT_ROUNDS):
+    return get_context(rounds).verify(plain_password, hashed_password)
+
+def verify_and_update(plain_password, hashed_password, rounds: int = BCRYPT_ROUNDS):
+    """Returns (ok, new_hash); new_hash is set when the stored hash uses another cost."""
+    return get_context(rounds).verify_and_update(plain_password, hashed_password)
+
+class HashMetrics:
+    def __init__(self, window: int = 1000):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.counts = {}
+        self.rejected = 0
+        self.window = window
+
+    def record(self, op: str, seconds: float):
+        with self.lock:
+            self.samples.setdefault(op, deque(maxlen=self.window)).append(seconds * 1000)
+            self.counts[op] = self.counts.get(op, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            out = {"rejected": self.rejected}
+            for op, s in self.samples.items():
+                ordered = sorted(s)
+                out[op] = {
+                    "count": self.counts[op],
+                    "p50_ms": round(ordered[len(ordered) // 2], 2),
+                    "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 2),
+                    "max_ms": round(ordered[-1], 2),
+                }
+            return out
+
+class Hasher:
+    def __init__(self, workers: int = HASH_WORKERS, max_pending: int = HASH_MAX_PENDING,
+                 rounds: int = BCRYPT_ROUNDS, executor: str = HASH_EXECUTOR):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.executor_kind = executor
+        self.metrics = HashMetrics()
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.executor_kind == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hasher")
+            else:
+                # spawn: forking a process that already runs event-loop threads is unsafe
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def _run(self, op: str, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self.metrics.lock:
+                self.metrics.rejected += 1
+            raise HasherBusy(op)
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._pending -= 1
+            self._slots.release()
+            self.metrics.record(op, time.perf_counter() - start)
+
+    async def hash(self, plain_password):
+        return await self._run("hash", hash_password, plain_password, self.rounds)
+
+    async def verify(self, plain_password, hashed_password):
+        return await self._run("verify", verify_password, plain_password, hashed_password, self.rounds)
+
+    async def verify_and_update(self, plain_password, hashed_password):
+        return await self._run("verify", verify_and_update, plain_password, hashed_password, self.rounds)
+
+    def stats(self):
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "rounds": self.rounds,
+            **self.metrics.snapshot(),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+hasher = Hasher()
@@ -1,42 +1,61 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request
-from db import init_db, get_session
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Request, Response, Query, Header
+from db import init_db, get_db, get_async_db, pool_stats
+from migrations import schema_version, SCHEMA_VERSION
+import db as db_module
 from crud import (
-    create_user, get_user_by_username, create_project, get_user_projects,
-    create_invitation, use_invitation, create_task, get_project_tasks, move_task,
-    get_task_history, project_report, create_notification, get_notifications_for_user
+    MAX_BULK_ITEMS, create_project, get_user_projects, get_project_tasks, get_task_history, project_report,
+    get_notifications_for_user, get_unread_count, mark_notifications_read, get_task_membership, search_tasks,
+    is_project_owner, save_workflow
 )
-from auth import create_access_token, verify_password, get_current_user
+import crud_async
+from auth import (
+    create_access_token, get_current_user, require_project_member, require_task_member,
+    get_current_user_async, require_project_member_async, require_task_member_async, principal_cache, membership_cache
+)
+from hashing import hasher, HasherBusy, HASH_RETRY_AFTER
+from notifier import create_notifier, user_topic, project_topic
+from metrics import InstrumentationMiddleware, render_prometheus
+from notification_writer import notification_writer, notification_retention
+from etags import check_etag, version_cache, task_etag, if_match_version
+from analytics import analytics_job, project_analytics, ANALYTICS_MAX_DAYS
+from workflows import get_workflow, get_workflow_async, workflow_cache
+from transfer import export_ndjson, export_csv, ProjectImporter, ImportLineTooLong
+from datetime import date, datetime, timedelta
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 import os
-import asyncio
-from fastapi.responses import StreamingResponse
+import json
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 
 DB_FILE = os.environ.get("DB_FILE", "sqlite:///./data.sqlite")
-init_db(DB_FILE)
-
-app = FastAPI(title="Project Tasks - TDD (FastAPI)")
-
-# Simple in-memory broadcaster for notifications
-class Notifier:
-    def __init__(self):
-        self.queues = []
 
-    async def publish(self, event: dict):
-        for q in list(self.queues):
-            await q.put(event)
+def hasher_busy_handler(request: Request, exc: HasherBusy):
+    return JSONResponse(status_code=503, content={"detail": "server busy"}, headers={"Retry-After": str(HASH_RETRY_AFTER)})
 
-    def subscribe(self):
-        q = asyncio.Queue()
-        self.queues.append(q)
-        return q
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # nothing heavy happens at import time: the engine is created here (unless already set up,
+    # e.g. by tests) and the schema is expected to be migrated beforehand
+    if db_module.engine is None:
+        init_db(DB_FILE)
+    if schema_version() < SCHEMA_VERSION:
+        raise RuntimeError("database schema is out of date: run `python manage.py migrate`")
+    notification_retention.start()
+    analytics_job.start()
+    yield
+    hasher.shutdown()
+    notifier.close()
+    notification_retention.close()
+    analytics_job.close()
+    notification_writer.close()
 
-    def unsubscribe(self, q):
-        try:
-            self.queues.remove(q)
-        except ValueError:
-            pass
+router = APIRouter()
 
-notifier = Notifier()
+# Real-time events: in-memory or cross-worker backend (NOTIFIER_BACKEND)
+notifier = create_notifier()
+SSE_HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", 15))
+SSE_RETRY_MS = int(os.environ.get("SSE_RETRY_MS", 3000))
+SSE_INIT_LIMIT = int(os.environ.get("SSE_INIT_LIMIT", 20))
 
 # Schemas
 class RegisterIn(BaseModel):
@@ -50,9 +69,24 @@ class LoginIn(BaseModel):
 class ProjectIn(BaseModel):
     name: str
 
+class WorkflowStatusIn(BaseModel):
+    name: str
+    category: str  # todo | doing | done
+    wip_limit: int | None = None
+
+class WorkflowIn(BaseModel):
+    statuses: list[WorkflowStatusIn]
+    # status -> statuses it may move to; omitted: any move is allowed
+    transitions: dict[str, list[str]] | None = None
+
 class InviteIn(BaseModel):
     token: str
 
+class MarkReadIn(BaseModel):
+    from_id: int | None = None
+    to_id: int | None = None
+    cursor: str | None = None
+
 class TaskIn(BaseModel):
     title: str
     description: str | None = ""
@@ -60,124 +94,372 @@ class TaskIn(BaseModel):
 
 class MoveIn(BaseModel):
     to_status: str
+    expected_status: str | None = None
+
+class BulkTasksIn(BaseModel):
+    tasks: list[TaskIn]
+
+class BulkMoveItem(BaseModel):
+    task_id: int
+    to_status: str
+
+class BulkMoveIn(BaseModel):
+    moves: list[BulkMoveItem]
+
+# Keyset pagination: the body stays a plain list, the next page cursor goes in a header
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def parse_cursor(cursor: str | None, parts: int):
+    if cursor is None:
+        return None
+    try:
+        values = tuple(int(v) for v in cursor.split(":"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    if len(values) != parts:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return values[0] if parts == 1 else values
+
+def set_next_cursor(response: Response, rows, limit: int, *fields):
+    if len(rows) == limit:
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = ":".join(str(getattr(last, f)) for f in fields)
+
+def task_project_id(task_id: int, user_id: int, db):
+    # filled in by require_task_member unless evicted since
+    project_id = membership_cache.task_project(task_id)
+    if project_id is None:
+        project_id = get_task_membership(task_id, user_id, db=db)[0]
+    return project_id
+
+async def task_project_id_async(task_id: int, adb):
+    project_id = membership_cache.task_project(task_id)
+    if project_id is None:
+        project_id = await crud_async.get_task_project_id(task_id, db=adb)
+        if project_id is None:
+            raise HTTPException(status_code=404, detail="not_found")
+    return project_id
 
 # Routes - Auth
-@app.post("/auth/register")
-def register(payload: RegisterIn):
+@router.post("/auth/register")
+async def register(payload: RegisterIn, adb=Depends(get_async_db)):
     try:
-        u = create_user(payload.username, payload.password)
+        u = await crud_async.create_user(payload.username, payload.password, db=adb)
         return {"id": u.id, "username": u.username}
     except ValueError as e:
         raise HTTPException(status_code=409, detail=str(e))
 
-@app.post("/auth/login")
-def login(payload: LoginIn):
-    db = get_session()
-    User = get_user_by_username.__globals__['User'] if 'User' in get_user_by_username.__globals__ else None
-    u = db.query(User).filter_by(username=payload.username).first()
+@router.post("/auth/login")
+async def login(payload: LoginIn, adb=Depends(get_async_db)):
+    u = await crud_async.get_user_by_username(payload.username, db=adb)
     if not u:
         raise HTTPException(status_code=401, detail="invalid credentials")
-    if not verify_password(payload.password, u.password_hash):
+    ok, new_hash = await hasher.verify_and_update(payload.password, u.password_hash)
+    if not ok:
         raise HTTPException(status_code=401, detail="invalid credentials")
+    if new_hash:
+        # bcrypt cost changed since this hash was stored
+        await crud_async.update_password_hash(u, new_hash, db=adb)
     token = create_access_token(sub=u.id, username=u.username)
     return {"token": token}
 
 # Projects
-@app.post("/projects")
-def create_project_route(payload: ProjectIn, current_user=Depends(get_current_user)):
-    p = create_project(payload.name, current_user.id)
+@router.post("/projects")
+def create_project_route(payload: ProjectIn, current_user=Depends(get_current_user), db=Depends(get_db)):
+    p = create_project(payload.name, current_user.id, db=db)
     return {"id": p.id, "name": p.name, "owner_id": p.owner_id}
 
-@app.get("/projects")
-def list_projects(current_user=Depends(get_current_user)):
-    rows = get_user_projects(current_user.id)
+@router.get("/projects")
+def list_projects(request: Request, response: Response, current_user=Depends(get_current_user), db=Depends(get_db)):
+    check_etag(request, response, "user", current_user.id, db)
+    rows = get_user_projects(current_user.id, db=db)
     out = [{"id": p.id, "name": p.name, "owner_id": p.owner_id} for p in rows]
     return out
 
-@app.post("/projects/{project_id}/invite")
-async def invite_project(project_id: int, current_user=Depends(get_current_user)):
-    # naive membership check
-    user_projects = get_user_projects(current_user.id)
-    if not any(p.id == project_id for p in user_projects):
-        raise HTTPException(status_code=403, detail="not a member")
-    inv = create_invitation(project_id, current_user.id)
-    await notifier.publish({"type": "invitation_created", "project_id": project_id, "token": inv.token, "by": current_user.id})
-    create_notification(current_user.id, f"Invitation created for project {project_id}")
+@router.post("/projects/{project_id}/invite")
+async def invite_project(project_id: int, current_user=Depends(require_project_member_async), adb=Depends(get_async_db)):
+    inv = await crud_async.create_invitation(project_id, current_user.id, db=adb)
+    notifier.publish({"type": "invitation_created", "project_id": project_id, "token": inv.token, "by": current_user.id}, [project_topic(project_id)])
+    await notification_writer.enqueue_async(current_user.id, f"Invitation created for project {project_id}")
     return {"token": inv.token, "expires_at": inv.expires_at}
 
-@app.post("/projects/{project_id}/join")
-async def join_project(project_id: int, payload: InviteIn, current_user=Depends(get_current_user)):
-    res = use_invitation(payload.token, current_user.id)
+@router.post("/projects/{project_id}/join")
+async def join_project(project_id: int, payload: InviteIn, current_user=Depends(get_current_user_async), adb=Depends(get_async_db)):
+    res = await crud_async.use_invitation(payload.token, current_user.id, db=adb)
     if not res["ok"]:
         raise HTTPException(status_code=400, detail=res["reason"])
-    await notifier.publish({"type": "user_joined", "project_id": res["project_id"], "user_id": current_user.id})
-    create_notification(current_user.id, f"Joined project {res['project_id']}")
+    notifier.publish({"type": "user_joined", "project_id": res["project_id"], "user_id": current_user.id}, [project_topic(res["project_id"])])
+    await notification_writer.enqueue_async(current_user.id, f"Joined project {res['project_id']}")
     return {"ok": True, "project_id": res["project_id"]}
 
-@app.get("/projects/{project_id}/report")
-def project_report_route(project_id: int, current_user=Depends(get_current_user)):
-    r = project_report(project_id)
+@router.get("/projects/{project_id}/report")
+def project_report_route(project_id: int, request: Request, response: Response, current_user=Depends(require_project_member), db=Depends(get_db)):
+    check_etag(request, response, "project", project_id, db)
+    r = project_report(project_id, db=db)
     return r
 
+@router.get("/projects/{project_id}/workflow")
+def get_workflow_route(project_id: int, request: Request, response: Response, current_user=Depends(require_project_member), db=Depends(get_db)):
+    check_etag(request, response, "project", project_id, db)
+    return get_workflow(project_id, db).to_dict()
+
+@router.put("/projects/{project_id}/workflow")
+def put_workflow_route(project_id: int, payload: WorkflowIn, current_user=Depends(require_project_member), db=Depends(get_db)):
+    if not is_project_owner(project_id, current_user.id, db=db):
+        raise HTTPException(status_code=403, detail="only the project owner can change its workflow")
+    statuses = [{"name": st.name.strip(), "category": st.category, "wip_limit": st.wip_limit} for st in payload.statuses]
+    res = save_workflow(project_id, statuses, payload.transitions, db=db)
+    if not res["ok"] and res["reason"] == "in_use":
+        raise HTTPException(status_code=409, detail={"reason": "in_use", "statuses": res["statuses"]})
+    if not res["ok"]:
+        raise HTTPException(status_code=400, detail=res["detail"])
+    workflow = get_workflow(project_id, db)
+    notifier.publish({"type": "workflow_changed", "project_id": project_id, "by": current_user.id}, [project_topic(project_id)])
+    return workflow.to_dict()
+
+@router.get("/projects/{project_id}/analytics")
+def project_analytics_route(project_id: int, start: date | None = Query(None, alias="from"), end: date | None = Query(None, alias="to"),
+                            current_user=Depends(require_project_member), db=Depends(get_db)):
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=29)
+    if start > end or (end - start).days >= ANALYTICS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"invalid range (at most {ANALYTICS_MAX_DAYS} days)")
+    return project_analytics(project_id, start, end, db=db)
+
+# Export / import (streamed both ways)
+@router.get("/projects/{project_id}/export")
+def export_project(project_id: int, format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+                   kind: str = Query("tasks", regex="^(tasks|history|members)$"), current_user=Depends(require_project_member)):
+    if format == "csv":
+        headers = {"Content-Disposition": f'attachment; filename="project-{project_id}-{kind}.csv"'}
+        return StreamingResponse(export_csv(project_id, kind), media_type="text/csv", headers=headers)
+    headers = {"Content-Disposition": f'attachment; filename="project-{project_id}.ndjson"'}
+    return StreamingResponse(export_ndjson(project_id), media_type="application/x-ndjson", headers=headers)
+
+@router.post("/projects/import")
+async def import_project(request: Request, name: str | None = None, current_user=Depends(get_current_user_async), adb=Depends(get_async_db)):
+    # progress goes to the user's SSE stream after every committed chunk
+    def progress(report):
+        notifier.publish({"type": "import_progress", **report}, [user_topic(current_user.id)])
+    importer = ProjectImporter(current_user.id, adb, name=name, on_progress=progress)
+    try:
+        async for chunk in request.stream():
+            await importer.feed(chunk)
+    except ImportLineTooLong as e:
+        raise HTTPException(status_code=413, detail={"error": str(e), **importer.report()})
+    report = await importer.finish()
+    await notification_writer.enqueue_async(current_user.id, f"Imported {report['tasks']} tasks into project {report['project_id']}")
+    return report
+
 # Tasks
-@app.post("/tasks/{project_id}/tasks")
-async def create_task_route(project_id: int, payload: TaskIn, current_user=Depends(get_current_user)):
-    t = create_task(project_id, payload.title, payload.description or "", payload.assignee_id)
-    create_notification(current_user.id, f'Task "{payload.title}" created in project {project_id}')
-    await notifier.publish({"type": "task_created", "project_id": project_id, "task": {"id": t.id, "title": t.title}})
+@router.post("/tasks/{project_id}/tasks")
+async def create_task_route(project_id: int, payload: TaskIn, current_user=Depends(require_project_member_async), adb=Depends(get_async_db)):
+    t = await crud_async.create_task(project_id, payload.title, payload.description or "", payload.assignee_id, db=adb)
+    await notification_writer.enqueue_async(current_user.id, f'Task "{payload.title}" created in project {project_id}')
+    notifier.publish({"type": "task_created", "project_id": project_id, "task": {"id": t.id, "title": t.title}}, [project_topic(project_id)])
     return {"id": t.id, "project_id": t.project_id, "title": t.title, "status": t.status}
 
-@app.get("/tasks/{project_id}/tasks")
-def list_tasks(project_id: int, current_user=Depends(get_current_user)):
-    t = get_project_tasks(project_id)
-    out = [{"id": x.id, "title": x.title, "status": x.status} for x in t]
+@router.get("/tasks/{project_id}/tasks")
+def list_tasks(project_id: int, request: Request, response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+               cursor: str | None = None, current_user=Depends(require_project_member), db=Depends(get_db)):
+    check_etag(request, response, "project", project_id, db)
+    t = get_project_tasks(project_id, limit=limit, cursor=parse_cursor(cursor, 1), db=db)
+    set_next_cursor(response, t, limit, "id")
+    out = [{"id": x.id, "title": x.title, "status": x.status, "version": x.version} for x in t]
     return out
 
-@app.patch("/tasks/move/{task_id}")
-async def move_task_route(task_id: int, payload: MoveIn, current_user=Depends(get_current_user)):
-    allowed = ["todo", "doing", "done"]
-    if payload.to_status not in allowed:
+@router.get("/tasks/{project_id}/search")
+def search_tasks_route(project_id: int, request: Request, response: Response, q: str = Query(..., min_length=1, max_length=200),
+                       status: str | None = None, assignee_id: int | None = None,
+                       limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), cursor: str | None = None,
+                       current_user=Depends(require_project_member), db=Depends(get_db)):
+    check_etag(request, response, "project", project_id, db)
+    # ranked results page by offset: the cursor is the number of rows already returned
+    offset = parse_cursor(cursor, 1) or 0
+    rows = search_tasks(project_id, q, status=status, assignee_id=assignee_id, limit=limit, offset=offset, db=db)
+    if rows is None:
+        raise HTTPException(status_code=400, detail="empty query")
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(offset + limit)
+    return [{"id": r.id, "title": r.title, "status": r.status, "assignee_id": r.assignee_id, "rank": r.rank} for r in rows]
+
+@router.post("/tasks/{project_id}/tasks/bulk")
+async def bulk_create_tasks_route(project_id: int, payload: BulkTasksIn, current_user=Depends(require_project_member_async), adb=Depends(get_async_db)):
+    if len(payload.tasks) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"at most {MAX_BULK_ITEMS} tasks per batch")
+    results = await crud_async.bulk_create_tasks(project_id, [t.dict() for t in payload.tasks], db=adb)
+    ids = [r["id"] for r in results if r["ok"]]
+    if ids:
+        await notification_writer.enqueue_async(current_user.id, f"{len(ids)} tasks created in project {project_id}")
+        notifier.publish({"type": "tasks_created", "project_id": project_id, "count": len(ids), "task_ids": ids}, [project_topic(project_id)])
+    return {"created": len(ids), "failed": len(results) - len(ids), "results": results}
+
+@router.patch("/tasks/bulk/move")
+async def bulk_move_tasks_route(payload: BulkMoveIn, current_user=Depends(get_current_user_async), adb=Depends(get_async_db)):
+    if len(payload.moves) > MAX_BULK_ITEMS:
+        raise HTTPException(status_code=413, detail=f"at most {MAX_BULK_ITEMS} moves per batch")
+    results = await crud_async.bulk_move_tasks([m.dict() for m in payload.moves], current_user.id, member_only=True, db=adb)
+    moved = [r for r in results if r["ok"]]
+    if moved:
+        await notification_writer.enqueue_async(current_user.id, f"{len(moved)} task moves applied")
+        by_project = {}
+        for r in moved:
+            by_project.setdefault(r["project_id"], []).append({"task_id": r["task_id"], "from": r["from"], "to": r["to"]})
+        for pid, items in by_project.items():
+            notifier.publish({"type": "tasks_moved", "project_id": pid, "count": len(items), "moves": items, "by": current_user.id}, [project_topic(pid)])
+    return {"moved": len(moved), "failed": len(results) - len(moved), "results": results}
+
+@router.patch("/tasks/move/{task_id}")
+async def move_task_route(task_id: int, payload: MoveIn, response: Response, if_match: str | None = Header(None),
+                          current_user=Depends(require_task_member_async), adb=Depends(get_async_db)):
+    # both lookups are served from per-process caches (adb is only used on a miss)
+    workflow = await get_workflow_async(await task_project_id_async(task_id, adb), adb)
+    if not workflow.has(payload.to_status):
+        raise HTTPException(status_code=400, detail="invalid status")
+    res = await crud_async.move_task(task_id, payload.to_status, current_user.id, expected_status=payload.expected_status,
+                                     expected_version=if_match_version(if_match, task_id), workflow=workflow, db=adb)
+    if not res["ok"] and res["reason"] == "conflict":
+        raise HTTPException(status_code=409, detail={"reason": "conflict", "status": res["status"], "version": res["version"]},
+                            headers={"ETag": task_etag(task_id, res["version"])})
+    if not res["ok"] and res["reason"] in ("transition_not_allowed", "wip_limit"):
+        raise HTTPException(status_code=409, detail={k: v for k, v in res.items() if k != "ok"})
+    if not res["ok"] and res["reason"] == "invalid_status":
         raise HTTPException(status_code=400, detail="invalid status")
-    res = move_task(task_id, payload.to_status, current_user.id)
     if not res["ok"]:
         raise HTTPException(status_code=404, detail=res["reason"])
-    create_notification(current_user.id, f"Task {task_id} moved to {payload.to_status}")
-    await notifier.publish({"type": "task_moved", "task_id": task_id, "from": res["from"], "to": res["to"], "by": current_user.id})
-    return {"ok": True}
+    response.headers["ETag"] = task_etag(task_id, res["version"])
+    await notification_writer.enqueue_async(current_user.id, f"Task {task_id} moved to {payload.to_status}")
+    notifier.publish({"type": "task_moved", "project_id": res["project_id"], "task_id": task_id, "from": res["from"], "to": res["to"],
+                      "version": res["version"], "by": current_user.id}, [project_topic(res["project_id"])])
+    return {"ok": True, "from": res["from"], "to": res["to"], "version": res["version"]}
 
-@app.get("/tasks/history/{task_id}")
-def task_history_route(task_id: int, current_user=Depends(get_current_user)):
-    h = get_task_history(task_id)
+@router.get("/tasks/history/{task_id}")
+def task_history_route(task_id: int, request: Request, response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                       cursor: str | None = None, current_user=Depends(require_task_member), db=Depends(get_db)):
+    # history only changes through moves, which bump the project's version
+    check_etag(request, response, "project", task_project_id(task_id, current_user.id, db), db)
+    h = get_task_history(task_id, limit=limit, cursor=parse_cursor(cursor, 2), db=db)
+    set_next_cursor(response, h, limit, "changed_at", "id")
     out = [{"from_status": x.from_status, "to_status": x.to_status, "changed_by": x.changed_by, "changed_at": x.changed_at} for x in h]
     return out
 
 # Notifications
-@app.get("/notifications")
-def notifications_route(current_user=Depends(get_current_user)):
-    rows = get_notifications_for_user(current_user.id)
+@router.get("/notifications")
+def notifications_route(response: Response, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                        cursor: str | None = None, current_user=Depends(get_current_user), db=Depends(get_db)):
+    rows = get_notifications_for_user(current_user.id, limit=limit, cursor=parse_cursor(cursor, 2), db=db)
+    set_next_cursor(response, rows, limit, "created_at", "id")
     out = [{"id": r.id, "message": r.message, "created_at": r.created_at, "read": r.read} for r in rows]
     return out
 
-@app.get("/notifications/stream")
-def notifications_stream(request: Request, current_user=Depends(get_current_user)):
-    q = notifier.subscribe()
+@router.get("/notifications/unread-count")
+def unread_count_route(current_user=Depends(get_current_user), db=Depends(get_db)):
+    return {"unread": get_unread_count(current_user.id, db=db)}
+
+@router.post("/notifications/read")
+def mark_read_route(payload: MarkReadIn, current_user=Depends(get_current_user), db=Depends(get_db)):
+    marked, unread = mark_notifications_read(current_user.id, from_id=payload.from_id, to_id=payload.to_id,
+                                             cursor=parse_cursor(payload.cursor, 2), db=db)
+    if marked:
+        # keeps the unread badge in sync across the user's other tabs
+        notifier.publish({"type": "notifications_read", "unread": unread}, [user_topic(current_user.id)])
+    return {"marked": marked, "unread": unread}
+
+def sse(event_type: str, data, event_id: int = None):
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@router.get("/notifications/stream")
+async def notifications_stream(request: Request, last_event_id: str | None = Header(None), current_user=Depends(get_current_user_async),
+                               adb=Depends(get_async_db)):
+    # the stream outlives the request; give the connection back before streaming
+    user_id = current_user.id
+    resume_from = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    projects = await crud_async.get_user_projects(user_id, db=adb)
+    initial = None
+    if resume_from is None:
+        # fresh connection: latest page only, older items come from GET /notifications
+        rows = await crud_async.get_notifications_for_user(user_id, limit=SSE_INIT_LIMIT, db=adb)
+        initial = [{"id": r.id, "message": r.message, "created_at": r.created_at, "read": r.read} for r in rows]
+    await adb.close()
+    sub = notifier.subscribe([user_topic(user_id)] + [project_topic(p.id) for p in projects], last_event_id=resume_from)
 
     async def event_generator():
-        # send initial stored notifications
-        initial = get_notifications_for_user(current_user.id)
-        yield f"event: init\ndata: { [ {'id':r.id,'message':r.message,'created_at':r.created_at} for r in initial ] }\n\n"
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        if initial is not None:
+            yield sse("init", initial)
+        elif not sub.replay_complete:
+            # missed more than the ring buffer holds: the client must reload
+            yield sse("reset", {"reason": "replay_unavailable"})
         try:
             while True:
                 if await request.is_disconnected():
                     break
-                event = await q.get()
-                yield f"event: {event.get('type')}\ndata: {event}\n\n"
+                item = await sub.get(timeout=SSE_HEARTBEAT_SECONDS)
+                if item is None:
+                    if sub.closed:
+                        # closed by the backend (slow consumer)
+                        break
+                    yield ": heartbeat\n\n"
+                    continue
+                event_id, event = item
+                yield sse(event.get("type", "message"), event, event_id)
         finally:
-            notifier.unsubscribe(q)
+            notifier.unsubscribe(sub)
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 # Health
-@app.get("/health")
+@router.get("/health")
 def health():
     return {"ok": True}
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics_route():
+    return render_prometheus()
+
+@router.get("/health/db")
+def health_db():
+    return pool_stats()
+
+@router.get("/health/principals")
+def health_principals():
+    return principal_cache.stats()
+
+@router.get("/health/membership")
+def health_membership():
+    return membership_cache.stats()
+
+@router.get("/health/etags")
+def health_etags():
+    return version_cache.stats()
+
+@router.get("/health/workflows")
+def health_workflows():
+    return workflow_cache.stats()
+
+@router.get("/health/analytics")
+def health_analytics():
+    return analytics_job.stats()
+
+@router.get("/health/notification-writer")
+def health_notification_writer():
+    return {**notification_writer.stats(), "retention": notification_retention.stats()}
+
+@router.get("/health/notifier")
+def health_notifier():
+    return notifier.stats()
+
+@router.get("/health/hasher")
+def health_hasher():
+    return hasher.stats()
+
+def create_app():
+    app = FastAPI(title="Project Tasks - TDD (FastAPI)", lifespan=lifespan)
+    app.add_middleware(InstrumentationMiddleware)
+    app.add_exception_handler(HasherBusy, hasher_busy_handler)
+    app.include_router(router)
+    return app
+
+app = create_app()
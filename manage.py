@@ -0,0 +1,75 @@
+"""Maintenance commands.
+
+Usage:
+  python manage.py migrate
+  python manage.py rebuild-report-counters [--project-id ID]
+  python manage.py rebuild-unread-counters [--user-id ID]
+  python manage.py purge-notifications [--days N] [--batch-size N]
+  python manage.py rebuild-search-index
+  python manage.py refresh-analytics
+"""
+import argparse
+import os
+from db import init_db, session_scope
+from migrations import migrate, schema_version
+from crud import rebuild_status_counts, rebuild_unread_counts, purge_read_notifications, rebuild_search_index, now_ts
+import search
+from analytics import refresh_analytics
+
+def migrate_cmd(args):
+    applied = migrate()
+    if applied:
+        print(f"applied migrations {applied}")
+    print(f"schema at version {schema_version()}")
+
+def rebuild_report_counters(args):
+    with session_scope() as db:
+        n = rebuild_status_counts(args.project_id, db=db)
+    print(f"rebuilt {n} status counters")
+
+def rebuild_unread_counters(args):
+    with session_scope() as db:
+        n = rebuild_unread_counts(args.user_id, db=db)
+    print(f"rebuilt {n} unread counters")
+
+def purge_notifications(args):
+    with session_scope() as db:
+        n = purge_read_notifications(now_ts() - int(args.days * 86400), args.batch_size, db=db)
+    print(f"deleted {n} read notifications")
+
+def rebuild_search(args):
+    with session_scope() as db:
+        n = rebuild_search_index(db=db)
+    print(f"search index ({search.backend.name}) rebuilt from {n} tasks")
+
+def refresh_analytics_cmd(args):
+    with session_scope() as db:
+        n = refresh_analytics(db=db)
+    print(f"folded {n} task/history rows into the analytics rollups")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Project Tasks maintenance commands")
+    parser.add_argument("--db", default=os.environ.get("DB_FILE", "sqlite:///./data.sqlite"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("migrate", help="create or upgrade the database schema")
+    p.set_defaults(func=migrate_cmd)
+    p = sub.add_parser("rebuild-report-counters", help="recompute per-project status counters from tasks")
+    p.add_argument("--project-id", type=int, default=None)
+    p.set_defaults(func=rebuild_report_counters)
+    p = sub.add_parser("rebuild-unread-counters", help="recompute per-user unread notification counters")
+    p.add_argument("--user-id", type=int, default=None)
+    p.set_defaults(func=rebuild_unread_counters)
+    p = sub.add_parser("purge-notifications", help="delete read notifications older than --days, in batches")
+    p.add_argument("--days", type=float, default=float(os.environ.get("NOTIFICATION_RETENTION_DAYS", 90)))
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.set_defaults(func=purge_notifications)
+    p = sub.add_parser("rebuild-search-index", help="rebuild the task full-text index from the tasks table")
+    p.set_defaults(func=rebuild_search)
+    p = sub.add_parser("refresh-analytics", help="fold new tasks/history rows into the analytics rollups")
+    p.set_defaults(func=refresh_analytics_cmd)
+    args = parser.parse_args(argv)
+    init_db(args.db)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+from sqlalchemy import event
+from contextvars import ContextVar
+import logging
+import threading
+import time
+import os
+
+# Per-request SQL/timing instrumentation: SQLAlchemy hooks feed the stats of the request
+# being served (via a context variable); the ASGI middleware reports them as Server-Timing
+# headers and aggregates per-route histograms for GET /metrics.
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 0))
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+
+slow_query_log = logging.getLogger("sql.slow")
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "commits", "slowest_seconds", "slowest_sql")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.commits = 0
+        self.slowest_seconds = 0.0
+        self.slowest_sql = None
+
+current_stats = ContextVar("current_stats", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = current_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        if elapsed > stats.slowest_seconds:
+            stats.slowest_seconds = elapsed
+            stats.slowest_sql = statement
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_query_log.warning("slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+def _on_commit(conn):
+    stats = current_stats.get()
+    if stats is not None:
+        stats.commits += 1
+
+def instrument_engine(engine):
+    """Attach the statement/commit hooks to a (sync) engine; idempotent."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "commit", _on_commit)
+    return engine
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self, name: str, label_names: tuple, help_text: str):
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        with self.lock:
+            for labels, series in sorted(self.series.items()):
+                base = ",".join(f'{k}="{v}"' for k, v in zip(label_names, labels))
+                for b, c in zip(self.buckets, series["buckets"]):
+                    lines.append(f'{name}_bucket{{{base},le="{b}"}} {c}')
+                lines.append(f'{name}_bucket{{{base},le="+Inf"}} {series["count"]}')
+                lines.append(f"{name}_sum{{{base}}} {round(series['sum'], 6)}")
+                lines.append(f"{name}_count{{{base}}} {series['count']}")
+        return lines
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+request_seconds = Histogram(LATENCY_BUCKETS)
+db_seconds = Histogram(LATENCY_BUCKETS)
+queries_per_request = Histogram(QUERY_BUCKETS)
+commits_per_request = Histogram(QUERY_BUCKETS)
+
+def render_prometheus():
+    labels = ("method", "route")
+    lines = []
+    lines += request_seconds.render("http_request_duration_seconds", labels, "Handler time per route.")
+    lines += db_seconds.render("db_time_seconds", labels, "Total SQL time per request.")
+    lines += queries_per_request.render("db_queries_per_request", labels, "SQL statements per request.")
+    lines += commits_per_request.render("db_commits_per_request", labels, "Commits per request.")
+    return "\n".join(lines) + "\n"
+
+def server_timing(stats: RequestStats, handler_seconds: float):
+    return (
+        f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.queries} queries, {stats.commits} commits", '
+        f'db-slowest;dur={stats.slowest_seconds * 1000:.2f}, '
+        f'app;dur={handler_seconds * 1000:.2f}'
+    )
+
+class InstrumentationMiddleware:
+    """Pure ASGI middleware (does not buffer streaming responses like SSE)."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(stats, time.perf_counter() - start).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_stats.reset(token)
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched")
+            request_seconds.observe(labels, time.perf_counter() - start)
+            db_seconds.observe(labels, stats.db_seconds)
+            queries_per_request.observe(labels, stats.queries)
+            commits_per_request.observe(labels, stats.commits)
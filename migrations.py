@@ -0,0 +1,206 @@
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, Text, Boolean, ForeignKey, Index, inspect, select, insert, func, text
+)
+from sqlalchemy.orm import Session
+import time
+from db import SchemaMigration
+import db as db_module
+from crud import rebuild_status_counts, rebuild_unread_counts, rebuild_search_index
+import search
+
+# Schema migrations, applied in order by `python manage.py migrate` (or init_db(create_schema=True))
+# and recorded in schema_migrations, so a worker's startup costs no DDL at all. Every step creates
+# frozen definitions (never the live models, which keep changing) with checkfirst, so it also
+# upgrades databases created before the step existed, and backfills whatever it introduces.
+
+def frozen_tables():
+    """The tables as the migrations create them; built per run, so the indexes each step attaches
+    never leak into an earlier step's CREATE TABLE."""
+    m = MetaData()
+    # baseline: the schema before any migration existed
+    Table("users", m,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("username", String(150), unique=True, nullable=False, index=True),
+          Column("password_hash", String(200), nullable=False))
+    Table("projects", m,
+          Column("id", Integer, primary_key=True, index=True),
+          Column("name", String(200), nullable=False),
+          Column("owner_id", Integer, ForeignKey("users.id"), nullable=False))
+    Table("project_members", m,
+          Column("id", Integer, primary_key=True),
+          Column("project_id", Integer, ForeignKey("projects.id")),
+          Column("user_id", Integer, ForeignKey("users.id")),
+          Column("role", String(50)))
+    Table("invitations", m,
+          Column("id", Integer, primary_key=True),
+          Column("project_id", Integer, ForeignKey("projects.id")),
+          Column("token", String(100), unique=True, index=True),
+          Column("expires_at", Integer),
+          Column("created_by", Integer, ForeignKey("users.id")),
+          Column("used", Boolean))
+    Table("tasks", m,
+          Column("id", Integer, primary_key=True),
+          Column("project_id", Integer, ForeignKey("projects.id")),
+          Column("title", String(300)),
+          Column("description", Text),
+          Column("status", String(50)),
+          Column("assignee_id", Integer, nullable=True),
+          Column("created_at", Integer),
+          Column("updated_at", Integer))
+    Table("task_history", m,
+          Column("id", Integer, primary_key=True),
+          Column("task_id", Integer, ForeignKey("tasks.id")),
+          Column("from_status", String(50)),
+          Column("to_status", String(50)),
+          Column("changed_by", Integer),
+          Column("changed_at", Integer))
+    Table("notifications", m,
+          Column("id", Integer, primary_key=True),
+          Column("user_id", Integer),
+          Column("message", Text),
+          Column("created_at", Integer),
+          Column("read", Boolean))
+    # added by later steps
+    Table("project_status_counts", m,
+          Column("project_id", Integer, ForeignKey("projects.id"), primary_key=True),
+          Column("status", String(50), primary_key=True),
+          Column("count", Integer, nullable=False))
+    Table("notification_unread_counts", m,
+          Column("user_id", Integer, primary_key=True),
+          Column("count", Integer, nullable=False))
+    Table("version_stamps", m,
+          Column("scope", String(20), primary_key=True),
+          Column("ref_id", Integer, primary_key=True),
+          Column("version", Integer, nullable=False))
+    Table("analytics_watermarks", m,
+          Column("name", String(50), primary_key=True),
+          Column("last_id", Integer, nullable=False))
+    Table("task_flow_state", m,
+          Column("task_id", Integer, primary_key=True),
+          Column("project_id", Integer, nullable=False),
+          Column("status", String(50), nullable=False),
+          Column("entered_at", Integer, nullable=False),
+          Column("created_at", Integer, nullable=False),
+          Column("started_at", Integer, nullable=True))
+    Table("project_flow_daily", m,
+          Column("project_id", Integer, primary_key=True),
+          Column("day", String(10), primary_key=True),
+          Column("status", String(50), primary_key=True),
+          Column("entered", Integer, nullable=False),
+          Column("exited", Integer, nullable=False))
+    Table("project_duration_histograms", m,
+          Column("project_id", Integer, primary_key=True),
+          Column("day", String(10), primary_key=True),
+          Column("metric", String(60), primary_key=True),
+          Column("bucket", Integer, primary_key=True),
+          Column("count", Integer, nullable=False))
+    Table("workflow_statuses", m,
+          Column("project_id", Integer, ForeignKey("projects.id"), primary_key=True),
+          Column("name", String(50), primary_key=True),
+          Column("position", Integer, nullable=False),
+          Column("category", String(20), nullable=False),
+          Column("wip_limit", Integer, nullable=True))
+    Table("workflow_transitions", m,
+          Column("project_id", Integer, ForeignKey("projects.id"), primary_key=True),
+          Column("from_status", String(50), primary_key=True),
+          Column("to_status", String(50), primary_key=True))
+    return m.tables
+
+def _create(bind, *tables):
+    for table in tables:
+        table.create(bind=bind, checkfirst=True)
+
+def _baseline(bind, t):
+    _create(bind, *(t[name] for name in ("users", "projects", "project_members", "invitations", "tasks", "task_history", "notifications")))
+
+def _report_counters(bind, t):
+    _create(bind, t["project_status_counts"])
+    Index("ix_tasks_project_status", t["tasks"].c.project_id, t["tasks"].c.status).create(bind=bind, checkfirst=True)
+    with Session(bind=bind) as db:
+        # version stamps (migration 6) don't exist yet, so there is no ETag to invalidate
+        rebuild_status_counts(bump_versions=False, db=db)
+
+def _keyset_indexes(bind, t):
+    tasks, history, notifications = t["tasks"], t["task_history"], t["notifications"]
+    Index("ix_tasks_project_id_id", tasks.c.project_id, tasks.c.id).create(bind=bind, checkfirst=True)
+    Index("ix_task_history_task_changed", history.c.task_id, history.c.changed_at, history.c.id).create(bind=bind, checkfirst=True)
+    Index("ix_notifications_user_created", notifications.c.user_id, notifications.c.created_at, notifications.c.id).create(bind=bind, checkfirst=True)
+
+def _unique_members(bind, t):
+    # keep the oldest row of each (project, user) pair, promoted to owner if any duplicate was one
+    with bind.begin() as conn:
+        conn.execute(text(
+            "UPDATE project_members SET role = 'owner' WHERE id IN ("
+            " SELECT MIN(id) FROM project_members GROUP BY project_id, user_id"
+            " HAVING SUM(CASE WHEN role = 'owner' THEN 1 ELSE 0 END) > 0)"
+        ))
+        conn.execute(text(
+            "DELETE FROM project_members WHERE id NOT IN ("
+            " SELECT MIN(id) FROM project_members GROUP BY project_id, user_id)"
+        ))
+    members = t["project_members"]
+    Index("ux_project_members_project_user", members.c.project_id, members.c.user_id, unique=True).create(bind=bind, checkfirst=True)
+
+def _unread_counters(bind, t):
+    _create(bind, t["notification_unread_counts"])
+    notifications = t["notifications"]
+    Index("ix_notifications_read_created", notifications.c.read, notifications.c.created_at).create(bind=bind, checkfirst=True)
+    with Session(bind=bind) as db:
+        rebuild_unread_counts(db=db)
+
+def _version_stamps(bind, t):
+    _create(bind, t["version_stamps"])
+
+def _search_index(bind, t):
+    search.backend.install(bind)
+    with Session(bind=bind) as db:
+        rebuild_search_index(db=db)
+
+def _analytics(bind, t):
+    # filled from scratch by the analytics job (its watermarks start at 0)
+    _create(bind, t["analytics_watermarks"], t["task_flow_state"], t["project_flow_daily"], t["project_duration_histograms"])
+
+def _task_versions(bind, t):
+    with bind.begin() as conn:
+        if "version" not in {c["name"] for c in inspect(conn).get_columns("tasks")}:
+            conn.exec_driver_sql("ALTER TABLE tasks ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+def _workflows(bind, t):
+    _create(bind, t["workflow_statuses"], t["workflow_transitions"])
+
+MIGRATIONS = [
+    (1, "baseline schema", _baseline),
+    (2, "report counters and the (project_id, status) index, backfilled", _report_counters),
+    (3, "keyset pagination indexes", _keyset_indexes),
+    (4, "unique (project_id, user_id) membership, after removing duplicates", _unique_members),
+    (5, "unread notification counters and the retention index, backfilled", _unread_counters),
+    (6, "version stamps for ETags", _version_stamps),
+    (7, "task search index, rebuilt from existing tasks", _search_index),
+    (8, "analytics rollups", _analytics),
+    (9, "tasks.version for optimistic concurrency", _task_versions),
+    (10, "per-project workflows", _workflows),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def schema_version(bind=None):
+    """Latest applied migration (0 for an empty database)."""
+    with (bind or db_module.engine).connect() as conn:
+        if not inspect(conn).has_table("schema_migrations"):
+            return 0
+        return conn.execute(select(func.max(SchemaMigration.version))).scalar() or 0
+
+def migrate(bind=None):
+    """Apply pending migrations; returns the versions applied."""
+    bind = bind or db_module.engine
+    current = schema_version(bind)
+    tables = frozen_tables()
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        apply(bind, tables)
+        SchemaMigration.__table__.create(bind=bind, checkfirst=True)
+        with bind.begin() as conn:
+            conn.execute(insert(SchemaMigration).values(version=version, description=description, applied_at=int(time.time())))
+        applied.append(version)
+    return applied
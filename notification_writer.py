@@ -0,0 +1,204 @@
+from collections import deque
+import logging
+import threading
+import time
+import os
+from starlette.concurrency import run_in_threadpool
+from db import session_scope
+from crud import now_ts, bulk_create_notifications, purge_read_notifications
+
+# Write-behind for the activity feed: routes enqueue notification rows and a background
+# thread persists them with multi-row INSERTs, every FLUSH_MS or every FLUSH_ROWS rows.
+NOTIFICATION_WRITE_MODE = os.environ.get("NOTIFICATION_WRITE_MODE", "background")
+NOTIFICATION_FLUSH_MS = int(os.environ.get("NOTIFICATION_FLUSH_MS", 200))
+NOTIFICATION_FLUSH_ROWS = int(os.environ.get("NOTIFICATION_FLUSH_ROWS", 500))
+NOTIFICATION_QUEUE_MAX = int(os.environ.get("NOTIFICATION_QUEUE_MAX", 50000))
+# Retention: read notifications older than RETENTION_DAYS are deleted in small batches
+# (0 disables the background job; `manage.py purge-notifications` runs it by hand).
+NOTIFICATION_RETENTION_DAYS = float(os.environ.get("NOTIFICATION_RETENTION_DAYS", 90))
+NOTIFICATION_RETENTION_INTERVAL = int(os.environ.get("NOTIFICATION_RETENTION_INTERVAL", 3600))
+NOTIFICATION_RETENTION_BATCH = int(os.environ.get("NOTIFICATION_RETENTION_BATCH", 1000))
+NOTIFICATION_RETENTION_PAUSE_MS = int(os.environ.get("NOTIFICATION_RETENTION_PAUSE_MS", 50))
+
+log = logging.getLogger("notifications")
+
+class NotificationWriter:
+    def __init__(self, mode: str = NOTIFICATION_WRITE_MODE, flush_ms: int = NOTIFICATION_FLUSH_MS,
+                 flush_rows: int = NOTIFICATION_FLUSH_ROWS, max_queue: int = NOTIFICATION_QUEUE_MAX):
+        self.mode = mode
+        self.flush_ms = flush_ms
+        self.flush_rows = flush_rows
+        self.max_queue = max_queue
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.stopping = False
+        self.thread = None
+        self.flushed_rows = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def _row(self, user_id: int, message: str):
+        return {"user_id": user_id, "message": message, "created_at": now_ts(), "read": False}
+
+    def enqueue(self, user_id: int, message: str):
+        """For sync (threadpool) callers; sync mode writes in the caller's thread."""
+        row = self._row(user_id, message)
+        if self.mode == "sync":
+            self._write([row])
+        else:
+            self._append(row)
+
+    async def enqueue_async(self, user_id: int, message: str):
+        """For async route handlers: never touches the database on the event loop."""
+        row = self._row(user_id, message)
+        if self.mode == "sync":
+            await run_in_threadpool(self._write, [row])
+        else:
+            self._append(row)
+
+    def _append(self, row: dict):
+        # never flushes in the producer: a full queue means the database is not keeping up, and
+        # a request stalling on it (on the event loop, for async routes) would only add load
+        with self.cond:
+            if len(self.pending) >= self.max_queue:
+                self.dropped += 1
+                self.cond.notify()
+                return
+            self.pending.append(row)
+            if len(self.pending) >= self.flush_rows:
+                self.cond.notify()
+        if self.thread is None:
+            self._start()
+
+    def _start(self):
+        with self.cond:
+            if self.thread is None and not self.stopping:
+                self.thread = threading.Thread(target=self._run, name="notification-writer", daemon=True)
+                self.thread.start()
+
+    def _take(self):
+        with self.cond:
+            batch = list(self.pending)
+            self.pending.clear()
+        return batch
+
+    def _write(self, rows):
+        start = time.perf_counter()
+        try:
+            with session_scope() as db:
+                bulk_create_notifications(rows, db=db)
+        except Exception:
+            self.errors += 1
+            log.exception("dropping %d notifications after a failed flush", len(rows))
+            return
+        elapsed = (time.perf_counter() - start) * 1000
+        self.flushed_rows += len(rows)
+        self.batches += 1
+        self.last_flush_ms = elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+
+    def flush(self):
+        """Persist everything queued so far (blocking)."""
+        with self.flush_lock:
+            batch = self._take()
+            if batch:
+                self._write(batch)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                if not self.stopping and len(self.pending) < self.flush_rows:
+                    self.cond.wait(self.flush_ms / 1000)
+                stopping = self.stopping
+            self.flush()
+            if stopping:
+                return
+
+    def close(self):
+        """Stop the worker after draining the queue (a later enqueue starts a new one)."""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout=10)
+        self.flush()
+        with self.cond:
+            self.thread = None
+            self.stopping = False
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "queue_depth": len(self.pending),
+            "flushed_rows": self.flushed_rows,
+            "batches": self.batches,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
+
+notification_writer = NotificationWriter()
+
+class NotificationRetention:
+    """Periodically purges old read notifications; each batch is its own short transaction."""
+    def __init__(self, days: float = NOTIFICATION_RETENTION_DAYS, interval: int = NOTIFICATION_RETENTION_INTERVAL,
+                 batch_size: int = NOTIFICATION_RETENTION_BATCH, pause_ms: int = NOTIFICATION_RETENTION_PAUSE_MS):
+        self.days = days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause_ms = pause_ms
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.runs = 0
+        self.deleted = 0
+        self.errors = 0
+        self.last_run_ms = 0.0
+
+    def run_once(self):
+        start = time.perf_counter()
+        cutoff = now_ts() - int(self.days * 86400)
+        try:
+            with session_scope() as db:
+                n = purge_read_notifications(cutoff, self.batch_size, pause=self.pause_ms / 1000, db=db)
+        except Exception:
+            self.errors += 1
+            log.exception("notification retention run failed")
+            return 0
+        self.runs += 1
+        self.deleted += n
+        self.last_run_ms = (time.perf_counter() - start) * 1000
+        return n
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        if self.days > 0 and self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="notification-retention", daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+            self.thread = None
+
+    def stats(self):
+        return {
+            "enabled": self.days > 0,
+            "days": self.days,
+            "runs": self.runs,
+            "deleted": self.deleted,
+            "errors": self.errors,
+            "last_run_ms": round(self.last_run_ms, 2),
+        }
+
+notification_retention = NotificationRetention()
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import itertools
+from collections import deque
+
+# Pub/sub for real-time events. Subscribers listen on topics ("user:<id>", "project:<id>");
+# publish never blocks the caller and each subscriber has a bounded buffer.
+NOTIFIER_BACKEND = os.environ.get("NOTIFIER_BACKEND", "memory")
+NOTIFIER_QUEUE_SIZE = int(os.environ.get("NOTIFIER_QUEUE_SIZE", 100))
+NOTIFIER_SLOW_POLICY = os.environ.get("NOTIFIER_SLOW_POLICY", "drop_oldest")
+NOTIFIER_SQLITE_PATH = os.environ.get("NOTIFIER_SQLITE_PATH", "./notifier.sqlite")
+NOTIFIER_POLL_INTERVAL = float(os.environ.get("NOTIFIER_POLL_INTERVAL", 0.1))
+NOTIFIER_RETENTION_SECONDS = int(os.environ.get("NOTIFIER_RETENTION_SECONDS", 300))
+# recent events kept per topic so reconnecting SSE clients can resume from Last-Event-ID
+NOTIFIER_REPLAY_SIZE = int(os.environ.get("NOTIFIER_REPLAY_SIZE", 256))
+
+def user_topic(user_id: int):
+    return f"user:{user_id}"
+
+def project_topic(project_id: int):
+    return f"project:{project_id}"
+
+class Subscription:
+    """Bounded per-subscriber buffer of (event_id, event). Events are delivered on the
+    subscriber's own loop."""
+    def __init__(self, topics, maxsize: int = NOTIFIER_QUEUE_SIZE, policy: str = NOTIFIER_SLOW_POLICY):
+        self.topics = frozenset(topics)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.buffer = deque()
+        self.closed = False
+        self.dropped = 0
+        self.last_id = 0
+        self.loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+
+    def _deliver(self, event_id: int, event: dict):
+        # no dedupe by id here: a publish from another thread arrives through call_soon_threadsafe
+        # and may land after a later id published on this loop
+        if self.closed:
+            return
+        if len(self.buffer) >= self.maxsize:
+            if self.policy == "disconnect":
+                self.close()
+                return
+            self.buffer.popleft()
+            self.dropped += 1
+        self.buffer.append((event_id, event))
+        self.last_id = max(self.last_id, event_id)
+        self._ready.set()
+
+    def deliver(self, event_id: int, event: dict):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._deliver(event_id, event)
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._deliver, event_id, event)
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    async def get(self, timeout: float = None):
+        """Next (event_id, event); None when the subscription was closed or the timeout expired."""
+        while not self.buffer:
+            if self.closed:
+                return None
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.buffer.popleft()
+
+class InMemoryNotifier:
+    """Single-process backend: fan-out straight to local subscribers."""
+    def __init__(self, maxsize: int = NOTIFIER_QUEUE_SIZE, policy: str = NOTIFIER_SLOW_POLICY,
+                 replay_size: int = NOTIFIER_REPLAY_SIZE):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.replay_size = replay_size
+        self.by_topic = {}
+        self.recent = {}
+        self.lock = threading.Lock()
+        self.published = 0
+        # start from the clock so ids keep increasing across restarts
+        self.first_id = int(time.time() * 1000)
+        self.ids = itertools.count(self.first_id)
+
+    def subscribe(self, topics, last_event_id: int = None):
+        """Register a subscription. With last_event_id, the buffered events after it are queued
+        first; `sub.replay_complete` is False when the ring buffer no longer reaches back that far."""
+        sub = Subscription(topics, self.maxsize, self.policy)
+        sub.replay_complete = True
+        with self.lock:
+            if last_event_id is not None:
+                # events before first_id were published before this process was listening
+                if last_event_id < self.first_id - 1:
+                    sub.replay_complete = False
+                missed = {}
+                for t in sub.topics:
+                    ring = self.recent.get(t)
+                    if not ring:
+                        continue
+                    if len(ring) == ring.maxlen and ring[0][0] > last_event_id + 1:
+                        sub.replay_complete = False
+                    for event_id, event in ring:
+                        if event_id > last_event_id:
+                            missed[event_id] = event
+                ordered = sorted(missed)
+                if len(ordered) > sub.maxsize:
+                    sub.replay_complete = False
+                    ordered = ordered[-sub.maxsize:]
+                for event_id in ordered:
+                    sub._deliver(event_id, missed[event_id])
+            for t in sub.topics:
+                self.by_topic.setdefault(t, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        sub.close()
+        with self.lock:
+            for t in sub.topics:
+                subs = self.by_topic.get(t)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self.by_topic[t]
+
+    def _fanout(self, event: dict, topics, event_id: int = None):
+        # the id is allocated and the event handed to every subscriber under one lock, so
+        # subscribers are given events in id order and a replay never overlaps live delivery
+        with self.lock:
+            if event_id is None:
+                event_id = next(self.ids)
+            targets = set()
+            for t in topics:
+                self.recent.setdefault(t, deque(maxlen=self.replay_size)).append((event_id, event))
+                targets |= self.by_topic.get(t, set())
+            for sub in targets:
+                sub.deliver(event_id, event)
+
+    def publish(self, event: dict, topics):
+        self.published += 1
+        self._fanout(event, topics)
+
+    def stats(self):
+        with self.lock:
+            subs = set().union(*self.by_topic.values()) if self.by_topic else set()
+        return {
+            "backend": type(self).__name__,
+            "subscribers": len(subs),
+            "topics": len(self.by_topic),
+            "published": self.published,
+            "dropped": sum(s.dropped for s in subs),
+        }
+
+    def close(self):
+        pass
+
+class SQLiteNotifier(InMemoryNotifier):
+    """Cross-process backend for `uvicorn --workers N`: every worker appends events to a
+    shared SQLite file and a background thread polls it for rows it has not seen yet."""
+    def __init__(self, path: str = NOTIFIER_SQLITE_PATH, poll_interval: float = NOTIFIER_POLL_INTERVAL,
+                 retention_seconds: int = NOTIFIER_RETENTION_SECONDS, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.outbox = queue.SimpleQueue()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    def _ensure_started(self):
+        # the file and the polling thread are set up on first use, not at import time
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is not None:
+                return
+            conn = self._connect()
+            conn.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, topics TEXT, payload TEXT, created_at REAL)")
+            self.last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+            self.first_id = self.last_id + 1
+            conn.close()
+            self.thread = threading.Thread(target=self._run, name="notifier-sqlite", daemon=True)
+            self.thread.start()
+
+    def subscribe(self, topics, last_event_id: int = None):
+        self._ensure_started()
+        return super().subscribe(topics, last_event_id)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def publish(self, event: dict, topics):
+        self._ensure_started()
+        self.published += 1
+        self.outbox.put((json.dumps(sorted(topics)), json.dumps(event, default=str), time.time()))
+        self.wakeup.set()
+
+    def _run(self):
+        conn = self._connect()
+        last_prune = time.time()
+        while not self.stopping:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            rows = []
+            while True:
+                try:
+                    rows.append(self.outbox.get_nowait())
+                except queue.Empty:
+                    break
+            if rows:
+                try:
+                    conn.executemany("INSERT INTO events (topics, payload, created_at) VALUES (?, ?, ?)", rows)
+                except sqlite3.OperationalError:
+                    # locked by another worker: retry on the next tick
+                    for r in rows:
+                        self.outbox.put(r)
+            try:
+                for event_id, topics, payload in conn.execute(
+                    "SELECT id, topics, payload FROM events WHERE id > ? ORDER BY id LIMIT 1000", (self.last_id,)
+                ).fetchall():
+                    self.last_id = event_id
+                    self._fanout(json.loads(payload), json.loads(topics), event_id)
+                if time.time() - last_prune > self.retention_seconds:
+                    conn.execute("DELETE FROM events WHERE created_at < ?", (time.time() - self.retention_seconds,))
+                    last_prune = time.time()
+            except sqlite3.OperationalError:
+                pass
+        conn.close()
+
+    def close(self):
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+def create_notifier(backend: str = NOTIFIER_BACKEND):
+    if backend == "sqlite":
+        return SQLiteNotifier()
+    return InMemoryNotifier()
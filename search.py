@@ -0,0 +1,101 @@
+from sqlalchemy import text
+import re
+import os
+
+# Task search per project. On SQLite an FTS5 index over project/title/description (external content:
+# the text lives only in `tasks`) answers ranked queries; other databases fall back to LIKE
+# scans through the same interface. crud keeps the index in sync when tasks are created.
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "auto")  # auto | fts5 | like
+# bm25 weights: a hit in the title counts more than one in the description
+SEARCH_TITLE_WEIGHT = float(os.environ.get("SEARCH_TITLE_WEIGHT", 4.0))
+MAX_SEARCH_TERMS = 8
+
+def parse_terms(query: str):
+    """Words of the user query (no operators, so any input is a valid MATCH expression)."""
+    return re.findall(r"\w+", query or "")[:MAX_SEARCH_TERMS]
+
+def _filters(status: str, assignee_id: int):
+    clauses, params = "", {}
+    if status is not None:
+        clauses += " AND t.status = :status"
+        params["status"] = status
+    if assignee_id is not None:
+        clauses += " AND t.assignee_id = :assignee_id"
+        params["assignee_id"] = assignee_id
+    return clauses, params
+
+class LikeSearch:
+    """Portable fallback: every term must appear in the title or the description; newest first."""
+    name = "like"
+
+    def install(self, engine):
+        pass
+
+    def index_statement(self):
+        # nothing to maintain
+        return None
+
+    def rebuild(self, db):
+        return 0
+
+    def search_statement(self, project_id: int, terms: list, status: str = None, assignee_id: int = None,
+                         limit: int = 100, offset: int = 0):
+        clauses, params = _filters(status, assignee_id)
+        for i, term in enumerate(terms):
+            clauses += f" AND (lower(t.title) LIKE :term{i} ESCAPE '\\' OR lower(t.description) LIKE :term{i} ESCAPE '\\')"
+            params[f"term{i}"] = "%" + term.lower().replace("\\", "\\\\").replace("_", "\\_") + "%"
+        sql = (
+            "SELECT t.id, t.title, t.status, t.assignee_id, NULL AS rank FROM tasks t"
+            f" WHERE t.project_id = :project_id{clauses} ORDER BY t.id DESC LIMIT :limit OFFSET :offset"
+        )
+        return text(sql).bindparams(project_id=project_id, limit=limit, offset=offset, **params)
+
+class FTS5Search(LikeSearch):
+    name = "fts5"
+
+    def install(self, engine):
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5("
+                "project_id, title, description, content='tasks', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+
+    def index_statement(self):
+        return text("INSERT INTO tasks_fts (rowid, project_id, title, description) VALUES (:id, :project_id, :title, :description)")
+
+    def rebuild(self, db):
+        db.execute(text("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')"))
+        return db.execute(text("SELECT count(*) FROM tasks")).scalar()
+
+    def search_statement(self, project_id: int, terms: list, status: str = None, assignee_id: int = None,
+                         limit: int = 100, offset: int = 0):
+        clauses, params = _filters(status, assignee_id)
+        # the project id is an indexed column too, so only that project's matches get ranked;
+        # quoted terms, the last one as a prefix ("search as you type")
+        match = f'project_id:"{int(project_id)}" AND (' + " ".join(f'"{t}"' for t in terms) + "*)"
+        sql = (
+            f"SELECT t.id, t.title, t.status, t.assignee_id, bm25(tasks_fts, 0.0, {SEARCH_TITLE_WEIGHT}, 1.0) AS rank"
+            " FROM tasks_fts JOIN tasks t ON t.id = tasks_fts.rowid"
+            f" WHERE tasks_fts MATCH :match AND t.project_id = :project_id{clauses}"
+            " ORDER BY rank, t.id LIMIT :limit OFFSET :offset"
+        )
+        return text(sql).bindparams(match=match, project_id=project_id, limit=limit, offset=offset, **params)
+
+def _fts5_available(engine):
+    try:
+        with engine.connect() as conn:
+            return conn.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar() == 1
+    except Exception:
+        return False
+
+backend = LikeSearch()
+
+def configure(engine, name: str = SEARCH_BACKEND):
+    """Pick the backend for this engine (called by db.init_db); its tables are created by the
+    schema migrations (`backend.install`)."""
+    global backend
+    if name == "auto":
+        name = "fts5" if engine.dialect.name == "sqlite" and _fts5_available(engine) else "like"
+    backend = FTS5Search() if name == "fts5" else LikeSearch()
+    return backend
@@ -1,8 +1,20 @@
+import os
+# cheapest bcrypt cost for tests; must be set before hashing is imported
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+# persist feed notifications inline so tests can read them back immediately
+os.environ.setdefault("NOTIFICATION_WRITE_MODE", "sync")
 import pytest
 from db import init_db as init_db_func
+from auth import principal_cache, membership_cache
+from etags import version_cache
+from workflows import workflow_cache
 
 @pytest.fixture(autouse=True)
 def fresh_db():
     # Each test gets a fresh in-memory DB
     init_db_func("sqlite:///:memory:")
+    principal_cache.clear()
+    membership_cache.clear()
+    version_cache.clear()
+    workflow_cache.clear()
     yield
@@ -0,0 +1,54 @@
+import asyncio
+from db import get_session, get_async_session
+from crud import create_user, create_project, get_task_history
+import crud_async
+
+def test_async_crud_shares_database_with_sync_layer():
+    db = get_session()
+    u = create_user("async_owner", "pw", db=db)
+    p = create_project("AsyncProj", u.id, db=db)
+
+    async def scenario():
+        adb = get_async_session()
+        try:
+            projects = await crud_async.get_user_projects(u.id, db=adb)
+            assert [x.id for x in projects] == [p.id]
+            t = await crud_async.create_task(p.id, "async task", db=adb)
+            res = await crud_async.move_task(t.id, "doing", u.id, db=adb)
+            assert res == {"ok": True, "from": "todo", "to": "doing", "project_id": p.id, "version": 2}
+            missing = await crud_async.move_task(9999, "done", u.id, db=adb)
+            assert missing["ok"] is False
+            return t.id
+        finally:
+            await adb.close()
+
+    tid = asyncio.run(scenario())
+    history = get_task_history(tid, db=db)
+    assert [(h.from_status, h.to_status) for h in history] == [("todo", "doing")]
+    db.close()
+
+def test_async_routes_use_one_async_session(monkeypatch):
+    from fastapi.testclient import TestClient
+    from main import app
+    from auth import principal_cache, membership_cache
+    import db as db_module
+    client = TestClient(app)
+    client.post("/auth/register", json={"username": "one_uow", "password": "pw"})
+    h = {"Authorization": f"Bearer {client.post('/auth/login', json={'username': 'one_uow', 'password': 'pw'}).json()['token']}"}
+    pid = client.post("/projects", json={"name": "UoW"}, headers=h).json()["id"]
+    tid = client.post(f"/tasks/{pid}/tasks", json={"title": "t"}, headers=h).json()["id"]
+
+    # the feed writer persists in its own transaction (write-behind); only the request's sessions count here
+    from notification_writer import notification_writer
+    async def skip(*args):
+        pass
+    monkeypatch.setattr(notification_writer, "enqueue_async", skip)
+    opened = []
+    for name in ("get_session", "get_async_session"):
+        original = getattr(db_module, name)
+        monkeypatch.setattr(db_module, name, lambda original=original, name=name: opened.append(name) or original())
+    # cold caches: authentication and membership are looked up on the route's own session
+    principal_cache.clear()
+    membership_cache.clear()
+    assert client.patch(f"/tasks/move/{tid}", json={"to_status": "doing"}, headers=h).status_code == 200
+    assert opened == ["get_async_session"]
@@ -14,3 +14,24 @@ def test_login_wrong_password():
     client.post("/auth/register", json={"username": "bob", "password": "pw"})
     r = client.post("/auth/login", json={"username": "bob", "password": "wrong"})
     assert r.status_code == 401
+
+def test_principal_is_cached_and_invalidated_on_user_delete():
+    from auth import principal_cache
+    from db import get_session, User
+    client.post("/auth/register", json={"username": "carol", "password": "pw"})
+    token = client.post("/auth/login", json={"username": "carol", "password": "pw"}).json()["token"]
+    h = {"Authorization": f"Bearer {token}"}
+    assert client.get("/projects", headers=h).status_code == 200
+    before = principal_cache.stats()
+    assert client.get("/projects", headers=h).status_code == 200
+    assert principal_cache.stats()["hits"] == before["hits"] + 1
+
+    db = get_session()
+    db.delete(db.query(User).filter_by(username="carol").first())
+    db.flush()
+    # dropped on commit, not at flush (a concurrent request would re-cache the committed row)
+    assert principal_cache.stats()["size"] == before["size"]
+    db.commit()
+    assert principal_cache.stats()["size"] == before["size"] - 1
+    db.close()
+    assert client.get("/projects", headers=h).status_code == 401
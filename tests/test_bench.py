@@ -0,0 +1,28 @@
+import json
+import bench
+
+def test_bench_run_writes_results_and_compare_flags_regressions(tmp_path):
+    out = tmp_path / "run.json"
+    rc = bench.main(["run", "--users", "3", "--projects", "1", "--tasks", "20", "--history", "1",
+                     "--concurrency", "2", "--requests", "10", "--subscribers", "3", "--events", "3",
+                     "--db", f"sqlite:///{tmp_path / 'bench.sqlite'}", "--out", str(out)])
+    assert rc == 0
+    report = json.loads(out.read_text())
+    assert set(report["scenarios"]) == {"login", "list_tasks", "move_task", "report", "sse_fanout"}
+    assert report["scenarios"]["list_tasks"]["errors"] == 0
+    assert report["scenarios"]["report"]["queries_per_request"] >= 1
+
+    slower = json.loads(out.read_text())
+    slower["scenarios"]["report"]["p99_ms"] = report["scenarios"]["report"]["p99_ms"] * 2 + 1
+    regressions = bench.compare(report, slower, threshold=0.10)
+    assert [(r[0], r[1]) for r in regressions] == [("report", "p99_ms")]
+    assert bench.compare(report, report, threshold=0.10) == []
+
+def test_bench_startup_runs_no_ddl_on_a_migrated_db(tmp_path):
+    out = tmp_path / "startup.json"
+    rc = bench.main(["startup", "--repeat", "1", "--db", f"sqlite:///{tmp_path / 'startup.sqlite'}", "--out", str(out)])
+    assert rc == 0
+    result = json.loads(out.read_text())["scenarios"]["startup"]
+    assert result["errors"] == 0
+    assert result["ddl_statements"] == 0
+    assert result["import_ms"] > 0
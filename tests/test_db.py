@@ -0,0 +1,114 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import text, inspect
+import sqlite3
+import asyncio
+import db as db_module
+from db import init_db, get_session, pool_stats
+from migrations import migrate, schema_version, SCHEMA_VERSION
+from main import app
+
+client = TestClient(app)
+
+def test_file_db_uses_queue_pool_and_wal(tmp_path):
+    init_db(f"sqlite:///{tmp_path / 'pool.sqlite'}", pool_size=3, max_overflow=2, create_schema=True)
+    stats = pool_stats()
+    assert stats["pool_class"] == "QueuePool"
+    assert stats["size"] == 3
+    s = get_session()
+    mode = s.execute(text("PRAGMA journal_mode")).scalar()
+    s.close()
+    assert mode.lower() == "wal"
+
+    # the async (aiosqlite) connections get the same settings
+    async def async_pragmas():
+        async with db_module.get_async_session() as adb:
+            return [(await adb.execute(text(f"PRAGMA {p}"))).scalar() for p in ("journal_mode", "synchronous", "foreign_keys")]
+    assert asyncio.run(async_pragmas()) == ["wal", 1, 1]
+    db_module.engine.dispose()
+
+def test_request_sessions_are_returned_to_pool(tmp_path):
+    init_db(f"sqlite:///{tmp_path / 'req.sqlite'}", create_schema=True)
+    client.post("/auth/register", json={"username": "pooled", "password": "pw"})
+    token = client.post("/auth/login", json={"username": "pooled", "password": "pw"}).json()["token"]
+    h = {"Authorization": f"Bearer {token}"}
+    for _ in range(5):
+        assert client.get("/projects", headers=h).status_code == 200
+    r = client.get("/health/db")
+    assert r.status_code == 200
+    assert r.json()["checkedout"] == 0
+    db_module.engine.dispose()
+
+def test_file_db_is_created_by_migrations_not_at_startup(tmp_path):
+    init_db(f"sqlite:///{tmp_path / 'migrate.sqlite'}")
+    assert schema_version() == 0
+    # the app refuses to start on an unmigrated database
+    try:
+        with TestClient(app):
+            raise AssertionError("startup should fail")
+    except RuntimeError as exc:
+        assert "manage.py migrate" in str(exc)
+    assert migrate() == list(range(1, SCHEMA_VERSION + 1))
+    assert migrate() == []
+    assert schema_version() == SCHEMA_VERSION
+    # the frozen migrations end up exactly where the models are
+    schema = inspect(db_module.engine)
+    for table in db_module.Base.metadata.sorted_tables:
+        assert {c["name"] for c in schema.get_columns(table.name)} == set(table.columns.keys()), table.name
+        assert {i["name"] for i in schema.get_indexes(table.name)} == {i.name for i in table.indexes}, table.name
+    with TestClient(app) as c:
+        assert c.post("/auth/register", json={"username": "migrated", "password": "pw"}).status_code == 200
+    db_module.engine.dispose()
+
+# the schema (and some data) of a database created before the migrations existed
+BASELINE_DDL = """
+CREATE TABLE users (id INTEGER NOT NULL, username VARCHAR(150) NOT NULL, password_hash VARCHAR(200) NOT NULL, PRIMARY KEY (id));
+CREATE INDEX ix_users_id ON users (id);
+CREATE UNIQUE INDEX ix_users_username ON users (username);
+CREATE TABLE notifications (id INTEGER NOT NULL, user_id INTEGER, message TEXT, created_at INTEGER, read BOOLEAN, PRIMARY KEY (id));
+CREATE TABLE projects (id INTEGER NOT NULL, name VARCHAR(200) NOT NULL, owner_id INTEGER NOT NULL, PRIMARY KEY (id),
+    FOREIGN KEY(owner_id) REFERENCES users (id));
+CREATE INDEX ix_projects_id ON projects (id);
+CREATE TABLE project_members (id INTEGER NOT NULL, project_id INTEGER, user_id INTEGER, role VARCHAR(50), PRIMARY KEY (id),
+    FOREIGN KEY(project_id) REFERENCES projects (id), FOREIGN KEY(user_id) REFERENCES users (id));
+CREATE TABLE invitations (id INTEGER NOT NULL, project_id INTEGER, token VARCHAR(100), expires_at INTEGER, created_by INTEGER,
+    used BOOLEAN, PRIMARY KEY (id), FOREIGN KEY(project_id) REFERENCES projects (id), FOREIGN KEY(created_by) REFERENCES users (id));
+CREATE UNIQUE INDEX ix_invitations_token ON invitations (token);
+CREATE TABLE tasks (id INTEGER NOT NULL, project_id INTEGER, title VARCHAR(300), description TEXT, status VARCHAR(50),
+    assignee_id INTEGER, created_at INTEGER, updated_at INTEGER, PRIMARY KEY (id), FOREIGN KEY(project_id) REFERENCES projects (id));
+CREATE TABLE task_history (id INTEGER NOT NULL, task_id INTEGER, from_status VARCHAR(50), to_status VARCHAR(50), changed_by INTEGER,
+    changed_at INTEGER, PRIMARY KEY (id), FOREIGN KEY(task_id) REFERENCES tasks (id));
+INSERT INTO users VALUES (1, 'legacy', 'x');
+INSERT INTO projects VALUES (1, 'Legacy', 1);
+INSERT INTO project_members VALUES (1, 1, 1, 'member'), (2, 1, 1, 'owner');
+INSERT INTO tasks VALUES (1, 1, 'Migrate the billing jobs', '', 'todo', NULL, 1700000000, 1700000000),
+    (2, 1, 'Old report', '', 'done', NULL, 1700000000, 1700000000), (3, 1, 'Another one', '', 'todo', NULL, 1700000000, 1700000000);
+INSERT INTO task_history VALUES (1, 2, 'todo', 'done', 1, 1700000100);
+INSERT INTO notifications VALUES (1, 1, 'unread', 1700000000, 0), (2, 1, 'seen', 1700000000, 1), (3, 1, 'unread too', 1700000000, 0);
+"""
+
+def test_migrating_a_baseline_database_adds_indexes_and_backfills(tmp_path):
+    from crud import project_report, get_unread_count, search_tasks, move_task, is_project_member
+    path = tmp_path / "legacy.sqlite"
+    with sqlite3.connect(path) as conn:
+        conn.executescript(BASELINE_DDL)
+    init_db(f"sqlite:///{path}")
+    assert schema_version() == 0
+    assert migrate() == list(range(1, SCHEMA_VERSION + 1))
+    with db_module.engine.connect() as conn:
+        indexes = {r[0] for r in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        members = conn.exec_driver_sql("SELECT id, role FROM project_members").all()
+    assert {"ux_project_members_project_user", "ix_tasks_project_status", "ix_tasks_project_id_id",
+            "ix_task_history_task_changed", "ix_notifications_user_created", "ix_notifications_read_created"} <= indexes
+    # duplicate memberships collapse into the oldest row, keeping the owner role
+    assert members == [(1, "owner")]
+    s = get_session()
+    try:
+        assert is_project_member(1, 1, db=s)
+        assert project_report(1, db=s) == {"todo": 2, "doing": 0, "done": 1}
+        assert get_unread_count(1, db=s) == 2
+        assert [r.id for r in search_tasks(1, "billing", db=s)] == [1]
+        assert move_task(1, "doing", 1, db=s)["ok"]
+        assert project_report(1, db=s) == {"todo": 1, "doing": 1, "done": 1}
+    finally:
+        s.close()
+    db_module.engine.dispose()
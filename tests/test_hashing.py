@@ -0,0 +1,33 @@
+from fastapi.testclient import TestClient
+import main
+from main import app
+from hashing import Hasher
+from db import get_session, User
+
+client = TestClient(app)
+
+def test_login_rehashes_when_cost_changes(monkeypatch):
+    client.post("/auth/register", json={"username": "rehash", "password": "pw"})
+    monkeypatch.setattr(main, "hasher", Hasher(rounds=5, executor="thread"))
+    r = client.post("/auth/login", json={"username": "rehash", "password": "pw"})
+    assert r.status_code == 200
+    db = get_session()
+    stored = db.query(User).filter_by(username="rehash").first().password_hash
+    db.close()
+    assert stored.startswith("$2b$05$")
+
+def test_full_pool_returns_503_with_retry_after(monkeypatch):
+    client.post("/auth/register", json={"username": "busy", "password": "pw"})
+    busy = Hasher(max_pending=0, executor="thread")
+    monkeypatch.setattr(main, "hasher", busy)
+    r = client.post("/auth/login", json={"username": "busy", "password": "pw"})
+    assert r.status_code == 503
+    assert "Retry-After" in r.headers
+    assert busy.stats()["rejected"] == 1
+
+def test_hasher_stats_record_latency():
+    client.post("/auth/register", json={"username": "timed", "password": "pw"})
+    client.post("/auth/login", json={"username": "timed", "password": "pw"})
+    stats = client.get("/health/hasher").json()
+    assert stats["hash"]["count"] >= 1
+    assert stats["verify"]["count"] >= 1
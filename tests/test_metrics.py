@@ -0,0 +1,29 @@
+import logging
+from fastapi.testclient import TestClient
+import metrics
+from main import app
+
+client = TestClient(app)
+
+def register_and_get_token(username):
+    client.post("/auth/register", json={"username": username, "password": "pw"})
+    r = client.post("/auth/login", json={"username": username, "password": "pw"})
+    return r.json()["token"]
+
+def test_server_timing_and_prometheus_histograms():
+    h = {"Authorization": f"Bearer {register_and_get_token('metered')}"}
+    r = client.post("/projects", json={"name": "M"}, headers=h)
+    timing = r.headers["Server-Timing"]
+    assert "db;dur=" in timing and "app;dur=" in timing
+    assert " 0 queries" not in timing and " 0 commits" not in timing
+
+    body = client.get("/metrics").text
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert 'http_request_duration_seconds_count{method="POST",route="/projects"}' in body
+    assert 'db_queries_per_request_bucket{method="POST",route="/projects",le="+Inf"}' in body
+
+def test_slow_query_log(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "SLOW_QUERY_MS", 0.000001)
+    with caplog.at_level(logging.WARNING, logger="sql.slow"):
+        client.post("/auth/register", json={"username": "slow", "password": "pw"})
+    assert any("slow query" in rec.message for rec in caplog.records)
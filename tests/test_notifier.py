@@ -0,0 +1,124 @@
+import asyncio
+from notifier import InMemoryNotifier, SQLiteNotifier, user_topic, project_topic
+
+def test_topic_routing_and_drop_oldest():
+    async def scenario():
+        n = InMemoryNotifier(maxsize=2, policy="drop_oldest")
+        a = n.subscribe([user_topic(1), project_topic(10)])
+        b = n.subscribe([project_topic(20)])
+        for i in range(3):
+            n.publish({"type": "x", "i": i}, [project_topic(10)])
+        n.publish({"type": "y"}, [project_topic(20)])
+        assert [(await a.get(timeout=0.1))[1]["i"] for _ in range(2)] == [1, 2]
+        assert a.dropped == 1
+        assert (await b.get(timeout=0.1))[1]["type"] == "y"
+        assert await b.get(timeout=0.01) is None
+        n.unsubscribe(a)
+        n.unsubscribe(b)
+        assert n.stats()["subscribers"] == 0
+    asyncio.run(scenario())
+
+def test_disconnect_policy_closes_slow_consumer():
+    async def scenario():
+        n = InMemoryNotifier(maxsize=1, policy="disconnect")
+        s = n.subscribe([user_topic(1)])
+        n.publish({"type": "a"}, [user_topic(1)])
+        n.publish({"type": "b"}, [user_topic(1)])
+        assert s.closed
+        assert (await s.get())[1]["type"] == "a"
+        assert await s.get() is None
+    asyncio.run(scenario())
+
+def test_replay_after_last_event_id():
+    async def scenario():
+        n = InMemoryNotifier(replay_size=3)
+        first = n.subscribe([project_topic(1), user_topic(7)])
+        n.publish({"i": 0}, [project_topic(1)])
+        n.publish({"i": 1}, [project_topic(1), user_topic(7)])
+        n.publish({"i": 2}, [project_topic(2)])
+        n.publish({"i": 3}, [user_topic(7)])
+        seen_id, _ = await first.get(timeout=0.1)
+        n.unsubscribe(first)
+
+        resumed = n.subscribe([project_topic(1), user_topic(7)], last_event_id=seen_id)
+        assert resumed.replay_complete
+        replayed = [(await resumed.get(timeout=0.1))[1]["i"] for _ in range(2)]
+        assert replayed == [1, 3]
+        assert await resumed.get(timeout=0.01) is None
+
+        for i in range(4, 8):
+            n.publish({"i": i}, [project_topic(1)])
+        stale = n.subscribe([project_topic(1)], last_event_id=seen_id)
+        assert not stale.replay_complete
+    asyncio.run(scenario())
+
+def test_publishes_from_threads_and_the_loop_both_arrive():
+    import threading
+    async def scenario():
+        n = InMemoryNotifier()
+        sub = n.subscribe([user_topic(1)])
+        # a threadpool route: its event reaches the loop through call_soon_threadsafe
+        worker = threading.Thread(target=n.publish, args=({"type": "from_thread"}, [user_topic(1)]))
+        worker.start()
+        worker.join()
+        n.publish({"type": "from_loop"}, [user_topic(1)])
+        got = [(await sub.get(timeout=0.1))[1]["type"] for _ in range(2)]
+        assert sorted(got) == ["from_loop", "from_thread"]
+    asyncio.run(scenario())
+
+def test_sqlite_backend_delivers_across_instances(tmp_path):
+    path = str(tmp_path / "bus.sqlite")
+    worker_a = SQLiteNotifier(path=path, poll_interval=0.02)
+    worker_b = SQLiteNotifier(path=path, poll_interval=0.02)
+
+    async def scenario():
+        sub = worker_b.subscribe([project_topic(5)])
+        worker_a.publish({"type": "task_created", "project_id": 5}, [project_topic(5)])
+        worker_a.publish({"type": "other"}, [project_topic(6)])
+        event_id, event = await sub.get(timeout=2)
+        assert event == {"type": "task_created", "project_id": 5}
+        assert event_id >= 1
+        assert await sub.get(timeout=0.2) is None
+    try:
+        asyncio.run(scenario())
+    finally:
+        worker_a.close()
+        worker_b.close()
+
+def test_notification_writer_batches_in_background():
+    from notification_writer import NotificationWriter
+    from db import session_scope
+    from crud import create_user, get_notifications_for_user
+    with session_scope() as db:
+        user_id = create_user("writer", "pw", db=db).id
+    w = NotificationWriter(mode="background", flush_ms=10000, flush_rows=3)
+    for i in range(5):
+        w.enqueue(user_id, f"n{i}")
+    w.close()
+    with session_scope() as db:
+        rows = get_notifications_for_user(user_id, limit=10, db=db)
+    assert sorted(r.message for r in rows) == [f"n{i}" for i in range(5)]
+    stats = w.stats()
+    assert stats["flushed_rows"] == 5 and stats["queue_depth"] == 0
+    assert stats["batches"] < 5
+
+def test_notification_writer_never_writes_on_the_event_loop():
+    import threading
+    from notification_writer import NotificationWriter
+    w = NotificationWriter(mode="background", flush_ms=10000, flush_rows=100, max_queue=2)
+    writes = []
+    w._write = lambda rows: writes.append((threading.current_thread(), len(rows)))
+
+    async def scenario():
+        for i in range(3):
+            await w.enqueue_async(1, f"n{i}")
+        # overloaded: the extra row is dropped and counted instead of flushing in the request
+        assert writes == [] and w.stats()["dropped"] == 1
+        w.mode = "sync"
+        await w.enqueue_async(1, "inline")
+        return threading.current_thread()
+    loop_thread = asyncio.run(scenario())
+    assert writes[0][0] is not loop_thread
+    w.mode = "background"
+    w.close()
+    assert sum(n for _, n in writes) == 3
@@ -28,3 +28,27 @@ def test_create_invite_join_flow():
     r4 = client.get("/projects", headers=headers_m)
     assert r4.status_code == 200
     assert any(p["id"] == pid for p in r4.json())
+
+def test_task_routes_require_membership_and_join_invalidates_cache():
+    from auth import membership_cache
+    owner = {"Authorization": f"Bearer {register_and_get_token('authz_owner')}"}
+    other = {"Authorization": f"Bearer {register_and_get_token('authz_other')}"}
+    pid = client.post("/projects", json={"name": "Private"}, headers=owner).json()["id"]
+    tid = client.post(f"/tasks/{pid}/tasks", json={"title": "secret"}, headers=owner).json()["id"]
+
+    assert client.get(f"/tasks/{pid}/tasks", headers=other).status_code == 403
+    assert client.get(f"/projects/{pid}/report", headers=other).status_code == 403
+    assert client.post(f"/tasks/{pid}/tasks", json={"title": "x"}, headers=other).status_code == 403
+    assert client.post(f"/projects/{pid}/invite", headers=other).status_code == 403
+    assert client.patch(f"/tasks/move/{tid}", json={"to_status": "done"}, headers=other).status_code == 403
+    assert client.get(f"/tasks/history/{tid}", headers=other).status_code == 403
+    assert client.get("/tasks/history/999999", headers=other).status_code == 404
+    r = client.patch("/tasks/bulk/move", json={"moves": [{"task_id": tid, "to_status": "done"}]}, headers=other)
+    assert r.json()["results"][0]["reason"] == "not_found"
+
+    token = client.post(f"/projects/{pid}/invite", headers=owner).json()["token"]
+    assert client.post(f"/projects/{pid}/join", json={"token": token}, headers=other).status_code == 200
+    before = membership_cache.stats()["hits"]
+    assert client.get(f"/tasks/{pid}/tasks", headers=other).status_code == 200
+    assert client.get(f"/tasks/history/{tid}", headers=other).status_code == 200
+    assert membership_cache.stats()["hits"] == before + 1
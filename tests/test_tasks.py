@@ -1,4 +1,5 @@
 from fastapi.testclient import TestClient
+from concurrent.futures import ThreadPoolExecutor
 from main import app
 
 client = TestClient(app)
@@ -45,3 +46,250 @@ def test_project_report_counts():
     assert r_report.status_code == 200
     body = r_report.json()
     assert "todo" in body and "doing" in body and "done" in body
+
+def test_report_counters_follow_moves_and_rebuild():
+    from crud import project_report, rebuild_status_counts
+    from db import get_session, ProjectStatusCount
+    token = register_and_get_token("counter")
+    h = {"Authorization": f"Bearer {token}"}
+    pid = client.post("/projects", json={"name": "Counters"}, headers=h).json()["id"]
+    ids = [client.post(f"/tasks/{pid}/tasks", json={"title": f"T{i}"}, headers=h).json()["id"] for i in range(3)]
+    client.patch(f"/tasks/move/{ids[0]}", json={"to_status": "doing"}, headers=h)
+    client.patch(f"/tasks/move/{ids[1]}", json={"to_status": "done"}, headers=h)
+    client.patch(f"/tasks/move/{ids[1]}", json={"to_status": "done"}, headers=h)
+    expected = {"todo": 1, "doing": 1, "done": 1}
+    assert client.get(f"/projects/{pid}/report", headers=h).json() == expected
+
+    etag = client.get(f"/projects/{pid}/report", headers=h).headers["ETag"]
+
+    db = get_session()
+    db.query(ProjectStatusCount).delete()
+    db.commit()
+    assert project_report(pid, db=db) == {"todo": 0, "doing": 0, "done": 0}
+    rebuild_status_counts(db=db)
+    assert project_report(pid, db=db) == expected
+    db.close()
+    # the repair invalidates cached reports
+    assert client.get(f"/projects/{pid}/report", headers={**h, "If-None-Match": etag}).status_code == 200
+
+def test_keyset_pagination_for_tasks_history_and_notifications():
+    token = register_and_get_token("pager")
+    h = {"Authorization": f"Bearer {token}"}
+    pid = client.post("/projects", json={"name": "Pages"}, headers=h).json()["id"]
+    ids = [client.post(f"/tasks/{pid}/tasks", json={"title": f"T{i}"}, headers=h).json()["id"] for i in range(5)]
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2} | ({"cursor": cursor} if cursor else {})
+        r = client.get(f"/tasks/{pid}/tasks", params=params, headers=h)
+        assert r.status_code == 200
+        seen += [t["id"] for t in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == ids
+
+    for s in ("doing", "done", "todo"):
+        client.patch(f"/tasks/move/{ids[0]}", json={"to_status": s}, headers=h)
+    first = client.get(f"/tasks/history/{ids[0]}", params={"limit": 2}, headers=h)
+    rest = client.get(f"/tasks/history/{ids[0]}", params={"limit": 2, "cursor": first.headers["X-Next-Cursor"]}, headers=h)
+    assert [x["to_status"] for x in first.json() + rest.json()] == ["doing", "done", "todo"]
+
+    page1 = client.get("/notifications", params={"limit": 4}, headers=h)
+    page2 = client.get("/notifications", params={"limit": 4, "cursor": page1.headers["X-Next-Cursor"]}, headers=h)
+    all_ids = [n["id"] for n in page1.json() + page2.json()]
+    assert len(all_ids) == 8 and all_ids == sorted(all_ids, reverse=True)
+
+    assert client.get(f"/tasks/{pid}/tasks", params={"cursor": "abc"}, headers=h).status_code == 400
+
+def test_bulk_create_and_bulk_move():
+    token = register_and_get_token("bulker")
+    h = {"Authorization": f"Bearer {token}"}
+    pid = client.post("/projects", json={"name": "Bulk"}, headers=h).json()["id"]
+    tasks = [{"title": f"T{i}"} for i in range(1000)] + [{"title": "  "}]
+    r = client.post(f"/tasks/{pid}/tasks/bulk", json={"tasks": tasks}, headers=h)
+    assert r.status_code == 200
+    body = r.json()
+    assert body["created"] == 1000 and body["failed"] == 1
+    assert body["results"][-1] == {"index": 1000, "ok": False, "reason": "empty_title"}
+    ids = [x["id"] for x in body["results"] if x["ok"]]
+    assert len(set(ids)) == 1000
+
+    moves = [{"task_id": tid, "to_status": "doing"} for tid in ids[:600]]
+    moves += [{"task_id": ids[0], "to_status": "done"}, {"task_id": 999999, "to_status": "done"}, {"task_id": ids[1], "to_status": "nope"}]
+    r2 = client.patch("/tasks/bulk/move", json={"moves": moves}, headers=h)
+    assert r2.status_code == 200
+    assert r2.json()["moved"] == 601 and r2.json()["failed"] == 2
+    assert client.get(f"/projects/{pid}/report", headers=h).json() == {"todo": 400, "doing": 599, "done": 1}
+    history = client.get(f"/tasks/history/{ids[0]}", headers=h).json()
+    assert [(x["from_status"], x["to_status"]) for x in history] == [("todo", "doing"), ("doing", "done")]
+    # one aggregated notification per batch
+    assert len(client.get("/notifications", headers=h).json()) == 2
+
+def test_unread_counter_mark_read_and_retention():
+    from db import session_scope
+    from crud import purge_read_notifications, get_notifications_for_user, rebuild_unread_counts, get_unread_count, get_user_by_username, now_ts
+    token = register_and_get_token("reader")
+    h = {"Authorization": f"Bearer {token}"}
+    pid = client.post("/projects", json={"name": "Inbox"}, headers=h).json()["id"]
+    for i in range(4):
+        client.post(f"/tasks/{pid}/tasks", json={"title": f"T{i}"}, headers=h)
+    assert client.get("/notifications/unread-count", headers=h).json() == {"unread": 4}
+
+    ids = sorted(n["id"] for n in client.get("/notifications", headers=h).json())
+    r = client.post("/notifications/read", json={"from_id": ids[0], "to_id": ids[1]}, headers=h)
+    assert r.json() == {"marked": 2, "unread": 2}
+    # the page cursor marks that row and everything older; already-read rows are not counted twice
+    page = client.get("/notifications", params={"limit": 1}, headers=h)
+    r = client.post("/notifications/read", json={"cursor": page.headers["X-Next-Cursor"]}, headers=h)
+    assert r.json() == {"marked": 2, "unread": 0}
+    assert client.post("/notifications/read", json={"cursor": "x"}, headers=h).status_code == 400
+
+    client.post(f"/tasks/{pid}/tasks", json={"title": "late"}, headers=h)
+    with session_scope() as db:
+        assert purge_read_notifications(now_ts() + 1, batch_size=3, db=db) == 4
+        uid = get_user_by_username("reader", db=db).id
+        remaining = get_notifications_for_user(uid, db=db)
+        assert [n.read for n in remaining] == [False]
+        rebuild_unread_counts(db=db)
+        unread = get_unread_count(uid, db=db)
+    assert unread == client.get("/notifications/unread-count", headers=h).json()["unread"] == 1
+
+def test_conditional_gets_with_etags():
+    token = register_and_get_token("poller")
+    h = {"Authorization": f"Bearer {token}"}
+    pid = client.post("/projects", json={"name": "Polled"}, headers=h).json()["id"]
+    tid = client.post(f"/tasks/{pid}/tasks", json={"title": "T"}, headers=h).json()["id"]
+    client.patch(f"/tasks/move/{tid}", json={"to_status": "doing"}, headers=h)
+
+    urls = ["/projects", f"/tasks/{pid}/tasks", f"/projects/{pid}/report", f"/tasks/history/{tid}"]
+    etags = {}
+    for url in urls:
+        r = client.get(url, headers=h)
+        assert r.status_code == 200 and r.headers["ETag"].startswith('"')
+        etags[url] = r.headers["ETag"]
+        r = client.get(url, headers={**h, "If-None-Match": etags[url]})
+        assert r.status_code == 304 and r.content == b""
+        # served from the cached version stamp: no SQL at all
+        assert "0 queries" in r.headers["Server-Timing"]
+    # pagination parameters are part of the tag
+    assert client.get(f"/tasks/{pid}/tasks", params={"limit": 1}, headers=h).headers["ETag"] != etags[f"/tasks/{pid}/tasks"]
+
+    client.patch(f"/tasks/move/{tid}", json={"to_status": "done"}, headers=h)
+    for url in urls[1:]:
+        r = client.get(url, headers={**h, "If-None-Match": etags[url]})
+        assert r.status_code == 200 and r.headers["ETag"] != etags[url]
+    assert client.get("/projects", headers={**h, "If-None-Match": etags["/projects"]}).status_code == 304
+    client.post("/projects", json={"name": "Another"}, headers=h)
+    assert client.get("/projects", headers={**h, "If-None-Match": etags["/projects"]}).status_code == 200
+
+def test_moves_are_conditional_and_conflicts_return_409(tmp_path):
+    token = register_and_get_token("mover")
+    h = {"Authorization": f"Bearer {token}"}
+    pid = client.post("/projects", json={"name": "Board"}, headers=h).json()["id"]
+    tid = client.post(f"/tasks/{pid}/tasks", json={"title": "Card"}, headers=h).json()["id"]
+    assert client.get(f"/tasks/{pid}/tasks", headers=h).json()[0]["version"] == 1
+
+    r = client.patch(f"/tasks/move/{tid}", json={"to_status": "doing", "expected_status": "todo"}, headers=h)
+    assert r.status_code == 200 and r.json()["version"] == 2
+    etag = r.headers["ETag"]
+    # a stale board: the card is no longer in "todo"
+    r = client.patch(f"/tasks/move/{tid}", json={"to_status": "done", "expected_status": "todo"}, headers=h)
+    assert r.status_code == 409
+    assert r.json()["detail"] == {"reason": "conflict", "status": "doing", "version": 2}
+    assert r.headers["ETag"] == etag
+    assert client.patch(f"/tasks/move/{tid}", json={"to_status": "done"}, headers={**h, "If-Match": etag}).status_code == 200
+    assert client.patch(f"/tasks/move/{tid}", json={"to_status": "todo"}, headers={**h, "If-Match": etag}).status_code == 409
+    assert client.patch(f"/tasks/move/{tid}", json={"to_status": "todo"}, headers={**h, "If-Match": f'"t{tid + 1}.3"'}).status_code == 409
+    history = client.get(f"/tasks/history/{tid}", headers=h).json()
+    assert [(x["from_status"], x["to_status"]) for x in history] == [("todo", "doing"), ("doing", "done")]
+    assert client.get(f"/projects/{pid}/report", headers=h).json()["done"] == 1
+
+    # parallel boards on a file database: one winner per expected state, and history stays a chain
+    from db import init_db, session_scope
+    from crud import create_user, create_project, create_task, move_task, get_task_history
+    init_db(f"sqlite:///{tmp_path / 'moves.sqlite'}", create_schema=True)
+    with session_scope() as db:
+        user_id = create_user("racer", "pw", db=db).id
+        task_id = create_task(create_project("Race", user_id, db=db).id, "Card", db=db).id
+
+    def move(to_status, expected=None):
+        with session_scope() as db:
+            return move_task(task_id, to_status, user_id, expected_status=expected, db=db)
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: move("doing", "todo"), range(8)))
+        assert sum(r["ok"] for r in results) == 1
+        assert {r["reason"] for r in results if not r["ok"]} == {"conflict"}
+        # unconditional moves retry on a lost race (and only report a conflict after MOVE_RETRIES)
+        moved = sum(r["ok"] for r in pool.map(move, ["todo", "doing", "done"] * 10))
+    with session_scope() as db:
+        history = get_task_history(task_id, db=db)
+    assert moved > 0 and len(history) == 1 + moved
+    assert all(a.to_status == b.from_status for a, b in zip(history, history[1:]))
+
+def test_bulk_move_skips_tasks_moved_after_planning(tmp_path, monkeypatch):
+    import crud
+    from db import init_db, session_scope
+    init_db(f"sqlite:///{tmp_path / 'bulk.sqlite'}", create_schema=True)
+    with session_scope() as db:
+        user_id = crud.create_user("bulk_racer", "pw", db=db).id
+        project_id = crud.create_project("Race", user_id, db=db).id
+        a, b = (crud.create_task(project_id, t, db=db).id for t in ("A", "B"))
+
+    plan = crud.plan_bulk_moves
+    def plan_then_race(*args):
+        planned = plan(*args)
+        # another request moves B between the read and the UPDATE
+        with session_scope() as other:
+            assert crud.move_task(b, "done", user_id, db=other)["ok"]
+        return planned
+    monkeypatch.setattr(crud, "plan_bulk_moves", plan_then_race)
+
+    with session_scope() as db:
+        results = crud.bulk_move_tasks([{"task_id": a, "to_status": "doing"}, {"task_id": b, "to_status": "doing"}], user_id, db=db)
+    assert [(r["ok"], r.get("reason")) for r in results] == [(True, None), (False, "conflict")]
+    with session_scope() as db:
+        assert crud.project_report(project_id, db=db) == {"todo": 0, "doing": 1, "done": 1}
+        assert [(h.from_status, h.to_status) for h in crud.get_task_history(b, db=db)] == [("todo", "done")]
+
+def test_ranked_project_search_with_filters():
+    from db import session_scope
+    from crud import rebuild_search_index
+    token = register_and_get_token("searcher")
+    h = {"Authorization": f"Bearer {token}"}
+    pid = client.post("/projects", json={"name": "Search"}, headers=h).json()["id"]
+    other = client.post("/projects", json={"name": "Other"}, headers=h).json()["id"]
+    first = client.post(f"/tasks/{pid}/tasks", json={"title": "Facturación mensual", "description": "enviar reporte"}, headers=h).json()["id"]
+    client.post(f"/tasks/{pid}/tasks/bulk", json={"tasks": [
+        {"title": "Reporte anual", "description": "revisar facturacion"},
+        {"title": "Deploy", "description": "sin relación"},
+    ]}, headers=h)
+    client.post(f"/tasks/{other}/tasks", json={"title": "Facturación otra"}, headers=h)
+
+    r = client.get(f"/tasks/{pid}/search", params={"q": "facturacion"}, headers=h)
+    assert r.status_code == 200
+    # accents are ignored and a title hit ranks above a description hit
+    assert [t["title"] for t in r.json()] == ["Facturación mensual", "Reporte anual"]
+    assert [t["title"] for t in client.get(f"/tasks/{pid}/search", params={"q": "rep"}, headers=h).json()] == ["Reporte anual", "Facturación mensual"]
+
+    client.patch(f"/tasks/move/{first}", json={"to_status": "done"}, headers=h)
+    r = client.get(f"/tasks/{pid}/search", params={"q": "facturacion", "status": "done"}, headers=h)
+    assert [t["id"] for t in r.json()] == [first]
+    page = client.get(f"/tasks/{pid}/search", params={"q": "facturacion", "limit": 1}, headers=h)
+    rest = client.get(f"/tasks/{pid}/search", params={"q": "facturacion", "limit": 1, "cursor": page.headers["X-Next-Cursor"]}, headers=h)
+    assert len(page.json()) == len(rest.json()) == 1 and page.json()[0]["id"] != rest.json()[0]["id"]
+    assert client.get(f"/tasks/{pid}/search", params={"q": '"*'}, headers=h).status_code == 400
+
+    with session_scope() as db:
+        assert rebuild_search_index(db=db) == 4
+    assert len(client.get(f"/tasks/{pid}/search", params={"q": "facturacion"}, headers=h).json()) == 2
+
+def test_counters_are_single_statement_upserts():
+    from sqlalchemy.dialects import postgresql
+    from crud import status_count_upsert, unread_count_upsert, version_upsert
+    sql = str(status_count_upsert("postgresql", 1, "doing", 1, limit=3).compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (project_id, status) DO UPDATE SET count = (project_status_counts.count + excluded.count)" in sql
+    assert "WHERE project_status_counts.count + %(count_1)s <= %(param_1)s" in sql
+    assert "ON CONFLICT (user_id)" in str(unread_count_upsert("postgresql", 1, 1).compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (scope, ref_id)" in str(version_upsert("postgresql", "project", 1).compile(dialect=postgresql.dialect()))
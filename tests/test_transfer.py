@@ -0,0 +1,92 @@
+import json
+from fastapi.testclient import TestClient
+from main import app
+import transfer
+
+client = TestClient(app)
+
+def register_and_get_token(username):
+    client.post("/auth/register", json={"username": username, "password": "pw"})
+    r = client.post("/auth/login", json={"username": username, "password": "pw"})
+    return r.json()["token"]
+
+def test_ndjson_round_trip_and_csv_export(monkeypatch):
+    h = {"Authorization": f"Bearer {register_and_get_token('exporter')}"}
+    pid = client.post("/projects", json={"name": "Origen"}, headers=h).json()["id"]
+    invite = client.post(f"/projects/{pid}/invite", headers=h).json()["token"]
+    hm = {"Authorization": f"Bearer {register_and_get_token('helper')}"}
+    client.post(f"/projects/{pid}/join", json={"token": invite}, headers=hm)
+    client.post(f"/tasks/{pid}/tasks/bulk", json={"tasks": [{"title": f"Tarea {i}"} for i in range(5)]}, headers=h)
+    ids = [t["id"] for t in client.get(f"/tasks/{pid}/tasks", headers=h).json()]
+    for tid in ids[:3]:
+        client.patch(f"/tasks/move/{tid}", json={"to_status": "doing"}, headers=h)
+        client.patch(f"/tasks/move/{tid}", json={"to_status": "done"}, headers=hm)
+
+    r = client.get(f"/projects/{pid}/export", headers=h)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("application/x-ndjson")
+    records = [json.loads(line) for line in r.text.splitlines()]
+    assert [x["type"] for x in records[:6]] == ["project", "workflow", "member", "member", "task", "history"]
+    assert sum(x["type"] == "history" for x in records) == 6
+
+    csv_rows = client.get(f"/projects/{pid}/export", params={"format": "csv", "kind": "history"}, headers=h).text.splitlines()
+    assert csv_rows[0] == "task_id,from_status,to_status,changed_by,changed_at" and len(csv_rows) == 7
+
+    # tiny chunks: history of a task can land in the chunk after the task itself
+    monkeypatch.setattr(transfer, "IMPORT_CHUNK", 2)
+    body = r.content + b"not json\n"
+    r2 = client.post("/projects/import", params={"name": "Copia"}, content=body, headers=h)
+    assert r2.status_code == 200
+    report = r2.json()
+    assert (report["members"], report["tasks"], report["history"]) == (1, 5, 6)
+    assert report["skipped"] == {"invalid": 1, "unknown_members": 0, "unshared_members": 0, "orphan_history": 0}
+    new_pid = report["project_id"]
+    assert client.get(f"/projects/{new_pid}/report", headers=h).json() == {"todo": 2, "doing": 0, "done": 3}
+    new_ids = [t["id"] for t in client.get(f"/tasks/{new_pid}/tasks", headers=hm).json()]
+    assert len(new_ids) == 5 and not set(new_ids) & set(ids)
+    moves = client.get(f"/tasks/history/{new_ids[0]}", headers=h).json()
+    assert [m["to_status"] for m in moves] == ["doing", "done"]
+    assert len(client.get(f"/tasks/{new_pid}/search", params={"q": "tarea"}, headers=h).json()) == 5
+
+def test_import_only_adds_users_the_importer_already_works_with():
+    h = {"Authorization": f"Bearer {register_and_get_token('importer')}"}
+    pid = client.post("/projects", json={"name": "Shared"}, headers=h).json()["id"]
+    invite = client.post(f"/projects/{pid}/invite", headers=h).json()["token"]
+    hc = {"Authorization": f"Bearer {register_and_get_token('colleague')}"}
+    client.post(f"/projects/{pid}/join", json={"token": invite}, headers=hc)
+    hs = {"Authorization": f"Bearer {register_and_get_token('stranger')}"}
+    body = "\n".join(json.dumps(x) for x in [
+        {"type": "project", "name": "Crafted"},
+        {"type": "member", "user_id": 1, "username": "colleague", "role": "owner"},
+        {"type": "member", "user_id": 2, "username": "stranger", "role": "owner"},
+    ]).encode()
+    report = client.post("/projects/import", content=body, headers=h).json()
+    assert report["members"] == 1 and report["skipped"]["unshared_members"] == 1
+    new_pid = report["project_id"]
+    assert client.get(f"/projects/{new_pid}/workflow", headers=hs).status_code == 403
+    # the colleague joins as a plain member
+    assert client.put(f"/projects/{new_pid}/workflow", json={"statuses": [{"name": "todo", "category": "todo"}]}, headers=hc).status_code == 403
+    assert client.get(f"/projects/{new_pid}/workflow", headers=hc).status_code == 200
+
+def test_malformed_records_are_skipped_not_fatal():
+    h = {"Authorization": f"Bearer {register_and_get_token('careful')}"}
+    records = [
+        {"type": "project", "name": "Checked"},
+        {"type": "workflow", "statuses": [{"name": "open", "category": "todo"}, {"name": "closed", "category": "done"}]},
+        {"type": "member", "user_id": [1], "username": "careful"},
+        {"type": "task", "id": 1, "title": "ok", "status": "closed"},
+        {"type": "task", "id": 2, "title": "dict description", "description": {"a": 1}},
+        {"type": "task", "id": 3, "title": "list assignee", "assignee_id": [1]},
+        {"type": "task", "id": 4, "title": "text timestamp", "created_at": "yesterday"},
+        {"type": "task", "id": 5, "title": "long status", "status": "x" * 80},
+        {"type": "task", "id": 6, "title": "foreign status", "status": "todo"},
+        {"type": "task", "id": 7, "title": "default status"},
+        {"type": "history", "task_id": 1, "from_status": "open", "to_status": "closed", "changed_by": [2]},
+        {"type": "history", "task_id": 1, "from_status": "open", "to_status": "closed", "changed_at": 1700000000},
+    ]
+    body = "\n".join(json.dumps(x) for x in records).encode()
+    r = client.post("/projects/import", content=body, headers=h)
+    assert r.status_code == 200
+    report = r.json()
+    assert (report["tasks"], report["history"], report["skipped"]["invalid"]) == (2, 1, 7)
+    assert report["invalid_lines"] == [3, 5, 6, 7, 8, 9, 11]
+    assert client.get(f"/projects/{report['project_id']}/report", headers=h).json() == {"open": 1, "closed": 1}
@@ -0,0 +1,80 @@
+from fastapi.testclient import TestClient
+from concurrent.futures import ThreadPoolExecutor
+from main import app
+
+client = TestClient(app)
+
+def register_and_get_token(username):
+    client.post("/auth/register", json={"username": username, "password": "pw"})
+    r = client.post("/auth/login", json={"username": username, "password": "pw"})
+    return r.json()["token"]
+
+BOARD = {
+    "statuses": [
+        {"name": "backlog", "category": "todo"},
+        {"name": "dev", "category": "doing", "wip_limit": 1},
+        {"name": "review", "category": "doing"},
+        {"name": "shipped", "category": "done"},
+    ],
+    "transitions": {"backlog": ["dev"], "dev": ["review", "backlog"], "review": ["dev", "shipped"]},
+}
+
+def test_project_workflow_drives_moves_wip_limits_and_reports():
+    token = register_and_get_token("wf_owner")
+    h = {"Authorization": f"Bearer {token}"}
+    pid = client.post("/projects", json={"name": "Custom"}, headers=h).json()["id"]
+    default = client.get(f"/projects/{pid}/workflow", headers=h).json()
+    assert [s["name"] for s in default["statuses"]] == ["todo", "doing", "done"]
+    assert default["transitions"]["todo"] == ["doing", "done"]
+
+    r = client.put(f"/projects/{pid}/workflow", json={**BOARD, "transitions": {"backlog": ["nowhere"]}}, headers=h)
+    assert r.status_code == 400
+    r = client.put(f"/projects/{pid}/workflow", json=BOARD, headers=h)
+    assert r.status_code == 200 and r.json()["transitions"]["review"] == ["dev", "shipped"]
+
+    t1, t2 = (client.post(f"/tasks/{pid}/tasks", json={"title": t}, headers=h).json() for t in ("A", "B"))
+    assert t1["status"] == "backlog"
+    assert client.patch(f"/tasks/move/{t1['id']}", json={"to_status": "done"}, headers=h).status_code == 400
+    r = client.patch(f"/tasks/move/{t1['id']}", json={"to_status": "shipped"}, headers=h)
+    assert r.status_code == 409 and r.json()["detail"] == {"reason": "transition_not_allowed", "status": "backlog", "allowed": ["dev"]}
+    assert client.patch(f"/tasks/move/{t1['id']}", json={"to_status": "dev"}, headers=h).status_code == 200
+    r = client.patch(f"/tasks/move/{t2['id']}", json={"to_status": "dev"}, headers=h)
+    assert r.status_code == 409 and r.json()["detail"] == {"reason": "wip_limit", "status": "dev", "limit": 1}
+
+    r = client.patch("/tasks/bulk/move", json={"moves": [
+        {"task_id": t1["id"], "to_status": "review"}, {"task_id": t2["id"], "to_status": "dev"},
+        {"task_id": t2["id"], "to_status": "shipped"},
+    ]}, headers=h)
+    assert [x.get("reason") for x in r.json()["results"]] == [None, None, "transition_not_allowed"]
+    assert client.get(f"/projects/{pid}/report", headers=h).json() == {"backlog": 0, "dev": 1, "review": 1, "shipped": 0}
+
+    # statuses still holding tasks cannot be dropped
+    r = client.put(f"/projects/{pid}/workflow", json={"statuses": [{"name": "backlog", "category": "todo"}, {"name": "dev", "category": "doing"}]}, headers=h)
+    assert r.status_code == 409 and r.json()["detail"] == {"reason": "in_use", "statuses": ["review"]}
+
+    other = {"Authorization": f"Bearer {register_and_get_token('wf_member')}"}
+    invite = client.post(f"/projects/{pid}/invite", headers=h).json()["token"]
+    client.post(f"/projects/{pid}/join", json={"token": invite}, headers=other)
+    assert client.get(f"/projects/{pid}/workflow", headers=other).status_code == 200
+    assert client.put(f"/projects/{pid}/workflow", json=BOARD, headers=other).status_code == 403
+
+def test_wip_limit_holds_under_parallel_moves(tmp_path):
+    from db import init_db, session_scope
+    from crud import create_user, create_project, create_task, move_task, save_workflow, project_report
+    init_db(f"sqlite:///{tmp_path / 'wip.sqlite'}", create_schema=True)
+    with session_scope() as db:
+        user_id = create_user("wip", "pw", db=db).id
+        project_id = create_project("WIP", user_id, db=db).id
+        save_workflow(project_id, [{"name": "todo", "category": "todo"}, {"name": "doing", "category": "doing", "wip_limit": 3}], db=db)
+        task_ids = [create_task(project_id, f"T{i}", db=db).id for i in range(12)]
+
+    def move(task_id):
+        with session_scope() as db:
+            return move_task(task_id, "doing", user_id, db=db)
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(move, task_ids))
+    assert sum(r["ok"] for r in results) == 3
+    assert {r["reason"] for r in results if not r["ok"]} <= {"wip_limit", "conflict"}
+    with session_scope() as db:
+        assert project_report(project_id, db=db) == {"todo": 9, "doing": 3}
@@ -0,0 +1,293 @@
+from sqlalchemy import select, insert, and_
+from sqlalchemy.orm import aliased
+import csv
+import io
+import json
+import os
+from db import get_session, Project, ProjectMember, User, Task, TaskHistory
+from crud import (
+    IN_CHUNK, now_ts, bulk_insert_tasks_stmt, search_rows, group_by_status, save_workflow
+)
+from workflows import DEFAULT_WORKFLOW, get_workflow, get_workflow_async
+import crud_async
+
+# Project backup/migration. Exports stream from one read transaction in fixed-size partitions
+# (constant memory); NDJSON carries everything, with each task followed by its history, so the
+# import only needs the id mapping of the current and previous chunk.
+EXPORT_BATCH = int(os.environ.get("EXPORT_BATCH", IN_CHUNK))
+IMPORT_CHUNK = int(os.environ.get("IMPORT_CHUNK", 1000))
+MAX_IMPORT_LINE = 1024 * 1024
+EXPORT_FORMAT_VERSION = 1
+
+TASK_FIELDS = ("id", "title", "description", "status", "assignee_id", "created_at", "updated_at")
+HISTORY_FIELDS = ("task_id", "from_status", "to_status", "changed_by", "changed_at")
+MEMBER_FIELDS = ("user_id", "username", "role")
+
+def _line(record: dict):
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+# field checks for imported records (bool is an int to Python, never to the schema)
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _opt_int(value):
+    return value is None or _is_int(value)
+
+def _opt_str(value, size: int = None):
+    return value is None or (isinstance(value, str) and (size is None or len(value) <= size))
+
+def _workflow_from_record(record: dict):
+    """(statuses, transitions) of a workflow record, None when its shape is wrong."""
+    statuses, transitions = record.get("statuses"), record.get("transitions")
+    if not isinstance(statuses, list) or not all(
+        isinstance(st, dict) and isinstance(st.get("name"), str) and isinstance(st.get("category"), str)
+        and _opt_int(st.get("wip_limit")) for st in statuses
+    ):
+        return None
+    if transitions is not None and not (isinstance(transitions, dict) and all(
+        isinstance(targets, list) and all(isinstance(t, str) for t in targets) for targets in transitions.values()
+    )):
+        return None
+    return [{"name": st["name"], "category": st["category"], "wip_limit": st.get("wip_limit")} for st in statuses], transitions
+
+def _shares_project_stmt(user_id: int, other_id: int, exclude_project_id: int):
+    mine = aliased(ProjectMember)
+    return (
+        select(ProjectMember.project_id)
+        .join(mine, and_(mine.project_id == ProjectMember.project_id, mine.user_id == user_id))
+        .where(ProjectMember.user_id == other_id, ProjectMember.project_id != exclude_project_id)
+        .limit(1)
+    )
+
+def _members_stmt(project_id: int):
+    return (select(ProjectMember.user_id, User.username, ProjectMember.role)
+            .join(User, User.id == ProjectMember.user_id)
+            .where(ProjectMember.project_id == project_id).order_by(ProjectMember.id))
+
+def _tasks_stmt(project_id: int, batch_size: int):
+    return (select(*(getattr(Task, f) for f in TASK_FIELDS))
+            .where(Task.project_id == project_id).order_by(Task.id)
+            .execution_options(yield_per=batch_size))
+
+def _history_stmt(task_ids: list):
+    return (select(*(getattr(TaskHistory, f) for f in HISTORY_FIELDS))
+            .where(TaskHistory.task_id.in_(task_ids))
+            .order_by(TaskHistory.task_id, TaskHistory.changed_at, TaskHistory.id))
+
+def export_ndjson(project_id: int, batch_size: int = None):
+    """Yields the project as NDJSON chunks: project, members, then every task followed by its history."""
+    batch_size = batch_size or EXPORT_BATCH
+    db = get_session()
+    try:
+        project = db.get(Project, project_id)
+        yield _line({"type": "project", "format": EXPORT_FORMAT_VERSION, "id": project.id, "name": project.name, "exported_at": now_ts()})
+        yield _line({"type": "workflow", **get_workflow(project_id, db).to_dict()})
+        yield "".join(_line({"type": "member", **m._asdict()}) for m in db.execute(_members_stmt(project_id)))
+        for part in db.execute(_tasks_stmt(project_id, batch_size)).partitions():
+            history = {}
+            for h in db.execute(_history_stmt([t.id for t in part])):
+                history.setdefault(h.task_id, []).append(h)
+            out = []
+            for t in part:
+                out.append(_line({"type": "task", **t._asdict()}))
+                out.extend(_line({"type": "history", **h._asdict()}) for h in history.get(t.id, ()))
+            yield "".join(out)
+    finally:
+        db.close()
+
+def export_csv(project_id: int, kind: str = "tasks", batch_size: int = None):
+    """Yields one table of the project (tasks, history or members) as CSV chunks."""
+    batch_size = batch_size or EXPORT_BATCH
+    fields = {"tasks": TASK_FIELDS, "history": HISTORY_FIELDS, "members": MEMBER_FIELDS}[kind]
+    db = get_session()
+    try:
+        if kind == "tasks":
+            stmt = _tasks_stmt(project_id, batch_size)
+        elif kind == "history":
+            stmt = (select(*(getattr(TaskHistory, f) for f in HISTORY_FIELDS))
+                    .join(Task, Task.id == TaskHistory.task_id).where(Task.project_id == project_id)
+                    .order_by(TaskHistory.task_id, TaskHistory.changed_at, TaskHistory.id)
+                    .execution_options(yield_per=batch_size))
+        else:
+            stmt = _members_stmt(project_id).execution_options(yield_per=batch_size)
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(fields)
+        for part in db.execute(stmt).partitions():
+            writer.writerows(part)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        yield buf.getvalue()
+    finally:
+        db.close()
+
+class ImportLineTooLong(ValueError):
+    pass
+
+class ProjectImporter:
+    """Incremental NDJSON import into a new project owned by `owner_id` (async session).
+    Tasks and history are inserted in chunked transactions with remapped ids; source user ids
+    are mapped by username to existing users (unknown ones become null). Only users the importer
+    already shares a project with become members, always with the member role. Records with
+    fields of the wrong type, or statuses outside the project's workflow, count as invalid."""
+    def __init__(self, owner_id: int, db, name: str = None, chunk_size: int = None, on_progress=None):
+        self.owner_id = owner_id
+        self.db = db
+        self.name = name
+        self.chunk_size = chunk_size or IMPORT_CHUNK
+        self.on_progress = on_progress
+        self.project_id = None
+        self.workflow = DEFAULT_WORKFLOW
+        self.users = {}
+        self.members = set()
+        self.tasks, self.history = [], []
+        self.previous_ids = {}
+        self.buffer = b""
+        self.lineno = 0
+        self.counts = {"members": 0, "tasks": 0, "history": 0}
+        self.skipped = {"invalid": 0, "unknown_members": 0, "unshared_members": 0, "orphan_history": 0}
+        self.invalid_lines = []
+
+    async def feed(self, chunk: bytes):
+        """Consume a piece of the body; complete lines are parsed right away."""
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split(b"\n")
+        for line in lines:
+            await self._line(line)
+        if len(self.buffer) > MAX_IMPORT_LINE:
+            raise ImportLineTooLong(f"line {self.lineno + 1} longer than {MAX_IMPORT_LINE} bytes")
+
+    async def finish(self):
+        if self.buffer:
+            await self._line(self.buffer)
+            self.buffer = b""
+        await self._ensure_project()
+        await self._flush()
+        return self.report()
+
+    def report(self):
+        return {"project_id": self.project_id, **self.counts, "skipped": self.skipped, "invalid_lines": self.invalid_lines}
+
+    async def _line(self, line: bytes):
+        self.lineno += 1
+        if not line.strip():
+            return
+        try:
+            record = json.loads(line)
+            kind = record["type"]
+        except (ValueError, TypeError, KeyError):
+            self._invalid()
+            return
+        if kind == "project" and _opt_str(record.get("name")):
+            self.name = self.name or record.get("name")
+            await self._ensure_project()
+        elif kind == "workflow" and not self.counts["tasks"] and not self.tasks and _workflow_from_record(record):
+            await self._ensure_project()
+            if not await self._workflow(*_workflow_from_record(record)):
+                self._invalid()
+                return
+        elif kind == "member" and _is_int(record.get("user_id")) and isinstance(record.get("username"), str):
+            await self._ensure_project()
+            await self._member(record)
+        elif kind == "task" and self._valid_task(record):
+            await self._ensure_project()
+            self.tasks.append(record)
+        elif kind == "history" and self._valid_history(record):
+            self.history.append(record)
+        else:
+            self._invalid()
+            return
+        if len(self.tasks) + len(self.history) >= self.chunk_size:
+            await self._flush()
+
+    def _valid_status(self, status):
+        return isinstance(status, str) and len(status) <= 50 and self.workflow.has(status)
+
+    def _valid_task(self, t: dict):
+        return (_is_int(t.get("id")) and isinstance(t.get("title"), str) and t["title"].strip()
+                and _opt_str(t.get("description")) and (t.get("status") is None or self._valid_status(t["status"]))
+                and all(_opt_int(t.get(f)) for f in ("assignee_id", "created_at", "updated_at")))
+
+    def _valid_history(self, h: dict):
+        return (_is_int(h.get("task_id")) and self._valid_status(h.get("from_status")) and self._valid_status(h.get("to_status"))
+                and _opt_int(h.get("changed_by")) and _opt_int(h.get("changed_at")))
+
+    def _invalid(self):
+        self.skipped["invalid"] += 1
+        if len(self.invalid_lines) < 20:
+            self.invalid_lines.append(self.lineno)
+
+    async def _ensure_project(self):
+        if self.project_id is not None:
+            return
+        db = self.db
+        p = Project(name=(self.name or "Imported project")[:200], owner_id=self.owner_id)
+        db.add(p)
+        await db.flush()
+        db.add(ProjectMember(project_id=p.id, user_id=self.owner_id, role="owner"))
+        await crud_async.bump_version("user", self.owner_id, db=db)
+        await db.commit()
+        self.project_id = p.id
+
+    async def _workflow(self, statuses: list, transitions: dict):
+        res = await self.db.run_sync(lambda db: save_workflow(self.project_id, statuses, transitions, db=db))
+        if res["ok"]:
+            self.workflow = await get_workflow_async(self.project_id, self.db)
+        return res["ok"]
+
+    async def _member(self, record: dict):
+        db = self.db
+        user_id = (await db.execute(select(User.id).where(User.username == record.get("username")))).scalar()
+        if user_id is None:
+            self.skipped["unknown_members"] += 1
+            return
+        self.users[record.get("user_id")] = user_id
+        if user_id == self.owner_id or user_id in self.members:
+            return
+        # a file cannot grant access to strangers (or ownership to anyone)
+        if (await db.execute(_shares_project_stmt(self.owner_id, user_id, self.project_id))).first() is None:
+            self.skipped["unshared_members"] += 1
+            return
+        self.members.add(user_id)
+        db.add(ProjectMember(project_id=self.project_id, user_id=user_id, role="member"))
+        await crud_async.bump_version("user", user_id, db=db)
+        await db.commit()
+        self.counts["members"] += 1
+
+    async def _flush(self):
+        if not self.tasks and not self.history:
+            return
+        db, pid, ts = self.db, self.project_id, now_ts()
+        ids = {}
+        if self.tasks:
+            rows = [{
+                "project_id": pid, "title": t["title"][:300], "description": t.get("description") or "",
+                "status": t.get("status") or self.workflow.initial, "assignee_id": self.users.get(t.get("assignee_id")),
+                "created_at": t.get("created_at") or ts, "updated_at": t.get("updated_at") or ts,
+            } for t in self.tasks]
+            new_ids = (await db.scalars(bulk_insert_tasks_stmt(), rows)).all()
+            ids = {t["id"]: new for t, new in zip(self.tasks, new_ids)}
+            await crud_async.index_tasks(search_rows(new_ids, rows), db=db)
+            for status, task_ids in group_by_status({new: r["status"] for new, r in zip(new_ids, rows)}).items():
+                await crud_async.bump_status_count(pid, status, len(task_ids), db=db)
+        # history follows its task, so it refers to this chunk or (across a boundary) the previous one
+        history = []
+        for h in self.history:
+            task_id = ids.get(h["task_id"]) or self.previous_ids.get(h["task_id"])
+            if task_id is None:
+                self.skipped["orphan_history"] += 1
+                continue
+            history.append({"task_id": task_id, "from_status": h.get("from_status"), "to_status": h.get("to_status"),
+                            "changed_by": self.users.get(h.get("changed_by")), "changed_at": h.get("changed_at") or ts})
+        if history:
+            await db.execute(insert(TaskHistory), history)
+        await crud_async.bump_version("project", pid, db=db)
+        await db.commit()
+        self.counts["tasks"] += len(self.tasks)
+        self.counts["history"] += len(history)
+        self.tasks, self.history = [], []
+        if ids:
+            self.previous_ids = ids
+        if self.on_progress is not None:
+            self.on_progress(self.report())
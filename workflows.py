@@ -0,0 +1,178 @@
+from sqlalchemy import select, event
+from sqlalchemy.orm import Session
+from collections import OrderedDict
+from dataclasses import dataclass
+import threading
+import time
+import os
+from db import WorkflowStatus, WorkflowTransition
+
+# Per-project workflows: statuses, allowed transitions and WIP limits. They are stored in two small
+# tables and compiled into an immutable Workflow cached per process, so validating a move is a
+# dict/set lookup. Saving a workflow invalidates the local cache on commit; the TTL bounds
+# staleness across workers.
+WORKFLOW_CACHE_TTL = float(os.environ.get("WORKFLOW_CACHE_TTL", 30))
+WORKFLOW_CACHE_SIZE = int(os.environ.get("WORKFLOW_CACHE_SIZE", 10000))
+MAX_WORKFLOW_STATUSES = 30
+# every status belongs to a category; analytics starts cycle time at "doing" and completes at "done"
+CATEGORIES = ("todo", "doing", "done")
+
+@dataclass(frozen=True)
+class Workflow:
+    statuses: tuple       # in board order; the first one is where new tasks start
+    categories: dict      # status -> category
+    wip_limits: dict      # status -> max tasks in it (only limited statuses)
+    targets: dict         # status -> frozenset of statuses it may move to
+
+    @property
+    def initial(self):
+        return self.statuses[0]
+
+    def has(self, status: str):
+        return status in self.categories
+
+    def allows(self, from_status: str, to_status: str):
+        # staying put is always allowed, and a task left in a status the workflow no longer
+        # has (e.g. imported) may move anywhere
+        return from_status == to_status or to_status in self.targets.get(from_status, self.categories)
+
+    def statuses_in(self, category: str):
+        return [s for s in self.statuses if self.categories[s] == category]
+
+    def to_dict(self):
+        return {
+            "statuses": [{"name": s, "category": self.categories[s], "wip_limit": self.wip_limits.get(s)} for s in self.statuses],
+            "transitions": {s: [t for t in self.statuses if t in self.targets[s]] for s in self.statuses},
+        }
+
+def compile_workflow(statuses, transitions=None):
+    """statuses: (name, category, wip_limit) rows in order; transitions: (from, to) pairs, None
+    allows every move."""
+    names = tuple(s[0] for s in statuses)
+    if transitions is None:
+        transitions = [(a, b) for a in names for b in names if a != b]
+    targets = {}
+    for a, b in transitions:
+        targets.setdefault(a, set()).add(b)
+    return Workflow(
+        statuses=names,
+        categories={name: category for name, category, _ in statuses},
+        wip_limits={name: limit for name, _, limit in statuses if limit is not None},
+        targets={name: frozenset(targets.get(name, ())) for name in names},
+    )
+
+DEFAULT_WORKFLOW = compile_workflow([("todo", "todo", None), ("doing", "doing", None), ("done", "done", None)])
+DEFAULT_STATUSES = DEFAULT_WORKFLOW.statuses
+
+def validate_workflow(statuses: list, transitions: dict = None):
+    """Error message for a workflow definition, None when it is valid. statuses are dicts with
+    name/category/wip_limit; transitions maps a status to the statuses it may move to."""
+    if not statuses:
+        return "a workflow needs at least one status"
+    if len(statuses) > MAX_WORKFLOW_STATUSES:
+        return f"at most {MAX_WORKFLOW_STATUSES} statuses"
+    names = [s["name"] for s in statuses]
+    for s in statuses:
+        if not s["name"] or len(s["name"]) > 50:
+            return "status names must have 1 to 50 characters"
+        if s["category"] not in CATEGORIES:
+            return f"invalid category for {s['name']!r} (expected one of {', '.join(CATEGORIES)})"
+        if s.get("wip_limit") is not None and s["wip_limit"] < 1:
+            return f"invalid WIP limit for {s['name']!r}"
+    if len(set(names)) != len(names):
+        return "duplicate status names"
+    for a, targets in (transitions or {}).items():
+        unknown = [x for x in (a, *targets) if x not in names]
+        if unknown:
+            return f"unknown status {unknown[0]!r} in transitions"
+    return None
+
+def status_rows_stmt(project_id: int):
+    return (select(WorkflowStatus.name, WorkflowStatus.category, WorkflowStatus.wip_limit)
+            .where(WorkflowStatus.project_id == project_id).order_by(WorkflowStatus.position))
+
+def transition_rows_stmt(project_id: int):
+    return (select(WorkflowTransition.from_status, WorkflowTransition.to_status)
+            .where(WorkflowTransition.project_id == project_id))
+
+def _compile_rows(status_rows, transition_rows):
+    if not status_rows:
+        return DEFAULT_WORKFLOW
+    return compile_workflow([tuple(r) for r in status_rows], [tuple(r) for r in transition_rows])
+
+class WorkflowCache:
+    """Bounded per-process cache of project id -> compiled Workflow."""
+    def __init__(self, maxsize: int = WORKFLOW_CACHE_SIZE, ttl: float = WORKFLOW_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # bumped by every invalidation, so a workflow loaded before a concurrent save is not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, project_id: int):
+        with self.lock:
+            entry = self.entries.get(project_id)
+            if entry is None or entry[1] <= time.monotonic():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(project_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, project_id: int, workflow: Workflow, generation: int):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[project_id] = (workflow, time.monotonic() + self.ttl)
+            self.entries.move_to_end(project_id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, project_ids):
+        with self.lock:
+            self.generation += 1
+            for project_id in project_ids:
+                self.entries.pop(project_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "maxsize": self.maxsize, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses}
+
+workflow_cache = WorkflowCache()
+
+def track_workflow_change(db, project_id: int):
+    # the cached workflow is dropped once the caller's transaction commits
+    db.info.setdefault("touched_workflows", set()).add(project_id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_workflows(session):
+    touched = session.info.pop("touched_workflows", None)
+    if touched:
+        workflow_cache.invalidate(touched)
+
+def get_workflow(project_id: int, db):
+    workflow = workflow_cache.get(project_id)
+    if workflow is None:
+        generation = workflow_cache.generation
+        workflow = _compile_rows(db.execute(status_rows_stmt(project_id)).all(),
+                                 db.execute(transition_rows_stmt(project_id)).all())
+        workflow_cache.put(project_id, workflow, generation)
+    return workflow
+
+async def get_workflow_async(project_id: int, db):
+    workflow = workflow_cache.get(project_id)
+    if workflow is None:
+        generation = workflow_cache.generation
+        workflow = _compile_rows((await db.execute(status_rows_stmt(project_id))).all(),
+                                 (await db.execute(transition_rows_stmt(project_id))).all())
+        workflow_cache.put(project_id, workflow, generation)
+    return workflow